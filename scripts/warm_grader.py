@@ -0,0 +1,36 @@
+"""Waits for a grader to run, so that its interpreter and sandbox are ready beforehand.
+
+Tin keeps a few of these running when ``GRADER_POOL_ENABLED`` is set. Each one
+runs a single grader, sent as a line of JSON on stdin::
+
+    {"argv": ["grader.py", ...], "cwd": "/path/to/assignment"}
+"""
+
+import json
+import os
+import runpy
+import subprocess  # noqa: F401  # every grader runs the submission with it
+import sys
+
+
+def main() -> None:
+    line = sys.stdin.readline()
+    if not line:
+        # the pool was shut down before a grader came along
+        return
+    job = json.loads(line)
+
+    # graders get no stdin, like when they're started directly
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = open(os.devnull, encoding="utf-8")
+
+    os.chdir(job["cwd"])
+    sys.argv = job["argv"]
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ from .models import (
     MossResult,
     Quiz,
     QuizLogMessage,
+    QuizState,
     SubmissionCap,
 )
 
@@ -136,6 +137,14 @@ class QuizLogMessageAdmin(admin.ModelAdmin):
     autocomplete_fields = ("assignment", "student")
 
 
+@admin.register(QuizState)
+class QuizStateAdmin(admin.ModelAdmin):
+    list_display = ("assignment", "student", "severity", "ended")
+    list_filter = ("ended",)
+    search_fields = ("assignment__name", "student__username")
+    autocomplete_fields = ("assignment", "student")
+
+
 @admin.register(MossResult)
 class MossResultAdmin(admin.ModelAdmin):
     date_hierarchy = "date"
@@ -85,6 +85,7 @@ class AssignmentForm(forms.ModelForm):
             "grader_timeout",
             "grader_has_network_access",
             "has_network_access",
+            "cache_grader_results",
             "submission_limit_count",
             "submission_limit_interval",
             "submission_limit_cooldown",
@@ -102,6 +103,7 @@ class AssignmentForm(forms.ModelForm):
             "grader_timeout": "Grader timeout (seconds):",
             "grader_has_network_access": "Give the grader internet access?",
             "has_network_access": "Give submissions internet access?",
+            "cache_grader_results": "Reuse the results of identical submissions?",
             "submission_limit_count": "Rate limit count",
             "submission_limit_interval": "Rate limit interval (minutes)",
             "submission_limit_cooldown": "Rate limit cooldown period (minutes)",
@@ -153,6 +155,7 @@ class AssignmentForm(forms.ModelForm):
                     "grader_timeout",
                     "has_network_access",
                     "grader_has_network_access",
+                    "cache_grader_results",
                     "submission_limit_count",
                     "submission_limit_interval",
                     "submission_limit_cooldown",
@@ -172,6 +175,9 @@ class AssignmentForm(forms.ModelForm):
             'internet access" below. If set, it increases the amount '
             "of time it takes to start up the grader (to about 1.5 "
             "seconds). This is not recommended unless necessary.",
+            "cache_grader_results": "If set, a submission identical to one graded before (with the "
+            "same grader, files and settings) gets the same result without running the grader. "
+            "Only use this if the grader always gives the same result for the same code.",
             "submission_cap": "The maximum number of submissions that can be made, or empty for unlimited.",
             "submission_cap_after_due": "The maximum number of submissions that can be made after the due date.",
             "submission_limit_count": "",
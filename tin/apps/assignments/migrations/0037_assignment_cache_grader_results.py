@@ -0,0 +1,18 @@
+# Generated by Django 5.2.12 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assignments', '0036_fileaction_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='cache_grader_results',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.12 on 2026-10-18 08:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def create_quiz_states(apps, schema_editor):
+    """Sum up the existing quiz log messages of each student into a :class:`.QuizState`."""
+    QuizLogMessage = apps.get_model("assignments", "QuizLogMessage")
+    QuizState = apps.get_model("assignments", "QuizState")
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        QuizLogMessage.objects.using(db_alias)
+        .order_by()
+        .values("assignment_id", "student_id")
+        .annotate(severity=Sum("severity"), ended=Count("id", filter=Q(content="Ended quiz")))
+    )
+    QuizState.objects.using(db_alias).bulk_create(
+        (
+            QuizState(
+                assignment_id=total["assignment_id"],
+                student_id=total["student_id"],
+                severity=total["severity"],
+                ended=total["ended"] > 0,
+            )
+            for total in totals
+        ),
+        batch_size=1000,
+    )
+
+
+# fmt: off
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assignments', '0037_assignment_cache_grader_results'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('severity', models.IntegerField(default=0)),
+                ('ended', models.BooleanField(default=False)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_states', to='assignments.assignment')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('assignment', 'student'), name='unique_quiz_state')],
+            },
+        ),
+        migrations.RunPython(create_quiz_states, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 import datetime
+import hashlib
+import json
 import logging
 import os
 import shlex
 import subprocess
+from decimal import Decimal
 from pathlib import Path
 from typing import Literal
 
@@ -11,12 +14,14 @@ from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Exists, F, OuterRef, Q
 from django.urls import reverse
 from django.utils import timezone
 
-from ...sandboxing import get_action_sandbox_args, get_assignment_sandbox_args
+from ...sandboxing import get_action_sandbox_args
+from ..courses.membership import enrolled_course_ids, taught_course_ids
 from ..courses.models import Course, Period
+from ..submissions import files
 from ..submissions.models import Submission
 from ..venvs.models import Venv
 
@@ -63,9 +68,11 @@ class AssignmentQuerySet(models.query.QuerySet):
             perm_q = Q(course__archived=False)
             for perm in perms:
                 perm_q |= Q(course__permission=perm)
-            q = Q(course__teacher=user) | (Q(course__students=user, hidden=False) & perm_q)
+            q = Q(course_id__in=taught_course_ids(user)) | (
+                Q(course_id__in=enrolled_course_ids(user), hidden=False) & perm_q
+            )
 
-            return self.filter(q).distinct()
+            return self.filter(q)
 
     def filter_visible(self, user):
         r"""Filters assignments that are visible to a user
@@ -85,12 +92,18 @@ class AssignmentQuerySet(models.query.QuerySet):
         """
         return self.filter_permissions(user, "w")
 
+    def filter_unsubmitted(self, student):
+        """Filters assignments the student hasn't submitted anything to."""
+        return self.filter(
+            ~Exists(Submission.objects.filter(assignment=OuterRef("pk"), student=student))
+        )
+
     def filter_editable(self, user):
         """Filters assignments if they're editable by the user"""
         if user.is_superuser:
             return self.all()
         else:
-            return self.filter(course__teacher=user).distinct()
+            return self.filter(course_id__in=taught_course_ids(user))
 
 
 def upload_grader_file_path(assignment, _):  # pylint: disable=unused-argument
@@ -161,6 +174,9 @@ class Assignment(models.Model):
 
     has_network_access = models.BooleanField(default=False)
 
+    # Only for graders that always give the same result for the same submission
+    cache_grader_results = models.BooleanField(default=False)
+
     # WARNING: this is the rate limit
     submission_limit_count = models.PositiveIntegerField(
         default=90,
@@ -266,8 +282,7 @@ class Assignment(models.Model):
 
     def make_assignment_dir(self) -> None:
         """Creates the directory where the assignment grader scripts go."""
-        assignment_path = os.path.join(settings.MEDIA_ROOT, f"assignment-{self.id}")
-        os.makedirs(assignment_path, exist_ok=True)
+        files.make_dirs(f"assignment-{self.id}")
 
     def grader_exists(self) -> bool:
         """Check if a grader file exists."""
@@ -277,46 +292,63 @@ class Assignment(models.Model):
         fpath = Path(settings.MEDIA_ROOT) / self.grader_file.name
         return fpath.exists()
 
+    def grader_version(self) -> str:
+        """Get a digest of everything about the assignment that goes into grading.
+
+        That is the grader (by its contents), the assignment's other files (by their
+        names, sizes and modification times), the packages in its virtual environment,
+        and the settings that affect grading. Submissions record the version they were
+        graded with in :attr:`.Submission.grader_version`.
+        """
+        digest = hashlib.sha256()
+
+        def add(value) -> None:
+            data = value if isinstance(value, bytes) else str(value).encode()
+            # prefix the length, so that values can't run together
+            digest.update(len(data).to_bytes(8) + data)
+
+        if self.grader_exists():
+            add((Path(settings.MEDIA_ROOT) / self.grader_file.name).read_bytes())
+        else:
+            add(b"")
+
+        for setting in (
+            self.grader_language,
+            json.dumps(self.language_details.info, sort_keys=True),
+            self.filename,
+            # the same whether it was just assigned or loaded from the database
+            Decimal(self.points_possible).normalize(),
+            self.enable_grader_timeout,
+            self.grader_timeout,
+            self.grader_has_network_access,
+            self.has_network_access,
+        ):
+            add(setting)
+
+        for _, name, _, size, modified in sorted(self.list_files(), key=lambda f: f[1]):
+            add(f"{name} {size} {modified.isoformat()}")
+
+        if self.venv_fully_created:
+            add(self.venv.path)
+            for package in sorted(
+                path.name for path in Path(self.venv.path).glob("lib/*/site-packages/*.dist-info")
+            ):
+                add(package)
+
+        return digest.hexdigest()
+
     def save_grader_file(self, grader_text: str) -> None:
         """Save the grader file to the correct location.
 
-        .. warning::
-
-            Writing to files in directories not controlled by us without some
-            form of sandboxing is a security risk. Most notably, users can use symbolic
-            links to trick you into writing to another file, outside the directory.
-            they control.
-            This solution is very hacky, but we don't have another good way of
-            doing this.
+        The file is written with :func:`.files.write_file`, so that symbolic links
+        left in the assignment's directory can't redirect it elsewhere.
         """
         fname = upload_grader_file_path(self, "")
 
         self.grader_file.name = fname
         self.save()
 
-        fpath = os.path.join(settings.MEDIA_ROOT, self.grader_file.name)
-
-        os.makedirs(os.path.dirname(fpath), exist_ok=True)
-
-        args = get_assignment_sandbox_args(
-            ["sh", "-c", 'cat >"$1"', "sh", fpath],
-            network_access=False,
-            whitelist=[os.path.dirname(fpath)],
-        )
-
-        try:
-            subprocess.run(
-                args,
-                input=grader_text,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                encoding="utf-8",
-                text=True,
-                check=True,
-            )
-        except FileNotFoundError as e:
-            logger.error("Cannot run processes: %s", e)
-            raise FileNotFoundError from e
+        files.write_file(fname, grader_text)
 
     def list_files(self) -> list[tuple[int, str, str, int, datetime.datetime]]:
         """List all files in the assignments directory
@@ -353,34 +385,7 @@ class Assignment(models.Model):
 
     def save_file(self, file_text: str | bytes, file_name: str) -> None:
         """Save some text as a file"""
-        self.make_assignment_dir()
-
-        fpath = os.path.join(settings.MEDIA_ROOT, f"assignment-{self.id}", file_name)
-
-        os.makedirs(os.path.dirname(fpath), exist_ok=True)
-
-        args = get_assignment_sandbox_args(
-            ["sh", "-c", 'cat >"$1"', "sh", fpath],
-            network_access=False,
-            whitelist=[os.path.dirname(fpath)],
-        )
-        kwargs = {}
-        if isinstance(file_text, str):
-            kwargs["text"] = True
-            kwargs["encoding"] = "utf-8"
-
-        try:
-            subprocess.run(
-                args,
-                input=file_text,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                check=True,
-                **kwargs,
-            )
-        except FileNotFoundError as e:
-            logger.error("Cannot run processes: %s", e)
-            raise FileNotFoundError from e
+        files.write_file(f"assignment-{self.id}/{file_name}", file_text)
 
     def get_file(self, file_id: int) -> tuple[str, str]:
         self.make_assignment_dir()
@@ -433,25 +438,100 @@ class Assignment(models.Model):
 
     def quiz_open_for_student(self, student):
         """Check if a quiz is open for a specific student"""
-        is_teacher = self.course.teacher.filter(id=student.id).exists()
-        if is_teacher or student.is_superuser:
+        if self.course.is_teacher_in_course(student) or student.is_superuser:
             return True
-        return not (self.quiz_ended_for_student(student) or self.quiz_locked_for_student(student))
+        state = self.quiz_state_for_student(student)
+        return not (state.ended or state.locked)
+
+    def quiz_state_for_student(self, student) -> QuizState:
+        """Get a student's :class:`.QuizState`.
+
+        If they haven't started the quiz, it is a new (unsaved) one.
+        """
+        state = self.quiz_states.filter(student=student).first()
+        if state is None:
+            state = QuizState(student=student)
+        state.assignment = self
+        return state
 
     def quiz_ended_for_student(self, student) -> bool:
         """Check if the quiz has ended for a student"""
-        return self.log_messages.filter(student=student, content="Ended quiz").exists()
+        return self.quiz_state_for_student(student).ended
 
     def quiz_locked_for_student(self, student) -> bool:
         """Check if the quiz has been locked (e.g. due to leaving the tab)"""
-        return self.quiz_issues_for_student(student) and self.quiz_action == "2"
+        return self.quiz_state_for_student(student).locked
 
     def quiz_issues_for_student(self, student) -> bool:
         """Check if the student has exceeded the maximum amount of issues they can have with a quiz."""
-        return (
-            sum(lm.severity for lm in self.log_messages.filter(student=student))
-            >= settings.QUIZ_ISSUE_THRESHOLD
-        )
+        return self.quiz_state_for_student(student).has_issues
+
+    def quiz_statuses_for_students(self, students) -> dict[int, tuple[bool, bool]]:
+        """Check if the quiz has ended or been locked for many students at once.
+
+        This takes a single query, instead of calling :meth:`quiz_ended_for_student`
+        and :meth:`quiz_locked_for_student` for every student.
+
+        Returns:
+            A dict mapping each student's id to ``(ended, locked)``. Students who
+            haven't started the quiz are left out.
+        """
+        statuses = {}
+        for state in self.quiz_states.filter(student__in=students):
+            state.assignment = self
+            statuses[state.student_id] = (state.ended, state.locked)
+        return statuses
+
+    def log_quiz_message(self, student, content: str, severity: int) -> QuizState:
+        """Log a quiz message for a student, unless they have ended the quiz.
+
+        See :meth:`log_quiz_messages`.
+        """
+        return self.log_quiz_messages(student, [(content, severity)])
+
+    def log_quiz_messages(self, student, messages: list[tuple[str, int]]) -> QuizState:
+        """Log many quiz messages for a student at once, unless they have ended the quiz.
+
+        Their :class:`.QuizState` is updated in the same transaction, so it always
+        matches their log messages. This takes the same few queries no matter how
+        many messages there are. Messages after the one ending the quiz are dropped.
+
+        Args:
+            student: The student taking the quiz
+            messages: The ``(content, severity)`` of each message, in order
+
+        Returns:
+            The student's :class:`.QuizState`, after the messages were logged.
+        """
+        for i, (content, _) in enumerate(messages):
+            if content == QuizState.ENDED_MESSAGE:
+                messages = messages[: i + 1]
+                break
+
+        with transaction.atomic():
+            state, _ = QuizState.objects.get_or_create(assignment=self, student=student)
+            if messages and not state.ended:
+                logged = QuizState.objects.filter(pk=state.pk, ended=False).update(
+                    severity=F("severity") + sum(severity for _, severity in messages),
+                    ended=messages[-1][0] == QuizState.ENDED_MESSAGE,
+                )
+                if logged:
+                    QuizLogMessage.objects.bulk_create(
+                        QuizLogMessage(
+                            assignment=self, student=student, content=content, severity=severity
+                        )
+                        for content, severity in messages
+                    )
+                state.refresh_from_db(fields=["severity", "ended"])
+
+        state.assignment = self
+        return state
+
+    def clear_quiz_messages(self, student) -> None:
+        """Delete a student's quiz log messages, which restarts the quiz for them."""
+        with transaction.atomic():
+            self.log_messages.filter(student=student).delete()
+            self.quiz_states.filter(student=student).delete()
 
 
 class SubmissionCap(models.Model):
@@ -620,6 +700,66 @@ class QuizLogMessage(models.Model):
         return reverse("assignments:student_submission", args=(self.assignment.id, self.student.id))
 
 
+class QuizState(models.Model):
+    """A student's progress through a quiz.
+
+    This sums up their log messages (see :class:`QuizLogMessage`), so that whether the
+    quiz has ended or been locked can be checked without going through all of them.
+    It is updated by :meth:`.Assignment.log_quiz_message`.
+    """
+
+    #: The message logged when a student ends the quiz
+    ENDED_MESSAGE = "Ended quiz"
+
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name="quiz_states")
+    student = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="quiz_states"
+    )
+
+    # The total severity of the student's log messages
+    severity = models.IntegerField(default=0)
+    ended = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                name="unique_quiz_state",
+                fields=["assignment", "student"],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.student} on {self.assignment}"
+
+    def __repr__(self):
+        return f"<QuizState: {self.student} on {self.assignment}>"
+
+    @property
+    def has_issues(self) -> bool:
+        """Whether the student has had as many issues as they are allowed."""
+        return self.severity >= settings.QUIZ_ISSUE_THRESHOLD
+
+    @property
+    def report_action(self) -> Literal["no action", "color", "lock"]:
+        """What the quiz page should do, after reporting a message to the server."""
+        if self.ended or not self.has_issues:
+            return "no action"
+        if self.assignment.quiz_action == "1":
+            return "color"
+        if self.assignment.quiz_action == "2":
+            return "lock"
+        return "no action"
+
+    @property
+    def locked(self) -> bool:
+        """Whether the quiz is locked for the student, because of their issues.
+
+        This depends on the assignment's :attr:`~.Assignment.quiz_action`, so that
+        changing it applies to students who already had issues.
+        """
+        return self.has_issues and self.assignment.quiz_action == "2"
+
+
 def moss_base_file_path(obj, _):  # pylint: disable=unused-argument
     assert obj.assignment.id is not None
     return f"assignment-{obj.assignment.id}/moss-{obj.id}/base.{obj.extension}"
@@ -1,11 +1,16 @@
+import contextlib
 import logging
 import os
+import shutil
+import time
 
 import mosspy
 from celery import shared_task
+from django.conf import settings
 
-from ..submissions.models import PublishedSubmission, Submission
-from .models import MossResult
+from ..courses.models import Period
+from ..submissions.utils import iter_submissions_zip
+from .models import Assignment, MossResult
 
 logger = logging.getLogger(__name__)
 
@@ -33,19 +38,19 @@ def run_moss(moss_result_id):
     moss_result.status = "Collecting student code..."
     moss_result.save()
 
-    for student in students:
-        submissions = Submission.objects.filter(student=student, assignment=assignment)
-        latest_submission = submissions.latest() if submissions else None
-        publishes = PublishedSubmission.objects.filter(student=student, assignment=assignment)
-        published_submission = publishes.latest().submission if publishes else latest_submission
-        if published_submission is not None:
-            file_with_header = published_submission.file_text_with_header
-            with open(os.path.join(download_folder, f"{student.username}.{extension}"), "w") as f:
-                f.write(file_with_header)
-            runner.addFile(
-                os.path.join(download_folder, f"{student.username}.{extension}"),
-                f"{student.first_name}_{student.last_name}",
-            )
+    submissions = assignment.submissions.graded_per_student(
+        assignment, students
+    ).with_file_headers()
+
+    for submission in submissions:
+        student = submission.student
+        file_with_header = submission.file_text_with_header
+        with open(os.path.join(download_folder, f"{student.username}.{extension}"), "w") as f:
+            f.write(file_with_header)
+        runner.addFile(
+            os.path.join(download_folder, f"{student.username}.{extension}"),
+            f"{student.first_name}_{student.last_name}",
+        )
 
     moss_result.status = "Uploading code to Moss..."
     moss_result.save()
@@ -60,3 +65,63 @@ def run_moss(moss_result_id):
         moss_result.status = "Connection refused"
     finally:
         moss_result.save()
+
+
+def submission_archives_dir(assignment_id: int) -> str:
+    """The directory that archives built by :func:`build_submissions_archive` are kept in."""
+    return os.path.join(settings.MEDIA_ROOT, "submission-archives", f"assignment-{assignment_id}")
+
+
+#: Left next to an archive by :func:`build_submissions_archive` if it could not be built
+ARCHIVE_FAILED_MARKER = "failed"
+
+
+@shared_task
+def build_submissions_archive(assignment_id, period_id, extension, archive_path):
+    """Build a zip archive of the graded submissions to an assignment on disk.
+
+    The archive only appears at ``archive_path`` once it is complete. If it can't be
+    built, :data:`ARCHIVE_FAILED_MARKER` is written to its directory instead.
+    """
+    partial_path = archive_path + ".part"
+    try:
+        assignment = Assignment.objects.get(id=assignment_id)
+
+        if period_id is not None:
+            students = Period.objects.get(id=period_id).students.all()
+        else:
+            students = assignment.course.students.all()
+
+        submissions = assignment.submissions.graded_per_student(
+            assignment, students
+        ).with_file_headers()
+
+        with open(partial_path, "wb") as f:
+            for chunk in iter_submissions_zip(submissions, extension):
+                f.write(chunk)
+        os.replace(partial_path, archive_path)
+    except Exception:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_path)
+        with open(os.path.join(os.path.dirname(archive_path), ARCHIVE_FAILED_MARKER), "w"):
+            pass
+        raise
+
+
+@shared_task
+def remove_old_submission_archives():
+    """Remove the archives built more than ``SUBMISSION_ARCHIVE_MAX_AGE`` ago.
+
+    Celery beat runs this every hour (see ``CELERY_BEAT_SCHEDULE``).
+    """
+    root = os.path.join(settings.MEDIA_ROOT, "submission-archives")
+    cutoff = time.time() - settings.SUBMISSION_ARCHIVE_MAX_AGE
+    try:
+        assignment_dirs = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+
+    for assignment_dir in assignment_dirs:
+        for entry in os.scandir(assignment_dir.path):
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
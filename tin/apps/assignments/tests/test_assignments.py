@@ -1,10 +1,23 @@
 import csv
 import io
+import os
+import time
+import zipfile
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from tin.tests import is_redirect, login
+from tin.tests import is_redirect, login, read_streaming
+
+from ...submissions.tasks import run_submission
+from ..tasks import (
+    ARCHIVE_FAILED_MARKER,
+    build_submissions_archive,
+    remove_old_submission_archives,
+    submission_archives_dir,
+)
 
 
 @login("teacher")
@@ -48,8 +61,44 @@ def test_assignment_action_rejects_get(client, assignment, url_name):
     assert client.get(reverse(url_name, args=[assignment.id])).status_code == 405
 
 
+@login("teacher")
+def test_rerun_only_stale(
+    client, monkeypatch, django_user_model, course, assignment, student, grading_queue
+):
+    sent = []
+    monkeypatch.setattr(run_submission, "apply_async", lambda args: sent.append(args[0]))
+    assignment.save_grader_file("print('Score: 100%')")
+    other_student = django_user_model.objects.create(username="other", is_student=True)
+    course.students.add(other_student)
+
+    # an older outdated submission doesn't count once there's a current one
+    older = assignment.submissions.create(student=student, complete=True)
+    current = assignment.submissions.create(
+        student=student, complete=True, grader_version=assignment.grader_version()
+    )
+    outdated = assignment.submissions.create(student=other_student, complete=True)
+
+    response = client.post(
+        reverse("assignments:rerun", args=[assignment.id]), {"period": "all", "stale": "1"}
+    )
+    assert is_redirect(response)
+    assert sent == [outdated.id]
+    current.refresh_from_db()
+    outdated.refresh_from_db()
+    older.refresh_from_db()
+    assert current.complete
+    assert older.complete
+    assert not outdated.complete
+    assert outdated.last_run is not None
+
+    # changing an assignment file makes every submission outdated
+    assignment.save_file("data", "input.txt")
+    client.post(reverse("assignments:rerun", args=[assignment.id]), {"period": "all", "stale": "1"})
+    assert sorted(sent) == sorted([outdated.id, outdated.id, current.id])
+
+
 @login("student")
-def test_submit_assignment_with_text(client, assignment):
+def test_submit_assignment_with_text(client, assignment, grading_queue):
     response = client.post(
         reverse("assignments:submit", args=[assignment.id]), {"text": "print('I hate CSS')"}
     )
@@ -59,7 +108,7 @@ def test_submit_assignment_with_text(client, assignment):
 
 
 @login("student")
-def test_submit_assignment_with_file(client, assignment):
+def test_submit_assignment_with_file(client, assignment, grading_queue):
     response = client.post(
         reverse("assignments:submit", args=[assignment.id]),
         {"file": io.BytesIO(b"print('I hate CSS')")},
@@ -75,7 +124,7 @@ def test_csv_of_missing_assignment(client, assignment, student):
     response = client.get(
         reverse("assignments:scores_csv", args=[assignment.id]), {"period": "all"}
     )
-    reader = csv.reader(io.StringIO(response.content.decode("utf-8")))
+    reader = csv.reader(io.StringIO(read_streaming(response).decode("utf-8")))
     next(reader)  # skip row with headers
     row = next(reader)
     assert row is not None
@@ -98,7 +147,7 @@ def test_csv_of_missing_assignment_graded(client, assignment, student):
     response = client.get(
         reverse("assignments:scores_csv", args=[assignment.id]), {"period": "all"}
     )
-    reader = csv.reader(io.StringIO(response.content.decode("utf-8")))
+    reader = csv.reader(io.StringIO(read_streaming(response).decode("utf-8")))
     next(reader)  # skip initial row with headers
     row = next(reader)
     assert row is not None
@@ -108,3 +157,158 @@ def test_csv_of_missing_assignment_graded(client, assignment, student):
     assert float(raw) == max_points
     assert float(final) == max_points
     assert formatted == "150 / 300 (50.00%)"
+
+
+def add_graded_students(assignment, period, django_user_model, count: int) -> None:
+    """Add students to ``period``, each with a published submission and a newer one."""
+    start = django_user_model.objects.count()
+    for i in range(start, start + count):
+        student = django_user_model.objects.create(username=f"gradebook{i}", is_student=True)
+        assignment.course.students.add(student)
+        period.students.add(student)
+
+        published = assignment.submissions.create(
+            student=student, complete=True, has_been_graded=True, points_received=100
+        )
+        published.publish()
+        published.comments.create(
+            author=period.teacher, start_char=0, end_char=1, text="Nice", point_override=5
+        )
+        assignment.submissions.create(student=student, complete=True)
+        assignment.log_quiz_message(student, "Ended quiz", 5)
+
+
+@login("teacher")
+@pytest.mark.parametrize("is_quiz", (False, True))
+def test_show_view_query_count(client, assignment, teacher, django_user_model, is_quiz):
+    assignment.is_quiz = is_quiz
+    assignment.save()
+    period = assignment.course.period_set.create(name="Period 1", teacher=teacher)
+
+    def count_queries() -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(
+                reverse("assignments:show", args=[assignment.id]), {"period": "all"}
+            )
+        assert response.status_code == 200
+        return len(queries)
+
+    add_graded_students(assignment, period, django_user_model, 1)
+    count_queries()  # the first request fills the course membership cache
+    num_queries = count_queries()
+
+    add_graded_students(assignment, period, django_user_model, 10)
+    assert count_queries() == num_queries, "The gradebook should not query once per student"
+
+
+@login("teacher")
+def test_show_view_gradebook(client, quiz, teacher, django_user_model):
+    quiz.quiz_action = "2"
+    quiz.save()
+    period = quiz.course.period_set.create(name="Period 1", teacher=teacher)
+    add_graded_students(quiz, period, django_user_model, 1)
+
+    response = client.get(reverse("assignments:show", args=[quiz.id]), {"period": "all"})
+    rows = {row[0].username: row for row in response.context["students_and_submissions"]}
+    student, periods, latest, graded, ended, locked = next(
+        row for username, row in rows.items() if username.startswith("gradebook")
+    )
+
+    assert periods == [period]
+    assert latest == student.submissions.latest()
+    assert graded == student.final_submissions.get().submission
+    assert graded.is_published
+    assert graded.is_latest_publish
+    assert graded.points == 105
+    assert not latest.is_published
+    assert ended
+    assert locked
+
+
+@login("teacher")
+def test_download_submissions(client, assignment, submission):
+    assignment.filename = "main.py"
+    assignment.save()
+    submission.create_backup_copy("print('Hello World!')")
+
+    response = client.get(
+        reverse("assignments:download_submissions", args=[assignment.id]), {"period": "all"}
+    )
+    assert response.streaming
+
+    with zipfile.ZipFile(io.BytesIO(read_streaming(response))) as zf:
+        assert zf.namelist() == [f"{submission.student.username}.py"]
+        text = zf.read(f"{submission.student.username}.py").decode()
+    assert text.startswith("# Turn-In\n")
+    assert text.endswith("\n\nprint('Hello World!')")
+
+
+@login("teacher")
+def test_download_submissions_in_background(client, assignment, submission):
+    assignment.filename = "main.py"
+    assignment.save()
+    submission.create_backup_copy("print('Hello World!')")
+
+    response = client.get(
+        reverse("assignments:download_submissions", args=[assignment.id]),
+        {"period": "all", "background": "1"},
+    )
+    assert is_redirect(response)
+    archive_url = response.url
+
+    # not built yet: the page waits for it
+    response = client.get(archive_url)
+    assert response.status_code == 200
+    assert response.templates[0].name == "assignments/download_submissions_archive.html"
+
+    # build it the way the worker would
+    archive_id = archive_url.rsplit("/", 1)[-1]
+    build_submissions_archive(
+        assignment.id,
+        None,
+        "py",
+        os.path.join(submission_archives_dir(assignment.id), archive_id, "code.zip"),
+    )
+
+    response = client.get(archive_url)
+    assert response["Content-Disposition"] == 'attachment; filename="code.zip"'
+    with zipfile.ZipFile(io.BytesIO(read_streaming(response))) as zf:
+        assert zf.namelist() == [f"{submission.student.username}.py"]
+
+
+@login("teacher")
+def test_download_submissions_in_background_failed(client, monkeypatch, assignment, submission):
+    def fail(*args):
+        yield b"PK"
+        raise OSError("disk full")
+
+    monkeypatch.setattr("tin.apps.assignments.tasks.iter_submissions_zip", fail)
+
+    response = client.get(
+        reverse("assignments:download_submissions", args=[assignment.id]),
+        {"period": "all", "background": "1"},
+    )
+    archive_url = response.url
+    archive_id = archive_url.rsplit("/", 1)[-1]
+    archive_dir = os.path.join(submission_archives_dir(assignment.id), archive_id)
+    with pytest.raises(OSError, match="disk full"):
+        build_submissions_archive(assignment.id, None, "py", os.path.join(archive_dir, "code.zip"))
+
+    # the partial archive is removed, and the page stops waiting for it
+    assert os.listdir(archive_dir) == [ARCHIVE_FAILED_MARKER]
+    response = client.get(archive_url)
+    assert response.status_code == 200
+    assert response.context["failed"]
+    assert b"could not be prepared" in response.content
+    assert b"http-equiv" not in response.content
+
+
+def test_remove_old_submission_archives(settings, assignment):
+    archives_dir = submission_archives_dir(assignment.id)
+    for name in ("old", "new"):
+        os.makedirs(os.path.join(archives_dir, name, "code.zip.part"))
+    old_time = time.time() - settings.SUBMISSION_ARCHIVE_MAX_AGE - 60
+    os.utime(os.path.join(archives_dir, "old"), (old_time, old_time))
+
+    remove_old_submission_archives()
+    assert os.listdir(archives_dir) == ["new"]
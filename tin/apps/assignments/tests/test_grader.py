@@ -1,5 +1,8 @@
 import io
+import shutil
+from pathlib import Path
 
+import pytest
 from django.conf import settings
 from django.urls import reverse
 
@@ -51,3 +54,17 @@ def test_download_grader(client, assignment):
 def test_grader_save_file(assignment):
     assignment.save_grader_file("print('hello, world')")
     assert assignment.grader_exists()
+
+
+def test_assignment_dir_symlink(assignment, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside")
+    assignment_dir = Path(settings.MEDIA_ROOT) / f"assignment-{assignment.id}"
+    shutil.rmtree(assignment_dir, ignore_errors=True)
+    assignment_dir.symlink_to(outside)
+
+    # the directory isn't followed to somewhere else
+    with pytest.raises(OSError, match=r"Not a directory|symbolic links"):
+        assignment.make_assignment_dir()
+    with pytest.raises(OSError, match=r"Not a directory|symbolic links"):
+        assignment.save_grader_file("print('hello, world')")
+    assert not any(outside.iterdir())
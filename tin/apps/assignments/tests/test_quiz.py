@@ -17,7 +17,7 @@ def test_submit_quiz_as_assignment(client, quiz):
 
 
 @login("student")
-def test_submit_quiz(client, quiz):
+def test_submit_quiz(client, quiz, grading_queue):
     response = client.post(
         reverse("assignments:quiz", args=[quiz.id]), {"text": "print('I hate CSS')"}
     )
@@ -107,3 +107,62 @@ def test_clear_quiz_messages(client, student, quiz):
     response = client.post(reverse("assignments:clear", args=[quiz.id, student.id]))
     assert is_redirect(response)
     assert not quiz.log_messages.exists()
+
+
+@login("student")
+def test_quiz_state(client, quiz, student, django_assert_num_queries):
+    half = settings.QUIZ_ISSUE_THRESHOLD // 2 + 1
+    for _ in range(2):
+        client.get(reverse("assignments:report", args=[quiz.id]), {"severity": half})
+
+    state = quiz.quiz_state_for_student(student)
+    assert state.severity == 2 * half
+    assert state.locked
+    assert not state.ended
+    with django_assert_num_queries(1):
+        assert quiz.quiz_statuses_for_students([student.id]) == {student.id: (False, True)}
+
+    quiz.quiz_action = "1"
+    quiz.save()
+    assert not quiz.quiz_locked_for_student(student), "Only the lock action locks quizzes"
+
+    client.post(reverse("assignments:quiz_end", args=[quiz.id]))
+    assert quiz.quiz_ended_for_student(student)
+    client.get(reverse("assignments:report", args=[quiz.id]), {"severity": half})
+    assert quiz.quiz_state_for_student(student).severity == 2 * half
+    assert quiz.log_messages.count() == 3
+
+
+@login("teacher")
+def test_clear_quiz_state(client, student, quiz):
+    quiz.log_quiz_message(student, "Ended quiz", 0)
+    client.post(reverse("assignments:clear", args=[quiz.id, student.id]))
+    assert not quiz.quiz_states.exists()
+    assert not quiz.quiz_ended_for_student(student)
+
+
+@login("student")
+def test_quiz_report_batch(client, quiz, student, django_assert_max_num_queries):
+    quiz.quiz_action = "1"
+    quiz.save()
+    url = reverse("assignments:report_batch", args=[quiz.id])
+    events = [{"content": "Clicked off browser", "severity": 1}] * 50
+    client.post(url, [], content_type="application/json")
+
+    with django_assert_max_num_queries(12):
+        response = client.post(url, events, content_type="application/json")
+    assert response.json() == {"action": "color"}
+    assert quiz.log_messages.count() == 50
+    assert quiz.quiz_state_for_student(student).severity == 50
+
+    response = client.post(
+        url,
+        [{"content": "Ended quiz", "severity": 0}, {"content": "after", "severity": -100}],
+        content_type="application/json",
+    )
+    assert response.json() == {"action": "no action"}
+    assert quiz.quiz_ended_for_student(student)
+    assert not quiz.log_messages.filter(content="after").exists()
+
+    assert client.post(url, {"content": "hi"}, content_type="application/json").status_code == 400
+    assert client.post(url, "[", content_type="application/json").status_code == 400
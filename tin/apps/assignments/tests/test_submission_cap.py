@@ -9,6 +9,8 @@ from tin.tests import is_redirect, login
 yesterday = timezone.now() - timedelta(days=1)
 tomorrow = timezone.now() + timedelta(days=1)
 
+pytestmark = pytest.mark.usefixtures("grading_queue")
+
 
 @login("student")
 def test_submission_cap(client, assignment):
@@ -51,6 +51,7 @@ urlpatterns = [
     path("<int:assignment_id>/rerun", views.rerun_view, name="rerun"),
     path("<int:assignment_id>/quiz", views.quiz_view, name="quiz"),
     path("<int:assignment_id>/report", views.quiz_report_view, name="report"),
+    path("<int:assignment_id>/report-batch", views.quiz_report_batch_view, name="report_batch"),
     path("<int:assignment_id>/end", views.quiz_end_view, name="quiz_end"),
     path("<int:assignment_id>/clear/<int:user_id>", views.quiz_clear_view, name="clear"),
     path("<int:assignment_id>/scores_csv", views.scores_csv_view, name="scores_csv"),
@@ -59,6 +60,11 @@ urlpatterns = [
         views.download_submissions_view,
         name="download_submissions",
     ),
+    path(
+        "<int:assignment_id>/download_submissions/<uuid:archive_id>",
+        views.download_submissions_archive_view,
+        name="download_submissions_archive",
+    ),
     path("<int:assignment_id>/moss", views.moss_view, name="moss"),
     path("<int:assignment_id>/download_log", views.download_log_view, name="download_log"),
     path("folder/<int:course_id>/<int:folder_id>", views.show_folder_view, name="show_folder"),
@@ -0,0 +1,94 @@
+import csv
+from collections.abc import Iterable, Iterator
+
+from django.db.models import Aggregate, CharField, OuterRef, Subquery, Value
+
+from ..courses.models import Period
+from ..submissions.models import Submission
+
+
+class GroupConcat(Aggregate):
+    """Join strings together, on both SQLite and PostgreSQL."""
+
+    function = "GROUP_CONCAT"
+    output_field = CharField()
+
+    def __init__(self, expression, delimiter: str = ", ", **extra):
+        super().__init__(expression, Value(delimiter), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function="STRING_AGG", **extra_context)
+
+
+class _Echo:
+    """A file that returns what is written to it, for :class:`csv.writer`."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_gradebook_csv(course, assignments: Iterable, students) -> Iterator[str]:
+    """Build a CSV gradebook, yielding it a row at a time.
+
+    There is a row per student and, for each assignment, columns for the raw score,
+    the final score and the formatted grade of the submission that counts (see
+    :meth:`.SubmissionQuerySet.published_or_latest_per_student`). Missing
+    submissions are marked ``M``, and ungraded ones ``NG``.
+
+    Period names are aggregated in SQL, so this takes the same
+    few queries however many students and assignments there are.
+
+    Args:
+        course: The :class:`.Course` the students' periods are in
+        assignments: The assignments to include
+        students: A queryset of the students to include
+    """
+    assignments = list(assignments)
+    assignments_by_id = {assignment.id: assignment for assignment in assignments}
+
+    submissions = (
+        Submission.objects.filter(assignment__in=assignments, student__in=students)
+        .published_or_latest_per_student()
+        .only(
+            "assignment_id",
+            "student_id",
+            "has_been_graded",
+            "points_received",
+            "points_override_total",
+        )
+    )
+    graded_submissions = {}
+    for submission in submissions.iterator():
+        submission.assignment = assignments_by_id[submission.assignment_id]
+        graded_submissions[submission.student_id, submission.assignment_id] = submission
+
+    period_names = (
+        Period.objects.filter(course=course, students=OuterRef("pk"))
+        .order_by()
+        .values("students")
+        .annotate(names=GroupConcat("name"))
+        .values("names")
+    )
+    students = students.annotate(period_names=Subquery(period_names)).order_by(
+        "period_names", "last_name", "first_name"
+    )
+
+    writer = csv.writer(_Echo())
+
+    header = ["Name", "Username", "Period"]
+    for assignment in assignments:
+        prefix = f"{assignment.name}: " if len(assignments) > 1 else ""
+        header += [f"{prefix}Raw Score", f"{prefix}Final Score", f"{prefix}Formatted Grade"]
+    yield writer.writerow(header)
+
+    for student in students.iterator():
+        row = [student.full_name, student.username, student.period_names or ""]
+        for assignment in assignments:
+            submission = graded_submissions.get((student.id, assignment.id))
+            if submission is None:
+                row += ["M", "M", "M"]
+            elif submission.points_received:
+                row += [submission.points_received, submission.points, submission.formatted_grade]
+            else:
+                row += ["NG", "NG", "NG"]
+        yield writer.writerow(row)
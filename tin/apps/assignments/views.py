@@ -1,19 +1,18 @@
-import csv
 import datetime
+import json
 import logging
 import os
 import subprocess
 import uuid
-import zipfile
-from io import BytesIO
 from pathlib import Path
 
-import celery
 from django import http
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Prefetch, QuerySet
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.utils.text import slugify
 from django.utils.timezone import now
 from django.views.decorators.http import require_POST
@@ -21,8 +20,9 @@ from django.views.decorators.http import require_POST
 from ... import sandboxing
 from ..auth.decorators import login_required, teacher_or_superuser_required
 from ..courses.models import Course, Period
+from ..submissions import scheduler
 from ..submissions.models import PublishedSubmission, Submission
-from ..submissions.tasks import run_submission
+from ..submissions.utils import aiter_sync, iter_file_chunks, iter_submissions_zip
 from ..users.models import User
 from .forms import (
     AssignmentForm,
@@ -37,8 +37,21 @@ from .forms import (
     SubmissionCapForm,
     TextSubmissionForm,
 )
-from .models import Assignment, CooldownPeriod, FileAction, QuizLogMessage, SubmissionCap
-from .tasks import run_moss
+from .models import (
+    Assignment,
+    CooldownPeriod,
+    FileAction,
+    QuizLogMessage,
+    QuizState,
+    SubmissionCap,
+)
+from .tasks import (
+    ARCHIVE_FAILED_MARKER,
+    build_submissions_archive,
+    run_moss,
+    submission_archives_dir,
+)
+from .utils import iter_gradebook_csv
 
 logger = logging.getLogger(__name__)
 
@@ -83,7 +96,7 @@ def show_view(request, assignment_id):
                 "latest_submission": latest_submission,
                 "graded_submission": graded_submission,
                 "is_student": course.is_student_in_course(request.user),
-                "is_teacher": request.user in course.teacher.all(),
+                "is_teacher": course.is_teacher_in_course(request.user),
                 "quiz_accessible": quiz_accessible,
                 "within_submission_limit": assignment.within_submission_limit(request.user),
                 "submissions_used": len(submissions),
@@ -112,17 +125,16 @@ def show_view(request, assignment_id):
             )
         elif filter:
             active_period = "filter"
+            has_submissions = Exists(
+                Submission.objects.filter(student=OuterRef("pk"), assignment=assignment)
+            )
             if filter == "no_submissions":
-                student_list = (
-                    course.students.exclude(submissions__assignment=assignment)
-                    .order_by("last_name", "first_name")
-                    .distinct()
+                student_list = course.students.filter(~has_submissions).order_by(
+                    "last_name", "first_name"
                 )
             elif filter == "with_submissions":
-                student_list = (
-                    course.students.filter(submissions__assignment=assignment)
-                    .order_by("last_name", "first_name")
-                    .distinct()
+                student_list = course.students.filter(has_submissions).order_by(
+                    "last_name", "first_name"
                 )
             else:
                 student_list = course.students.all().order_by("last_name", "first_name")
@@ -137,7 +149,7 @@ def show_view(request, assignment_id):
             student_list = course.teacher.all().order_by("last_name", "first_name")
         elif course.period_set.exists():
             if period == "":
-                if request.user in course.teacher.all():
+                if course.is_teacher_in_course(request.user):
                     try:
                         period = (
                             course.period_set.filter(teacher=request.user).order_by("name")[0].id
@@ -159,12 +171,38 @@ def show_view(request, assignment_id):
             active_period = "none"
             student_list = []
 
+        # Load everything the gradebook needs in a fixed number of queries,
+        # rather than a handful for every student
+        if isinstance(student_list, QuerySet):
+            student_list = list(
+                student_list.prefetch_related(
+                    Prefetch(
+                        "periods",
+                        queryset=Period.objects.filter(course=course),
+                        to_attr="course_periods",
+                    )
+                )
+            )
+        student_ids = [student.id for student in student_list]
+
+        student_submissions = assignment.submissions.with_publish_info().with_points()
+        latest_submissions = {
+            submission.student_id: submission
+            for submission in student_submissions.filter(
+                student__in=student_ids
+            ).latest_per_student()
+        }
+        graded_submissions = {
+            submission.student_id: submission
+            for submission in student_submissions.graded_per_student(assignment, student_ids)
+        }
+        if assignment.is_quiz:
+            quiz_statuses = assignment.quiz_statuses_for_students(student_ids)
+
         for student in student_list:
-            period = student.periods.filter(course=assignment.course)
-            submissions = Submission.objects.filter(student=student, assignment=assignment)
-            publishes = PublishedSubmission.objects.filter(student=student, assignment=assignment)
-            latest_submission = submissions.latest() if submissions else None
-            graded_submission = publishes.latest().submission if publishes else latest_submission
+            period = student.course_periods
+            latest_submission = latest_submissions.get(student.id)
+            graded_submission = graded_submissions.get(student.id)
 
             if not assignment.is_quiz:
                 if latest_submission:
@@ -187,8 +225,7 @@ def show_view(request, assignment_id):
                         period,
                         latest_submission,
                         graded_submission,
-                        assignment.quiz_ended_for_student(student),
-                        assignment.quiz_locked_for_student(student),
+                        *quiz_statuses.get(student.id, (False, False)),
                     )
                 )
 
@@ -201,7 +238,7 @@ def show_view(request, assignment_id):
                 os.path.exists(os.path.join(settings.MEDIA_ROOT, assignment.grader_log_filename))
             ),
             "is_student": course.is_student_in_course(request.user),
-            "is_teacher": request.user in course.teacher.all(),
+            "is_teacher": course.is_teacher_in_course(request.user),
             "query": query,
             "filter": filter,
             "period_set": period_set,
@@ -796,7 +833,7 @@ def submit_view(request, assignment_id):
 
                         submission.create_backup_copy(submission_text)
 
-                        run_submission.delay(submission.id)
+                        scheduler.schedule([submission])
                         return redirect("assignments:show", assignment.id)
             else:
                 file_errors = "That file's too large. Are you sure it's a Python program?"
@@ -815,7 +852,7 @@ def submit_view(request, assignment_id):
 
                     submission.create_backup_copy(submission_text)
 
-                    run_submission.delay(submission.id)
+                    scheduler.schedule([submission])
                     return redirect("assignments:show", assignment.id)
                 else:
                     text_errors = "Submission too large"
@@ -841,6 +878,9 @@ def submit_view(request, assignment_id):
 def rerun_view(request, assignment_id):
     """Rerun select submissions
 
+    With ``stale`` set, only the submissions that weren't graded with the
+    assignment's current :meth:`~.Assignment.grader_version` are rerun.
+
     Args:
         request: The request
         assignment_id: The primary key of the :class:`.Assignment`
@@ -860,17 +900,17 @@ def rerun_view(request, assignment_id):
     else:
         raise http.Http404
 
-    submission_reruns = []
+    submissions = assignment.submissions.graded_per_student(assignment, students)
+    if request.POST.get("stale"):
+        # only the ones graded before the grader or assignment last changed
+        submissions = submissions.stale(assignment.grader_version())
+    rerun_ids = submissions.mark_for_rerun()
 
-    for student in students:
-        submissions = Submission.objects.filter(student=student, assignment=assignment)
-        latest_submission = submissions.latest() if submissions else None
-        publishes = PublishedSubmission.objects.filter(student=request.user, assignment=assignment)
-        published_submission = publishes.latest().submission if publishes else latest_submission
-        if published_submission:
-            submission_reruns.append(published_submission.rerun())
-
-    celery.group(submission_reruns).delay()
+    # queued behind students' own submissions
+    scheduler.schedule(
+        Submission.objects.filter(id__in=rerun_ids).select_related("assignment"),
+        lane=scheduler.BULK,
+    )
 
     return redirect("assignments:show", assignment.id)
 
@@ -942,7 +982,7 @@ def quiz_view(request, assignment_id):
 
                     submission.create_backup_copy(submission_text)
 
-                    run_submission.delay(submission.id)
+                    scheduler.schedule([submission])
                     return redirect("assignments:quiz", assignment.id)
                 else:
                     text_errors = "Submission too large"
@@ -961,6 +1001,7 @@ def quiz_view(request, assignment_id):
             "text_form": text_form,
             "text_errors": text_errors,
             "quiz_color": quiz_color,
+            "quiz_report_batch_limit": settings.QUIZ_REPORT_BATCH_LIMIT,
         },
     )
 
@@ -977,32 +1018,65 @@ def quiz_report_view(request, assignment_id):
         Assignment.objects.filter_visible(request.user), id=assignment_id
     )
 
-    content = request.GET.get("content", "")
+    content = request.GET.get("content", "")[: QuizLogMessage._meta.get_field("content").max_length]
+    severity = _clean_quiz_severity(request.GET.get("severity", 0))
+
+    state = assignment.log_quiz_message(request.user, content, severity)
+    return http.JsonResponse({"action": state.report_action})
+
+
+@login_required
+@require_POST
+def quiz_report_batch_view(request, assignment_id):
+    """Allows client-side JavaScript to report many quiz log messages at once
+
+    The body is a JSON list of ``{"content": ..., "severity": ...}`` objects, in the
+    order they happened. The quiz page sends the messages that come up while it is
+    waiting for a response together, so that a burst of them (like from switching
+    windows back and forth) takes a few requests instead of one each.
+
+    Args:
+        request: The request
+        assignment_id: The primary key of the :class:`.Assignment` model
+    """
+    assignment = get_object_or_404(
+        Assignment.objects.filter_visible(request.user), id=assignment_id
+    )
+
+    try:
+        events = json.loads(request.body)
+    except ValueError:
+        return http.HttpResponseBadRequest("Invalid JSON")
+    if (
+        not isinstance(events, list)
+        or len(events) > settings.QUIZ_REPORT_BATCH_LIMIT
+        or not all(isinstance(event, dict) for event in events)
+    ):
+        return http.HttpResponseBadRequest(
+            f"Expected a list of at most {settings.QUIZ_REPORT_BATCH_LIMIT} messages"
+        )
+
+    max_length = QuizLogMessage._meta.get_field("content").max_length
+    messages = [
+        (str(event.get("content", ""))[:max_length], _clean_quiz_severity(event.get("severity", 0)))
+        for event in events
+    ]
+    state = assignment.log_quiz_messages(request.user, messages)
+    return http.JsonResponse({"action": state.report_action})
+
+
+def _clean_quiz_severity(severity) -> int:
+    """Clean up the severity of a quiz log message reported by the quiz page."""
     # Severity is reported by the (student-controlled) quiz monitor, so it must be
     # constrained server-side. Without clamping, a student could send a large
     # negative severity to permanently offset the running total and neuter the
     # lock threshold (see quiz_issues_for_student). Non-integer input previously
     # raised and 500'd; default it to 0 instead.
     try:
-        severity = int(request.GET.get("severity", 0))
+        severity = int(severity)
     except TypeError, ValueError:
         severity = 0
-    severity = max(0, min(severity, settings.QUIZ_ISSUE_THRESHOLD))
-
-    action = "no action"
-
-    if not assignment.quiz_ended_for_student(request.user):
-        QuizLogMessage.objects.create(
-            assignment=assignment, student=request.user, content=content, severity=severity
-        )
-
-        if severity >= settings.QUIZ_ISSUE_THRESHOLD:
-            if assignment.quiz_action == "1":
-                action = "color"
-            elif assignment.quiz_action == "2":
-                action = "lock"
-
-    return http.JsonResponse({"action": action})
+    return max(0, min(severity, settings.QUIZ_ISSUE_THRESHOLD))
 
 
 @login_required
@@ -1018,9 +1092,7 @@ def quiz_end_view(request, assignment_id):
         Assignment.objects.filter_visible(request.user), id=assignment_id
     )
 
-    QuizLogMessage.objects.create(
-        assignment=assignment, student=request.user, content="Ended quiz", severity=0
-    )
+    assignment.log_quiz_message(request.user, QuizState.ENDED_MESSAGE, 0)
 
     return redirect("assignments:show", assignment.id)
 
@@ -1042,7 +1114,7 @@ def quiz_clear_view(request, assignment_id, user_id):
     )
     user = get_object_or_404(get_user_model(), id=user_id)
 
-    assignment.log_messages.filter(student=user).delete()
+    assignment.clear_quiz_messages(user)
 
     return redirect("assignments:student_submission", assignment.id, user.id)
 
@@ -1073,36 +1145,10 @@ def scores_csv_view(request, assignment_id):
     else:
         raise http.Http404
 
-    response = http.HttpResponse(content_type="text/csv")
+    response = http.StreamingHttpResponse(
+        aiter_sync(iter_gradebook_csv(course, [assignment], students)), content_type="text/csv"
+    )
     response["Content-Disposition"] = f"attachment; filename={name}"
-
-    writer = csv.writer(response)
-    writer.writerow(["Name", "Username", "Period", "Raw Score", "Final Score", "Formatted Grade"])
-
-    for student in students.order_by("periods", "last_name", "first_name"):
-        row = [student.full_name, student.username]
-        periods = ", ".join([p.name for p in student.periods.filter(course=assignment.course)])
-        row.append(periods)
-
-        submissions = Submission.objects.filter(student=student, assignment=assignment)
-        latest_submission = submissions.latest() if submissions else None
-        publishes = PublishedSubmission.objects.filter(student=student, assignment=assignment)
-        published_submission = publishes.latest().submission if publishes else latest_submission
-        if published_submission is not None:
-            if published_submission.points_received:
-                row.append(published_submission.points_received)
-                row.append(published_submission.points)
-                row.append(published_submission.formatted_grade)
-            else:
-                row.append("NG")
-                row.append("NG")
-                row.append("NG")
-        else:
-            row.append("M")
-            row.append("M")
-            row.append("M")
-        writer.writerow(row)
-
     return response
 
 
@@ -1135,21 +1181,82 @@ def download_submissions_view(request, assignment_id):
     language = "P" if assignment.filename.endswith(".py") else "J"
     extension = "java" if language == "J" else "py"
 
-    s = BytesIO()
-    with zipfile.ZipFile(s, "w") as zf:
-        for student in students:
-            submissions = Submission.objects.filter(student=student, assignment=assignment)
-            latest_submission = submissions.latest() if submissions else None
-            publishes = PublishedSubmission.objects.filter(student=student, assignment=assignment)
-            published_submission = publishes.latest().submission if publishes else latest_submission
-            if published_submission is not None:
-                file_with_header = published_submission.file_text_with_header
-                zf.writestr(f"{student.username}.{extension}", file_with_header)
-    resp = http.HttpResponse(s.getvalue(), content_type="application/x-zip-compressed")
+    submissions = assignment.submissions.graded_per_student(
+        assignment, students
+    ).with_file_headers()
+
+    # Very large archives are built by a worker instead of tying up this one
+    if (
+        request.GET.get("background")
+        or submissions.count() > settings.SUBMISSION_ARCHIVE_BACKGROUND_THRESHOLD
+    ):
+        archive_id = uuid.uuid4()
+        archive_dir = os.path.join(submission_archives_dir(assignment.id), str(archive_id))
+        os.makedirs(archive_dir)
+        build_submissions_archive.delay(
+            assignment.id,
+            period_obj.id if period != "all" else None,
+            extension,
+            os.path.join(archive_dir, name),
+        )
+        return redirect("assignments:download_submissions_archive", assignment.id, archive_id)
+
+    resp = http.StreamingHttpResponse(
+        aiter_sync(iter_submissions_zip(submissions, extension)),
+        content_type="application/x-zip-compressed",
+    )
     resp["Content-Disposition"] = f"attachment; filename={name}"
     return resp
 
 
+@teacher_or_superuser_required
+def download_submissions_archive_view(request, assignment_id, archive_id):
+    """Download an archive built by :func:`.build_submissions_archive`
+
+    Until the archive is ready, this shows a page that refreshes itself, or an error
+    if the archive could not be built.
+
+    Args:
+        request: The request
+        assignment_id: The primary key of the :class:`.Assignment` model
+        archive_id: The id of the archive
+    """
+    assignment = get_object_or_404(
+        Assignment.objects.filter_editable(request.user), id=assignment_id
+    )
+    archive_dir = os.path.join(submission_archives_dir(assignment.id), str(archive_id))
+
+    try:
+        names = os.listdir(archive_dir)
+    except FileNotFoundError as e:
+        raise http.Http404 from e
+    archives = [name for name in names if name.endswith(".zip")]
+
+    if archives:
+        # not a FileResponse, which daphne would read into memory before sending
+        archive_path = os.path.join(archive_dir, archives[0])
+        response = http.StreamingHttpResponse(
+            aiter_sync(iter_file_chunks(archive_path)),
+            content_type="application/x-zip-compressed",
+        )
+        response["Content-Length"] = os.path.getsize(archive_path)
+        response["Content-Disposition"] = content_disposition_header(
+            as_attachment=True, filename=archives[0]
+        )
+        return response
+
+    return render(
+        request,
+        "assignments/download_submissions_archive.html",
+        {
+            "course": assignment.course,
+            "folder": assignment.folder,
+            "assignment": assignment,
+            "failed": ARCHIVE_FAILED_MARKER in names,
+        },
+    )
+
+
 @teacher_or_superuser_required
 def moss_view(request, assignment_id):
     """Allows teachers to select submissions and send them to Moss.
@@ -1219,7 +1326,7 @@ def download_log_view(request, assignment_id):
     log_file_name = os.path.join(settings.MEDIA_ROOT, assignment.grader_log_filename)
 
     if (
-        request.user not in assignment.course.teacher.all() and not request.user.is_superuser
+        not assignment.course.is_teacher_in_course(request.user) and not request.user.is_superuser
     ) or not os.path.exists(log_file_name):
         raise http.Http404
 
@@ -1277,7 +1384,7 @@ def show_folder_view(request, course_id, folder_id):
         "assignments": assignments,
         "period": course.period_set.filter(students=request.user),
         "is_student": course.is_student_in_course(request.user),
-        "is_teacher": request.user in course.teacher.all(),
+        "is_teacher": course.is_teacher_in_course(request.user),
     }
     if course.is_student_in_course(request.user):
         context["unsubmitted_assignments"] = assignments.exclude(submissions__student=request.user)
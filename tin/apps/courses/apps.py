@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CoursesConfig(AppConfig):
     name = "tin.apps.courses"
+
+    def ready(self):
+        from . import signals  # noqa: F401, PLC0415
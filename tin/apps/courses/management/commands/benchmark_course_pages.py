@@ -0,0 +1,151 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ....assignments.models import Assignment, Language
+from ....submissions.models import Submission
+from ...models import Course, Period
+
+STUDENTS_PER_COURSE = 200
+PERIODS_PER_COURSE = 4
+BATCH_SIZE = 10_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large number of students and assignments, and measure how long the pages "
+        "that list courses, assignments and students take. Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=10_000, help="Students to seed")
+        parser.add_argument("--assignments", type=int, default=2000, help="Assignments to seed")
+        parser.add_argument(
+            "--submissions",
+            type=int,
+            default=10,
+            help="Assignments each student has submitted to",
+        )
+        parser.add_argument("--runs", type=int, default=10, help="Times to load each page")
+
+    def handle(self, *args, **options):
+        # seeded users must not be left in the real cache once they are rolled back
+        with (
+            override_settings(
+                CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+            ),
+            transaction.atomic(),
+        ):
+            cache.clear()
+            course, teacher, student = self.seed(**options)
+            period = course.period_set.first()
+            assignment = course.assignments.first()
+
+            pages = [
+                ("student: courses", student, reverse("courses:index")),
+                ("student: course", student, reverse("courses:show", args=[course.id])),
+                ("teacher: courses", teacher, reverse("courses:index")),
+                ("teacher: students", teacher, reverse("courses:students", args=[course.id])),
+                (
+                    "teacher: period",
+                    teacher,
+                    f"{reverse('courses:students', args=[course.id])}?period={period.id}",
+                ),
+                (
+                    "teacher: assignment",
+                    teacher,
+                    f"{reverse('assignments:show', args=[assignment.id])}?period=all",
+                ),
+            ]
+
+            self.stdout.write(f"{'page':<22} {'queries':>8} {'p50':>10} {'max':>10}")
+            for name, user, url in pages:
+                # not an internal IP, so that the debug toolbar stays out of the timings
+                client = Client(HTTP_HOST="localhost", REMOTE_ADDR="10.0.0.1")
+                client.force_login(user)
+
+                timings = []
+                for _ in range(options["runs"]):
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        timings.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError(f"{url} returned {response.status_code}")
+
+                self.stdout.write(
+                    f"{name:<22} {len(queries):>8} {statistics.median(timings) * 1000:>7.1f} ms "
+                    f"{max(timings) * 1000:>7.1f} ms"
+                )
+
+            transaction.set_rollback(True)
+
+    def seed(self, *, students: int, assignments: int, submissions: int, **_):
+        """Create courses with the students, periods, assignments and submissions."""
+        User = get_user_model()
+        now = timezone.now()
+        num_courses = max(1, students // STUDENTS_PER_COURSE)
+
+        language = Language.objects.create(name="Benchmark", info={}, language="P")
+        teachers = User.objects.bulk_create(
+            User(username=f"benchmark-teacher-{i}", is_teacher=True) for i in range(num_courses)
+        )
+        courses = Course.objects.bulk_create(
+            Course(name=f"Benchmark {i}") for i in range(num_courses)
+        )
+        Course.teacher.through.objects.bulk_create(
+            Course.teacher.through(course=course, user=teacher)
+            for course, teacher in zip(courses, teachers, strict=True)
+        )
+        periods = Period.objects.bulk_create(
+            Period(name=f"Period {i}", course=course, teacher=course_teacher)
+            for course, course_teacher in zip(courses, teachers, strict=True)
+            for i in range(PERIODS_PER_COURSE)
+        )
+        assignment_objs = Assignment.objects.bulk_create(
+            Assignment(
+                name=f"Benchmark {i}",
+                course=courses[i % num_courses],
+                points_possible=10,
+                due=now,
+                language_details=language,
+            )
+            for i in range(assignments)
+        )
+        course_assignments = {course.id: [] for course in courses}
+        for assignment in assignment_objs:
+            course_assignments[assignment.course_id].append(assignment)
+
+        student_objs = User.objects.bulk_create(
+            (User(username=f"benchmark-{i}", is_student=True) for i in range(students)),
+            batch_size=BATCH_SIZE,
+        )
+        enrollments = []
+        period_enrollments = []
+        submission_objs = []
+        for i, student in enumerate(student_objs):
+            course = courses[i % num_courses]
+            enrollments.append(Course.students.through(course=course, user=student))
+            period = periods[(i % num_courses) * PERIODS_PER_COURSE + i % PERIODS_PER_COURSE]
+            period_enrollments.append(Period.students.through(period=period, user=student))
+            submission_objs.extend(
+                Submission(assignment=assignment, student=student, complete=True)
+                for assignment in course_assignments[course.id][:submissions]
+            )
+        Course.students.through.objects.bulk_create(enrollments, batch_size=BATCH_SIZE)
+        Period.students.through.objects.bulk_create(period_enrollments, batch_size=BATCH_SIZE)
+        Submission.objects.bulk_create(submission_objs, batch_size=BATCH_SIZE)
+
+        self.stdout.write(
+            f"Seeded {students} students in {num_courses} courses, {assignments} assignments "
+            f"and {len(submission_objs)} submissions"
+        )
+        return courses[0], teachers[0], student_objs[0]
@@ -0,0 +1,62 @@
+"""Cached sets of the courses each user teaches or is enrolled in.
+
+Checking permissions used to join through the courses' teachers and students on
+every query. Instead, the ids of a user's courses are kept in the cache, and the
+checks filter on them. They are invalidated by ``signals.py`` whenever
+:attr:`.Course.teacher` or :attr:`.Course.students` change, and also expire after
+``COURSE_MEMBERSHIP_CACHE_TIMEOUT`` seconds in case a change was missed.
+"""
+
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+TAUGHT = "taught"
+ENROLLED = "enrolled"
+
+
+def _key(kind: str, user_id: int) -> str:
+    return f"courses:{kind}:{user_id}"
+
+
+def _course_ids(kind: str, user) -> frozenset[int]:
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = _key(kind, user.id)
+    course_ids = cache.get(key)
+    if course_ids is None:
+        from .models import Course  # noqa: PLC0415
+
+        courses = Course.objects.filter(teacher=user) if kind == TAUGHT else user.courses
+        course_ids = frozenset(courses.values_list("id", flat=True))
+        cache.set(key, course_ids, settings.COURSE_MEMBERSHIP_CACHE_TIMEOUT)
+    return course_ids
+
+
+def taught_course_ids(user) -> frozenset[int]:
+    """Get the ids of the courses a user teaches."""
+    return _course_ids(TAUGHT, user)
+
+
+def enrolled_course_ids(user) -> frozenset[int]:
+    """Get the ids of the courses a user is a student in."""
+    return _course_ids(ENROLLED, user)
+
+
+def invalidate(kind: str, user_ids: Iterable[int]) -> None:
+    """Forget the cached course ids of some users.
+
+    They are forgotten again once the current transaction commits, so that a
+    request that read the old courses in the meantime can't keep them cached.
+
+    Args:
+        kind: :data:`TAUGHT` or :data:`ENROLLED`
+        user_ids: The users whose courses changed
+    """
+    keys = [_key(kind, user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -3,6 +3,8 @@ from django.db import models
 from django.db.models import Q
 from django.urls import reverse
 
+from .membership import enrolled_course_ids, taught_course_ids
+
 
 class CourseQuerySet(models.query.QuerySet):
     """Provide filtering utilities for courses."""
@@ -18,16 +20,19 @@ class CourseQuerySet(models.query.QuerySet):
             return self.all()
         else:
             return self.filter(
-                Q(teacher=user)
-                | (Q(students=user) & (Q(archived=False) | Q(permission="r") | Q(permission="w")))
-            ).distinct()
+                Q(id__in=taught_course_ids(user))
+                | (
+                    Q(id__in=enrolled_course_ids(user))
+                    & (Q(archived=False) | Q(permission="r") | Q(permission="w"))
+                )
+            )
 
     def filter_editable(self, user):
         """Filter courses a user can edit."""
         if user.is_superuser:
             return self.all()
         else:
-            return self.filter(teacher=user).distinct()
+            return self.filter(id__in=taught_course_ids(user))
 
 
 class Course(models.Model):
@@ -75,12 +80,16 @@ class Course(models.Model):
 
     def is_student_in_course(self, user) -> bool:
         """Check if a student is registered in the course"""
-        return self.students.contains(user)
+        return self.id in enrolled_course_ids(user)
+
+    def is_teacher_in_course(self, user) -> bool:
+        """Check if a user teaches the course"""
+        return self.id in taught_course_ids(user)
 
     def is_only_student_in_course(self, user) -> bool:
         """Check if a user is the only student in a course"""
         return self.is_student_in_course(user) and not (
-            user.is_superuser or user in self.teacher.all()
+            user.is_superuser or self.is_teacher_in_course(user)
         )
 
 
@@ -0,0 +1,42 @@
+from django.db.models.signals import m2m_changed, pre_delete
+
+from . import membership
+from .models import Course
+
+
+def make_membership_invalidator(kind: str, related_name: str):
+    """Invalidate cached course ids when one side of a course membership changes.
+
+    Args:
+        kind: Which course ids the relation decides (see :mod:`.membership`)
+        related_name: The name of the relation on :class:`.Course`
+    """
+
+    def invalidate(sender, instance, action, reverse, pk_set, **kwargs):  # pylint: disable=unused-argument
+        if action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        if reverse:
+            # a user's courses changed
+            user_ids = [instance.pk]
+        elif action == "pre_clear":
+            user_ids = list(getattr(instance, related_name).values_list("id", flat=True))
+        else:
+            user_ids = pk_set
+        membership.invalidate(kind, user_ids)
+
+    return invalidate
+
+
+invalidate_teachers = make_membership_invalidator(membership.TAUGHT, "teacher")
+invalidate_students = make_membership_invalidator(membership.ENROLLED, "students")
+
+
+def invalidate_deleted_course(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    # deleting a course removes its memberships without sending m2m_changed
+    membership.invalidate(membership.TAUGHT, instance.teacher.values_list("id", flat=True))
+    membership.invalidate(membership.ENROLLED, instance.students.values_list("id", flat=True))
+
+
+m2m_changed.connect(invalidate_teachers, sender=Course.teacher.through)
+m2m_changed.connect(invalidate_students, sender=Course.students.through)
+pre_delete.connect(invalidate_deleted_course, sender=Course)
@@ -1,8 +1,15 @@
+import csv
+import io
+
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from tin.tests import is_login_redirect, is_redirect, login
+from tin.tests import is_login_redirect, is_redirect, login, read_streaming
 
+from ..submissions import scheduler
+from . import membership
 from .models import Course
 
 
@@ -118,3 +125,130 @@ def test_teacher_access_hidden_archived_course(
 
     response = client.get(reverse("assignments:submit", args=[assignment.id]))
     assert response.status_code == 200
+
+
+def get_gradebook(client, course, **params) -> list[list[str]]:
+    response = client.get(reverse("courses:gradebook_csv", args=[course.id]), params)
+    assert response.status_code == 200
+    return list(csv.reader(io.StringIO(read_streaming(response).decode("utf-8"))))
+
+
+@login("teacher")
+def test_gradebook_csv(client, course, assignment, teacher, student, django_user_model) -> None:
+    other = course.assignments.create(
+        name="Write a Fragment Shader",
+        points_possible="10",
+        due=assignment.due,
+        language_details=assignment.language_details,
+    )
+    period = course.period_set.create(name="Period 1", teacher=teacher)
+    period.students.add(student)
+    course.period_set.create(name="Period 2", teacher=teacher).students.add(student)
+    absent = django_user_model.objects.create(username="absent", is_student=True)
+    course.students.add(absent)
+
+    published = assignment.submissions.create(
+        student=student, has_been_graded=True, points_received=100
+    )
+    published.publish()
+    published.comments.create(
+        author=teacher, start_char=0, end_char=1, text="Nice", point_override=5
+    )
+    published.comments.create(
+        author=teacher, start_char=0, end_char=1, text="Also nice", point_override=10
+    )
+    assignment.submissions.create(student=student, has_been_graded=True, points_received=1)
+    other.submissions.create(student=student)
+
+    header, *rows = get_gradebook(client, course)
+    assert header == [
+        "Name",
+        "Username",
+        "Period",
+        "Write a Shader: Raw Score",
+        "Write a Shader: Final Score",
+        "Write a Shader: Formatted Grade",
+        "Write a Fragment Shader: Raw Score",
+        "Write a Fragment Shader: Final Score",
+        "Write a Fragment Shader: Formatted Grade",
+    ]
+    rows = {row[1]: row for row in rows}
+    assert rows["student"][2:] == [
+        "Period 1, Period 2",
+        "100.000",
+        "115.000",
+        "115 / 300 (38.33%)",
+        "NG",
+        "NG",
+        "NG",
+    ]
+    assert rows["absent"][2:] == ["", "M", "M", "M", "M", "M", "M"]
+
+    header, *rows = get_gradebook(client, course, period=period.id, assignment=[other.id])
+    assert header[3:] == ["Raw Score", "Final Score", "Formatted Grade"]
+    assert [row[1] for row in rows] == ["student"]
+
+
+@login("teacher")
+def test_gradebook_csv_query_count(client, course, assignment, teacher, django_user_model):
+    period = course.period_set.create(name="Period 1", teacher=teacher)
+
+    def add_students(count: int) -> None:
+        start = django_user_model.objects.count()
+        for i in range(start, start + count):
+            student = django_user_model.objects.create(username=f"gradebook{i}")
+            course.students.add(student)
+            period.students.add(student)
+            submission = assignment.submissions.create(
+                student=student, has_been_graded=True, points_received=100
+            )
+            submission.comments.create(
+                author=teacher, start_char=0, end_char=1, text="Nice", point_override=5
+            )
+
+    def count_queries() -> int:
+        with CaptureQueriesContext(connection) as queries:
+            get_gradebook(client, course)
+        return len(queries)
+
+    add_students(1)
+    count_queries()  # the first request fills the course membership cache
+    num_queries = count_queries()
+
+    add_students(10)
+    assert count_queries() == num_queries, "The gradebook should not query once per student"
+
+
+@login("admin")
+def test_index_shows_grading_queue(client, assignment, student, grading_queue) -> None:
+    scheduler.schedule([assignment.submissions.create(student=student)], lane=scheduler.BULK)
+
+    response = client.get(reverse("courses:index"))
+    assert response.status_code == 200
+    depth = response.context["grading_queue"][scheduler.BULK]
+    assert depth["waiting"] + depth["running"] == 1
+
+
+def test_course_membership_cache(course, teacher, student, django_assert_num_queries) -> None:
+    assert Course.objects.filter_visible(student).get() == course
+    assert course.is_teacher_in_course(teacher)
+    with django_assert_num_queries(0):
+        assert course.is_student_in_course(student)
+        assert course.is_teacher_in_course(teacher)
+        assert not course.is_teacher_in_course(student)
+
+    course.students.remove(student)
+    assert not Course.objects.filter_visible(student).exists()
+    student.courses.add(course)
+    assert course.is_student_in_course(student)
+
+    course.teacher.set([student])
+    assert course.is_teacher_in_course(student)
+    assert not Course.objects.filter_editable(teacher).exists()
+
+    course.students.clear()
+    assert not course.is_student_in_course(student)
+
+    course.delete()
+    assert not Course.objects.filter_visible(student).exists()
+    assert course.id not in membership.taught_course_ids(student)
@@ -16,6 +16,7 @@ urlpatterns = [
         name="import_from_selected_course",
     ),
     path("<int:course_id>/students", views.students_view, name="students"),
+    path("<int:course_id>/gradebook.csv", views.gradebook_csv_view, name="gradebook_csv"),
     path("<int:course_id>/students/import", views.import_students_view, name="import_students"),
     path("<int:course_id>/students/manage", views.manage_students_view, name="manage_students"),
     path("<int:course_id>/add_period", views.add_period_view, name="add_period"),
@@ -1,12 +1,17 @@
 from datetime import timedelta
 
 from celery.result import AsyncResult
-from django.http import JsonResponse
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 
 from ..assignments.models import Assignment
+from ..assignments.utils import iter_gradebook_csv
 from ..auth.decorators import login_required, teacher_or_superuser_required
+from ..submissions import scheduler
+from ..submissions.models import Submission
+from ..submissions.utils import aiter_sync
 from .forms import (
     CourseForm,
     ImportFromSelectedCourseForm,
@@ -14,6 +19,7 @@ from .forms import (
     SelectCourseToImportFromForm,
     StudentForm,
 )
+from .membership import enrolled_course_ids
 from .models import Course, Period, StudentImport
 from .tasks import import_course_data_tasks
 
@@ -35,12 +41,13 @@ def index_view(request):
     if request.user.is_student:
         assignments = (
             Assignment.objects.filter_visible(request.user)
-            .filter(course__students=request.user, is_quiz=False)
+            .filter(course_id__in=enrolled_course_ids(request.user), is_quiz=False)
+            .select_related("course")
             .order_by("due")
         )
 
         unsubmitted_assignments = (
-            assignments.exclude(submissions__student=request.user)
+            assignments.filter_unsubmitted(request.user)
             .filter(course__archived=False)
             .filter_permissions(request.user, "w")
         )
@@ -53,6 +60,20 @@ def index_view(request):
         due_soon_assignments = assignments.filter(due__gte=now, due__lte=now + timedelta(weeks=1))
         context["due_soon_assignments"] = due_soon_assignments
 
+    if request.user.is_superuser:
+        grading_queue = scheduler.queue_depths()
+        course_names = Course.objects.in_bulk(
+            {course_id for depth in grading_queue.values() for course_id in depth["courses"]}
+        )
+        for depth in grading_queue.values():
+            depth["courses"] = {
+                course_names[course_id]: waiting
+                for course_id, waiting in depth["courses"].items()
+                if course_id in course_names
+            }
+        context["grading_queue"] = grading_queue
+        context["reaped_submissions"] = scheduler.reaped_totals()
+
     return render(request, "courses/home.html", context)
 
 
@@ -66,11 +87,13 @@ def show_view(request, course_id):
     """
     course = get_object_or_404(Course.objects.filter_visible(request.user), id=course_id)
 
-    is_teacher = request.user in course.teacher.all()
+    is_teacher = course.is_teacher_in_course(request.user)
     if request.user.is_superuser or is_teacher:
         folders = course.folders.order_by("name")
     else:
-        folders = course.folders.filter(assignments__hidden=False).distinct().order_by("name")
+        folders = course.folders.filter(
+            Exists(Assignment.objects.filter(folder=OuterRef("pk"), hidden=False))
+        ).order_by("name")
 
     assignments = course.assignments.filter(folder=None).filter_visible(request.user)
     if course.sort_assignments_by == "due_date":
@@ -87,7 +110,7 @@ def show_view(request, course_id):
         "is_teacher": is_teacher,
     }
     if course.is_student_in_course(request.user):
-        context["unsubmitted_assignments"] = assignments.exclude(submissions__student=request.user)
+        context["unsubmitted_assignments"] = assignments.filter_unsubmitted(request.user)
 
     return render(request, "courses/show.html", context)
 
@@ -208,7 +231,14 @@ def students_view(request, course_id):
     period_set = course.period_set.order_by("teacher", "name")
 
     if period == "all":
-        students = {s: course.period_set.filter(students=s) for s in course.students.all()}
+        students = {
+            student: student.course_periods
+            for student in course.students.prefetch_related(
+                Prefetch(
+                    "periods", queryset=course.period_set.order_by("name"), to_attr="course_periods"
+                )
+            )
+        }
 
         return render(
             request,
@@ -224,17 +254,23 @@ def students_view(request, course_id):
     else:
         active_period = get_object_or_404(Period.objects.filter(course=course), id=int(period))
 
+        assignments = list(Assignment.objects.filter_visible(request.user).filter(course=course))
+        period_students = list(active_period.students.all())
+        submitted = set(
+            Submission.objects.filter(assignment__in=assignments, student__in=period_students)
+            .values_list("student_id", "assignment_id")
+            .distinct()
+        )
         students = [
             [
-                s,
+                student,
                 [
                     assignment.name
-                    for assignment in Assignment.objects.filter_visible(request.user)
-                    .filter(course=course)
-                    .exclude(submissions__student=s)
+                    for assignment in assignments
+                    if (student.id, assignment.id) not in submitted
                 ],
             ]
-            for s in active_period.students.all()
+            for student in period_students
         ]
 
         return render(
@@ -251,6 +287,47 @@ def students_view(request, course_id):
         )
 
 
+@teacher_or_superuser_required
+def gradebook_csv_view(request, course_id):
+    """Get a ``.csv`` of every student's scores on the course's assignments
+
+    Only the assignments given by the ``assignment`` query parameter are
+    included, if any are, and only the students in the ``period`` (if not ``all``).
+
+    Args:
+        request: The HTTP request
+        course_id: The primary key of an instance of :class:`.Course`
+    """
+    course = get_object_or_404(Course.objects.filter_editable(request.user), id=course_id)
+
+    assignments = Assignment.objects.filter(course=course).order_by("due", "id")
+    if assignment_ids := request.GET.getlist("assignment"):
+        try:
+            assignments = assignments.filter(id__in=[int(i) for i in assignment_ids])
+        except ValueError as e:
+            raise Http404 from e
+
+    period = request.GET.get("period", "all")
+    if period == "all":
+        students = course.students.all()
+        name = f"course_{course.id}_gradebook.csv"
+    else:
+        try:
+            period_obj = get_object_or_404(Period.objects.filter(course=course), id=int(period))
+        except ValueError as e:
+            raise Http404 from e
+        students = period_obj.students.all()
+        name = "course_{}_period_{}_gradebook.csv".format(
+            course.id, period_obj.name.replace(" ", "_")
+        )
+
+    response = StreamingHttpResponse(
+        aiter_sync(iter_gradebook_csv(course, assignments, students)), content_type="text/csv"
+    )
+    response["Content-Disposition"] = f"attachment; filename={name}"
+    return response
+
+
 @teacher_or_superuser_required
 def import_students_view(request, course_id):
     """Add students to a course
@@ -0,0 +1,76 @@
+"""A content-addressed store for submitted code.
+
+Each distinct file is kept once, gzipped, under the SHA-256 of its contents, so a
+student resubmitting the same code (or a class submitting the same starter code)
+doesn't take another file each time. A second replica of each blob is kept under
+``submission-backups``, in place of the per-submission backup copies Tin used to
+make.
+
+Submissions still write their own working copy for the grader to run (see
+:meth:`.Submission.save_file`), but their contents are read back from here.
+"""
+
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
+
+from . import files
+
+PRIMARY = "blobs"
+REPLICA = "submission-backups/blobs"
+
+
+def get_digest(data: bytes) -> str:
+    """Get the digest that ``data`` is stored under."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(root: str, digest: str) -> str:
+    """Get the path (relative to ``MEDIA_ROOT``) of a blob.
+
+    Args:
+        root: :data:`PRIMARY` or :data:`REPLICA`
+        digest: The digest of the blob
+    """
+    if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        raise ValueError(f"Invalid digest {digest!r}")
+    return f"{root}/{digest[:2]}/{digest}.gz"
+
+
+def store(data: bytes, roots: tuple[str, ...] = (PRIMARY, REPLICA)) -> str:
+    """Store some data, unless it is already stored.
+
+    Args:
+        data: The data to store
+        roots: Which copies to store it in
+
+    Returns:
+        The digest of the data
+    """
+    digest = get_digest(data)
+    compressed = None
+    for root in roots:
+        path = blob_path(root, digest)
+        if not os.path.exists(os.path.join(settings.MEDIA_ROOT, path)):
+            if compressed is None:
+                compressed = gzip.compress(data, mtime=0)
+            files.write_file(path, compressed)
+    return digest
+
+
+def find_blob(digest: str) -> str:
+    """Find a blob, in the replica if the primary copy is missing.
+
+    Returns:
+        The absolute path to the blob, which is gzipped
+
+    Raises:
+        FileNotFoundError: Neither copy exists
+    """
+    for root in (PRIMARY, REPLICA):
+        path = os.path.join(settings.MEDIA_ROOT, blob_path(root, digest))
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No blob with digest {digest}")
@@ -1,71 +1,108 @@
 from typing import Any
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.db.models import Exists, OuterRef, Q
 
+from ..courses.models import Course
 from .models import Submission
-from .utils import serialize_submission_info
+from .tasks import aget_live_output
+from .utils import can_see_grader_errors, serialize_submission_info
 
 
-class SubmissionJsonConsumer(JsonWebsocketConsumer):
+class SubmissionJsonConsumer(AsyncJsonWebsocketConsumer):
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
         self.submission = None
         self.user = None
+        self.can_see_errors = False
         self.connected = False
 
-    def connect(self) -> None:
+    @staticmethod
+    def get_queryset():
+        """Everything :func:`.serialize_submission_info` needs, in as few queries as possible."""
+        return Submission.objects.select_related("assignment")
+
+    async def connect(self) -> None:
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
-            self.close()
+            await self.close()
             return
 
         submission_id = self.scope["url_route"]["kwargs"]["submission_id"]
 
-        try:
-            self.submission = Submission.objects.get(id=submission_id)
-        except Submission.DoesNotExist:
-            self.close()
-            return
-
         # A user may watch a submission's live updates only if it is their own
         # submission, or they teach the course, or they are a superuser. The
         # previous check allowed *any* student enrolled in the course to read
         # *any* classmate's submission (including quizzes), which the HTTP views
         # (Submission.objects.filter_visible) never permit.
-        is_owner = self.submission.student_id == self.user.id
-        is_teacher = self.submission.assignment.course.teacher.filter(id=self.user.id).exists()
-        if not (is_owner or is_teacher or self.user.is_superuser):
-            self.close()
+        # The check is done in the same query that loads the submission.
+        submissions = self.get_queryset().filter(id=submission_id)
+        if not self.user.is_superuser:
+            submissions = submissions.filter(
+                Q(student_id=self.user.id)
+                | Exists(
+                    Course.teacher.through.objects.filter(
+                        course_id=OuterRef("assignment__course_id"), user_id=self.user.id
+                    )
+                )
+            )
+
+        self.submission = await submissions.afirst()
+        if self.submission is None:
+            await self.close()
             return
 
+        self.can_see_errors = can_see_grader_errors(self.user)
         self.connected = True
-        self.accept()
+        await self.accept()
 
-        async_to_sync(self.channel_layer.group_add)(
-            self.submission.channel_group_name, self.channel_name
-        )
+        await self.channel_layer.group_add(self.submission.channel_group_name, self.channel_name)
 
-        self.send_submission_info()
+        await self.send_submission_info(refresh=False)
+
+    async def disconnect(self, code: int) -> None:
+        if self.connected:
+            await self.channel_layer.group_discard(
+                self.submission.channel_group_name, self.channel_name
+            )
 
-    def disconnect(self, code: int) -> None:
         self.submission = None
         self.user = None
         self.connected = False
 
-    def receive_json(self, content: Any, **kwargs: Any) -> None:
+    async def receive_json(self, content: Any, **kwargs: Any) -> None:
         if self.connected:
             if not isinstance(content, dict):
                 return
 
             msg_type = content.get("type")
             if msg_type == "request-info":
-                self.send_submission_info()
+                await self.send_submission_info()
 
-    def submission_updated(self, _event) -> None:
-        self.send_submission_info()
+    async def submission_message(self, event) -> None:
+        """Forward a message that was already encoded by the grading task."""
+        if self.connected:
+            await self.send(text_data=event["text" if self.can_see_errors else "public_text"])
+
+    async def send_submission_info(self, *, refresh: bool = True) -> None:
+        """Send a snapshot of the submission for the client to (re)sync from.
 
-    def send_submission_info(self):
+        If the submission is still running, the output comes from the grader's live
+        snapshot rather than the last checkpoint saved to the database.
+        """
         if self.connected:
-            self.submission.refresh_from_db()
-            self.send_json(serialize_submission_info(self.submission, self.user))
+            if refresh:
+                self.submission = await self.get_queryset().aget(id=self.submission.id)
+
+            data = {"type": "snapshot", "seq": 0}
+            data.update(serialize_submission_info(self.submission, self.user))
+
+            if not self.submission.complete:
+                live_output = await aget_live_output(self.submission)
+                if live_output is not None:
+                    data["seq"] = live_output["seq"]
+                    data["grader_output"] = live_output["grader_output"]
+                    if self.can_see_errors:
+                        data["grader_errors"] = live_output["grader_errors"]
+
+            await self.send_json(data)
@@ -0,0 +1,92 @@
+"""Writing files under ``MEDIA_ROOT`` without following symbolic links.
+
+Graders and submissions run with write access to their assignment's directory, so
+they can leave symbolic links there to trick Tin into writing somewhere else. Files
+used to be written by a sandboxed ``cat``, which is safe but slow. Instead, these
+functions open each directory relative to the previous one with ``O_NOFOLLOW``, so
+a link anywhere in the path is an error, and write to a new file (``O_EXCL``) that is
+then renamed into place. Renaming replaces a link instead of following it.
+"""
+
+import contextlib
+import os
+import secrets
+from collections.abc import Iterator
+
+from django.conf import settings
+
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC
+
+
+def _split(path: str) -> list[str]:
+    parts = path.split("/")
+    if os.path.isabs(path) or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"{path!r} is not a normalized path relative to MEDIA_ROOT")
+    return parts
+
+
+@contextlib.contextmanager
+def _open_dirs(parts: list[str]) -> Iterator[int]:
+    """Open a directory under ``MEDIA_ROOT``, creating it if needed.
+
+    Raises:
+        OSError: One of the directories is a symbolic link or not a directory
+    """
+    # MEDIA_ROOT itself is trusted
+    fd = os.open(settings.MEDIA_ROOT, _DIR_FLAGS & ~os.O_NOFOLLOW)
+    try:
+        for part in parts:
+            try:
+                next_fd = os.open(part, _DIR_FLAGS, dir_fd=fd)
+            except FileNotFoundError:
+                with contextlib.suppress(FileExistsError):
+                    os.mkdir(part, 0o755, dir_fd=fd)
+                next_fd = os.open(part, _DIR_FLAGS, dir_fd=fd)
+            os.close(fd)
+            fd = next_fd
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def make_dirs(path: str) -> None:
+    """Create a directory and its parents, like ``mkdir -p``.
+
+    Args:
+        path: The directory, relative to ``MEDIA_ROOT``
+    """
+    with _open_dirs(_split(path)):
+        pass
+
+
+def write_file(path: str, data: str | bytes, *, mode: int = 0o644) -> None:
+    """Write a file, replacing it if it exists.
+
+    Args:
+        path: The file, relative to ``MEDIA_ROOT``. Its directories are created
+            if needed.
+        data: The contents. Text is encoded as UTF-8.
+        mode: The permissions of the file
+
+    Raises:
+        ValueError: ``path`` is absolute or contains ``..``
+        OSError: The file could not be written, for instance because one of its
+            directories is a symbolic link
+    """
+    *dirs, name = _split(path)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    with _open_dirs(dirs) as dir_fd:
+        tmp_name = f".{name}.{secrets.token_hex(8)}.tmp"
+        fd = os.open(tmp_name, _FILE_FLAGS, mode, dir_fd=dir_fd)
+        try:
+            with os.fdopen(fd, "wb") as f_obj:
+                os.fchmod(f_obj.fileno(), mode)
+                f_obj.write(data)
+            os.replace(tmp_name, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_name, dir_fd=dir_fd)
+            raise
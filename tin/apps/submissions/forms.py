@@ -1,5 +1,5 @@
 from django import forms
-from django.db.models import Q
+from django.db.models import F, Q
 
 from ..assignments.models import Assignment, Folder
 from ..courses.models import Course, Period
@@ -95,7 +95,7 @@ class FilterForm(forms.Form):
 
     def get_results(self):
         """Returns a queryset of submissions matching the form's filters"""
-        queryset = Submission.objects.all()
+        queryset = Submission.objects.with_points().with_latest_info()
 
         if self.cleaned_data["courses"]:
             queryset = queryset.filter(assignment__course__in=self.cleaned_data["courses"])
@@ -146,22 +146,17 @@ class FilterForm(forms.Form):
 
         order_bys = [self.cleaned_data[f"order_by_{i}"] for i in range(1, 6)]
         order_bys = filter(None, order_bys)  # Remove empty selections
-        if order_bys:
-            queryset = queryset.order_by(*order_bys)
+        # ties are broken by id, so that the results can be split into pages
+        queryset = queryset.order_by(*order_bys, "id")
 
-        # This is done last to minimize queryset evaluation
-        # However, slicing must be done last (see limit below)
         if self.cleaned_data["is_latest_publish"]:
-            latest_publish_ids = [s.pk for s in queryset if (s.is_latest_publish or s.is_latest)]
-            queryset = queryset.filter(pk__in=latest_publish_ids)
+            queryset = queryset.filter(Q(latest_publish_id=F("id")) | Q(is_latest_submission=True))
 
         if self.cleaned_data["is_latest"]:
-            latest_ids = [s.pk for s in queryset if s.is_latest]
-            queryset = queryset.filter(pk__in=latest_ids)
+            queryset = queryset.filter(is_latest_submission=True)
 
         if self.cleaned_data["is_published"]:
-            published_ids = [s.pk for s in queryset if s.is_latest_publish]
-            queryset = queryset.filter(pk__in=published_ids)
+            queryset = queryset.filter(latest_publish_id=F("id"))
 
         if self.cleaned_data["limit"]:
             queryset = queryset[: self.cleaned_data["limit"]]
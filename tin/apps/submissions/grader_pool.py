@@ -0,0 +1,182 @@
+"""A pool of interpreters started ahead of time to run graders in.
+
+Starting a sandboxed interpreter takes a good part of the time it takes to grade a
+simple submission. With ``GRADER_POOL_ENABLED``, each worker keeps spare
+interpreters running ``scripts/warm_grader.py``, for the interpreter, environment
+and sandbox of each assignment it recently graded. A spare runs a single grader,
+and is replaced by a new one as soon as it is taken.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from ... import sandboxing
+
+
+class GraderPool:
+    """Spare interpreters, ready to run a grader.
+
+    Args:
+        size: How many spares to keep for each kind of grader
+        max_idle: How many spares to keep in total
+        idle_timeout: How long (in seconds) a spare is kept before it is stopped
+    """
+
+    def __init__(self, *, size: int, max_idle: int, idle_timeout: float):
+        self.size = size
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        # the least recently used kind of grader comes first
+        self._spares: OrderedDict[tuple, list[tuple[float, subprocess.Popen]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def popen(
+        self,
+        python_exe: str,
+        argv: list[str],
+        *,
+        cwd: str,
+        env: dict[str, str],
+        sandbox_options: dict | None = None,
+    ) -> subprocess.Popen:
+        """Run a grader, in a spare interpreter if there is one.
+
+        The grader is run as ``python_exe -u *argv``, unbuffered with no stdin.
+
+        Args:
+            python_exe: The interpreter to run the grader with
+            argv: The grader script and its arguments
+            cwd: The directory to run the grader in
+            env: The environment of the grader
+            sandbox_options: The keyword arguments to
+                :func:`.get_assignment_sandbox_args`, or ``None`` not to sandbox it
+
+        Returns:
+            The process running the grader. It is in its own process group.
+        """
+        key = (python_exe, cwd, json.dumps(env, sort_keys=True), json.dumps(sandbox_options))
+
+        with self._lock:
+            self._stop_idle()
+            proc = self._take(key)
+
+        if proc is None:
+            proc = self._start(python_exe, cwd=cwd, env=env, sandbox_options=sandbox_options)
+
+        try:
+            proc.stdin.write(json.dumps({"argv": argv, "cwd": cwd}).encode() + b"\n")
+        except BrokenPipeError:
+            # it died while waiting; its output will say why
+            pass
+        # the grader has no stdin, like when it's started directly
+        proc.stdin.close()
+        proc.stdin = None
+
+        spare = self._start(python_exe, cwd=cwd, env=env, sandbox_options=sandbox_options)
+        with self._lock:
+            self._spares.setdefault(key, []).append((time.monotonic(), spare))
+            self._spares.move_to_end(key)
+            while len(self._spares[key]) > self.size:
+                self._stop(self._spares[key].pop(0)[1])
+            self._stop_idle()
+
+        return proc
+
+    def close(self) -> None:
+        """Stop all the spares."""
+        with self._lock:
+            for spares in self._spares.values():
+                for _, proc in spares:
+                    self._stop(proc)
+            self._spares.clear()
+
+    def _start(
+        self, python_exe: str, *, cwd: str, env: dict[str, str], sandbox_options: dict | None
+    ) -> subprocess.Popen:
+        script = str(settings.GRADER_POOL_SCRIPT)
+        args = [python_exe, "-u", script]
+        if sandbox_options is not None:
+            sandbox_options = dict(sandbox_options)
+            sandbox_options["whitelist"] = [
+                *(sandbox_options.get("whitelist") or []),
+                os.path.dirname(script),
+            ]
+            sandbox_options["read_only"] = [*(sandbox_options.get("read_only") or []), script]
+            args = sandboxing.get_assignment_sandbox_args(args, **sandbox_options)
+
+        return subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            cwd=cwd,
+            preexec_fn=os.setpgrp,  # noqa: PLW1509
+            env=env,
+        )
+
+    def _take(self, key: tuple) -> subprocess.Popen | None:
+        spares = self._spares.get(key, [])
+        while spares:
+            _, proc = spares.pop(0)
+            if proc.poll() is None:
+                return proc
+            self._stop(proc)
+        return None
+
+    def _stop_idle(self) -> None:
+        """Stop the spares that have waited too long, or are one too many."""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key in list(self._spares):
+            spares = self._spares[key]
+            while spares and spares[0][0] < cutoff:
+                self._stop(spares.pop(0)[1])
+            if not spares:
+                del self._spares[key]
+
+        total = sum(len(spares) for spares in self._spares.values())
+        while total > self.max_idle:
+            key = next(iter(self._spares))
+            self._stop(self._spares[key].pop(0)[1])
+            if not self._spares[key]:
+                del self._spares[key]
+            total -= 1
+
+    @staticmethod
+    def _stop(proc: subprocess.Popen) -> None:
+        # closing stdin tells it no grader is coming
+        with contextlib.suppress(OSError):
+            proc.stdin.close()
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        for pipe in (proc.stdout, proc.stderr):
+            pipe.close()
+
+
+_pool: GraderPool | None = None
+
+
+def get_grader_pool() -> GraderPool:
+    """Get this worker's pool, starting it if needed."""
+    global _pool  # noqa: PLW0603
+    if _pool is None:
+        _pool = GraderPool(
+            size=settings.GRADER_POOL_SIZE,
+            max_idle=settings.GRADER_POOL_MAX_IDLE,
+            idle_timeout=settings.GRADER_POOL_IDLE_TIMEOUT,
+        )
+        atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,58 @@
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ..... import sandboxing
+from ...files import write_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long it takes to save a submission, with a sandboxed cat (as Tin used to) "
+        "or in-process with files.write_file. Sandboxing is only used if the sandboxing "
+        "module is installed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=200, help="Files to write in each mode")
+        parser.add_argument("--size", type=int, default=4096, help="Size of each file in bytes")
+
+    def handle(self, *args, **options):
+        text = "x" * options["size"]
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            self.stdout.write(f"{'mode':>10} {'p50':>10} {'p90':>10}")
+            for mode in ("subprocess", "in-process"):
+                timings = []
+                for i in range(options["runs"]):
+                    name = f"assignment-1/student/submission_{mode}_{i}.py"
+                    start = time.perf_counter()
+                    if mode == "subprocess":
+                        fpath = Path(tmp, name)
+                        fpath.parent.mkdir(parents=True, exist_ok=True)
+                        subprocess.run(
+                            sandboxing.get_assignment_sandbox_args(
+                                ["sh", "-c", 'cat >"$1"', "sh", str(fpath)],
+                                network_access=False,
+                                whitelist=[str(fpath.parent)],
+                            ),
+                            input=text,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            encoding="utf-8",
+                            check=True,
+                        )
+                    else:
+                        write_file(name, text)
+                    timings.append(time.perf_counter() - start)
+
+                cuts = statistics.quantiles(timings, n=10)
+                self.stdout.write(
+                    f"{mode:>10} {statistics.median(timings) * 1000:>7.3f} ms "
+                    f"{cuts[8] * 1000:>7.3f} ms"
+                )
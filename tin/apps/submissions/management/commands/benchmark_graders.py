@@ -0,0 +1,77 @@
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from ...grader_pool import GraderPool
+from ...tasks import start_grader
+
+EXAMPLE_GRADER = (
+    Path(settings.BASE_DIR).parent / "docs" / "source" / "usage" / "graders" / "examples"
+) / "addition.py"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long it takes to run a trivial grader (the addition example from the docs), "
+        "starting a new interpreter each time or using a warm one from the grader pool. "
+        "Graders are not sandboxed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=20, help="Graders to run in each mode")
+        parser.add_argument("--python", default=sys.executable, help="The interpreter to use")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.5,
+            help="Seconds between graders, in which the pool can start a spare",
+        )
+
+    def handle(self, *args, **options):
+        if not EXAMPLE_GRADER.exists():
+            raise CommandError(f"{EXAMPLE_GRADER} does not exist")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            submission = Path(tmp, "submission.py")
+            submission.write_text("def add_num(a, b):\n    return a + b\n", "utf-8")
+            argv = [
+                str(EXAMPLE_GRADER),
+                "unused",
+                str(submission),
+                "student",
+                str(Path(tmp, "log")),
+            ]
+
+            self.stdout.write(f"{'mode':>6} {'p50':>10} {'p90':>10}")
+            pool = GraderPool(size=1, max_idle=1, idle_timeout=60)
+            try:
+                for mode in ("cold", "warm"):
+                    timings = []
+                    for _ in range(options["runs"]):
+                        start = time.perf_counter()
+                        if mode == "warm":
+                            proc = pool.popen(options["python"], argv, cwd=tmp, env={})
+                        else:
+                            with override_settings(GRADER_POOL_ENABLED=False):
+                                proc = start_grader(
+                                    options["python"], argv, cwd=tmp, env={}, sandbox_options=None
+                                )
+                        output, _ = proc.communicate()
+                        timings.append(time.perf_counter() - start)
+                        if not output.decode().endswith("Score: 100.00%\n"):
+                            raise CommandError(f"Unexpected output: {output.decode()!r}")
+                        time.sleep(options["interval"])
+
+                    cuts = statistics.quantiles(timings, n=10)
+                    self.stdout.write(
+                        f"{mode:>6} {statistics.median(timings) * 1000:>7.1f} ms "
+                        f"{cuts[8] * 1000:>7.1f} ms"
+                    )
+            finally:
+                pool.close()
@@ -0,0 +1,136 @@
+import datetime
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ....assignments.models import Language
+from ....courses.models import Course
+from ...models import Submission
+
+BATCH_SIZE = 10_000
+
+
+def key_queries(student, assignment, now: datetime.datetime):
+    """The common submission queries, and the index each one should use."""
+    return [
+        (
+            "latest submission",
+            Submission.objects.filter(student=student, assignment=assignment).order_by(
+                "-date_submitted"
+            )[:1],
+            "submission_student_latest",
+        ),
+        (
+            "running submissions",
+            Submission.objects.filter(student=student, complete=False).values("id"),
+            "submission_student_running",
+        ),
+        (
+            "rate limit",
+            Submission.objects.filter(
+                student=student, date_submitted__gte=now - datetime.timedelta(minutes=30)
+            ).values("id"),
+            "submission_student_recent",
+        ),
+        (
+            "timed out submissions",
+            Submission.objects.filter(
+                complete=False,
+                grader_start_time__isnull=False,
+                assignment__enable_grader_timeout=True,
+                grader_start_time__lte=now.timestamp() - F("assignment__grader_timeout"),
+            ).values("id"),
+            "submission_running_started",
+        ),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large number of submissions, and check that the common submission queries "
+        "use the indexes on Submission. Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1_000_000, help="Submissions to seed")
+        parser.add_argument(
+            "--students", type=int, default=2000, help="Students to spread them over"
+        )
+        parser.add_argument(
+            "--assignments", type=int, default=50, help="Assignments to spread them over"
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        failures = []
+
+        with transaction.atomic():
+            students, assignments = self.seed(now, **options)
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Submission._meta.db_table}")
+
+            student = students[len(students) // 2]
+            assignment = assignments[len(assignments) // 2]
+            self.stdout.write(f"{'query':<24} {'time':>10}  index")
+            for name, queryset, index in key_queries(student, assignment, now):
+                plan = queryset.explain()
+                start = time.perf_counter()
+                list(queryset)
+                elapsed = time.perf_counter() - start
+
+                used = index in plan
+                self.stdout.write(
+                    f"{name:<24} {elapsed * 1000:>7.2f} ms  {index if used else 'NOT USED'}"
+                )
+                if not used:
+                    failures.append(f"{name} does not use {index}:\n{plan}")
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError("\n\n".join(failures))
+
+    def seed(self, now: datetime.datetime, *, count: int, students: int, assignments: int, **_):
+        """Create the students, assignments and submissions to query."""
+        language = Language.objects.create(name="Benchmark", info={}, language="P")
+        course = Course.objects.create(name="Benchmark")
+        assignment_objs = [
+            course.assignments.create(
+                name=f"Benchmark {i}",
+                points_possible=10,
+                due=now,
+                language_details=language,
+            )
+            for i in range(assignments)
+        ]
+        User = get_user_model()
+        student_objs = User.objects.bulk_create(
+            User(username=f"benchmark-{i}", is_student=True) for i in range(students)
+        )
+
+        # spread the submissions over the last year, instead of all being submitted now
+        date_submitted = Submission._meta.get_field("date_submitted")
+        date_submitted.auto_now_add = False
+        try:
+            for start in range(0, count, BATCH_SIZE):
+                Submission.objects.bulk_create(
+                    Submission(
+                        student=student_objs[i % students],
+                        assignment=assignment_objs[i // students % assignments],
+                        date_submitted=now - datetime.timedelta(minutes=count - i),
+                        # one in a thousand is still being graded
+                        complete=i % 1000 != 0,
+                        has_been_graded=i % 1000 != 0,
+                        grader_start_time=(now.timestamp() - 60) if i % 1000 == 0 else None,
+                    )
+                    for i in range(start, min(start + BATCH_SIZE, count))
+                )
+        finally:
+            date_submitted.auto_now_add = True
+
+        self.stdout.write(f"Seeded {count} submissions")
+        return student_objs, assignment_objs
@@ -0,0 +1,232 @@
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import resource
+import statistics
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Submission
+from ...tasks import send_submission_message
+
+
+class BenchmarkClient:
+    """Just enough of a websocket client to watch a submission.
+
+    Autobahn's asyncio client can't be used here, because importing Daphne
+    (an installed app) has already set it up for Twisted.
+    """
+
+    def __init__(self):
+        self.received = {}
+        self._reader = None
+        self._writer = None
+        self._listener = None
+
+    async def connect(self, host: str, port: int, path: str, cookie: str) -> None:
+        """Open the websocket, and wait for the submission's snapshot."""
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self._writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                f"Cookie: {cookie}\r\n"
+                "\r\n"
+            ).encode()
+        )
+
+        status = await self._reader.readline()
+        if b" 101 " not in status:
+            raise ConnectionError(status.decode().strip())
+        while await self._reader.readline() not in (b"\r\n", b""):
+            pass
+
+        if json.loads(await self.receive())["type"] != "snapshot":
+            raise ConnectionError("Expected a snapshot")
+        self._listener = asyncio.create_task(self.listen())
+
+    async def receive(self) -> str:
+        """Receive the next text message."""
+        while True:
+            header = await self._reader.readexactly(2)
+            opcode = header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await self._reader.readexactly(2))
+            elif length == 127:
+                length = int.from_bytes(await self._reader.readexactly(8))
+            payload = await self._reader.readexactly(length)
+
+            if opcode == 0x1:
+                return payload.decode()
+            if opcode == 0x8:
+                raise ConnectionError("Closed by the server")
+            if opcode == 0x9:
+                self.send_frame(0xA, payload)
+
+    async def listen(self) -> None:
+        with contextlib.suppress(ConnectionError, asyncio.IncompleteReadError):
+            while True:
+                message = json.loads(await self.receive())
+                if message["type"] == "output":
+                    self.received[message["seq"]] = time.perf_counter()
+
+    def send_frame(self, opcode: int, payload: bytes) -> None:
+        # client frames must be masked; ours are always shorter than 126 bytes
+        mask = os.urandom(4)
+        self._writer.write(
+            bytes([0x80 | opcode, 0x80 | len(payload)])
+            + mask
+            + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        )
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._writer is not None:
+            with contextlib.suppress(OSError):
+                self.send_frame(0x8, b"")
+            self._writer.close()
+
+
+def percentiles(values: list[float]) -> str:
+    if len(values) < 2:
+        return "-"
+    cuts = statistics.quantiles(values, n=100)
+    return f"{cuts[49] * 1000:.1f}/{cuts[98] * 1000:.1f} ms"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how many submission websockets one server process can sustain. "
+        "Sockets are opened in steps against a running server (e.g. daphne tin.asgi:application), "
+        "and after each step output deltas are fanned out to all of them. "
+        "Use a submission that nobody else is watching."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("submission_id", type=int, help="The submission to watch")
+        parser.add_argument("--url", default="ws://localhost:8000", help="The server to test")
+        parser.add_argument("--sockets", type=int, default=1000, help="Sockets to open in total")
+        parser.add_argument("--step", type=int, default=100, help="Sockets to open per step")
+        parser.add_argument("--messages", type=int, default=20, help="Deltas to send per step")
+        parser.add_argument("--interval", type=float, default=0.25, help="Seconds between deltas")
+        parser.add_argument(
+            "--timeout", type=float, default=10, help="Seconds to wait for a socket or delta"
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        if url.scheme != "ws":
+            raise CommandError("Only ws:// URLs are supported")
+
+        try:
+            submission = Submission.objects.select_related("student").get(
+                id=options["submission_id"]
+            )
+        except Submission.DoesNotExist as e:
+            raise CommandError("Submission does not exist") from e
+
+        # every socket is a file descriptor
+        _soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(submission.student.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = submission.student.get_session_auth_hash()
+        session.create()
+
+        try:
+            asyncio.run(
+                self.run(
+                    submission,
+                    host=url.hostname,
+                    port=url.port or 80,
+                    cookie=f"{settings.SESSION_COOKIE_NAME}={session.session_key}",
+                    **options,
+                )
+            )
+        finally:
+            session.delete()
+
+    async def run(self, submission, *, host, port, cookie, **options) -> None:
+        clients = []
+        seq = 0
+
+        self.stdout.write(
+            f"{'sockets':>8} {'failed':>7} {'connect p50/p99':>20} "
+            f"{'delivery p50/p99':>20} {'dropped':>8}"
+        )
+
+        async def connect():
+            client = BenchmarkClient()
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    client.connect(host, port, f"/submissions/{submission.id}.json", cookie),
+                    options["timeout"],
+                )
+            except OSError, asyncio.IncompleteReadError:
+                client.close()
+                return None, None
+            return client, time.perf_counter() - start
+
+        while len(clients) < options["sockets"]:
+            # open the next step of sockets at once
+            count = min(options["step"], options["sockets"] - len(clients))
+            results = await asyncio.gather(*(connect() for _ in range(count)))
+            connected = [(client, elapsed) for client, elapsed in results if client is not None]
+            clients.extend(client for client, _ in connected)
+            failed = len(results) - len(connected)
+
+            # fan deltas out to every open socket
+            sent = {}
+            for _ in range(options["messages"]):
+                seq += 1
+                sent[seq] = time.perf_counter()
+                await sync_to_async(send_submission_message)(
+                    submission,
+                    {"type": "output", "seq": seq, "grader_output": "", "grader_errors": ""},
+                )
+                await asyncio.sleep(options["interval"])
+
+            deadline = time.perf_counter() + options["timeout"]
+            while time.perf_counter() < deadline and any(
+                seq not in client.received for client in clients
+            ):
+                await asyncio.sleep(0.1)
+
+            latencies = [
+                client.received[s] - sent_at
+                for client in clients
+                for s, sent_at in sent.items()
+                if s in client.received
+            ]
+            dropped = len(clients) * len(sent) - len(latencies)
+
+            self.stdout.write(
+                f"{len(clients):>8} {failed:>7} "
+                f"{percentiles([elapsed for _, elapsed in connected]):>20} "
+                f"{percentiles(latencies):>20} {dropped:>8}"
+            )
+
+            if failed or dropped:
+                self.stdout.write(self.style.WARNING("Stopping: sockets are failing"))
+                break
+
+        for client in clients:
+            client.close()
@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from ... import blobs
+from ...models import Submission
+
+
+class Command(BaseCommand):
+    help = (
+        "Move submissions made before the blob store into it, from their backup copies "
+        "(or their working copies, if the backup is missing)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete-backups",
+            action="store_true",
+            help="Delete each old backup copy once its blob is stored",
+        )
+
+    def handle(self, *args, **options):
+        stored = missing = 0
+        submissions = (
+            Submission.objects.filter(blob_digest="")
+            .exclude(file__isnull=True)
+            .exclude(file="")
+            .only("id", "file")
+        )
+        for submission in submissions.iterator():
+            for fpath in (submission.backup_file_path, submission.file_path):
+                try:
+                    with open(fpath, "rb") as f_obj:
+                        data = f_obj.read()
+                except OSError:
+                    continue
+                break
+            else:
+                missing += 1
+                continue
+
+            submission.blob_digest = blobs.store(data)
+            submission.save(update_fields=["blob_digest"])
+            stored += 1
+
+            if options["delete_backups"] and os.path.exists(submission.backup_file_path):
+                os.remove(submission.backup_file_path)
+
+        self.stdout.write(f"Stored {stored} submissions ({missing} had no file)")
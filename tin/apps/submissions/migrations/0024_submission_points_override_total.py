@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_points_override_totals(apps, schema_editor):
+    """Fill in :attr:`.Submission.points_override_total` from the existing comments."""
+
+    Submission = apps.get_model("submissions", "Submission")
+    Comment = apps.get_model("submissions", "Comment")
+    db_alias = schema_editor.connection.alias
+
+    overrides = (
+        Comment.objects.using(db_alias)
+        .filter(submission=OuterRef("pk"))
+        .order_by()
+        .values("submission")
+        .annotate(total=Sum("point_override"))
+        .values("total")
+    )
+    Submission.objects.using(db_alias).filter(comments__isnull=False).update(
+        points_override_total=Coalesce(Subquery(overrides), Value(Decimal(0)))
+    )
+
+
+# fmt: off
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0023_auto_20231120_1024'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='points_override_total',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=9),
+        ),
+        migrations.RunPython(compute_points_override_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.12 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0024_submission_points_override_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedGraderResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('points_received', models.DecimalField(blank=True, decimal_places=3, max_digits=6, null=True)),
+                ('has_been_graded', models.BooleanField(default=False)),
+                ('grader_output', models.CharField(blank=True, max_length=10240)),
+                ('grader_errors', models.CharField(blank=True, max_length=4096)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='graded_from_cache',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.12 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0025_cachedgraderresult_submission_graded_from_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='grader_version',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
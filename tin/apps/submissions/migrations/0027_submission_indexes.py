@@ -0,0 +1,32 @@
+# Generated by Django 5.2.12 on 2026-10-18 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assignments', '0037_assignment_cache_grader_results'),
+        ('submissions', '0026_submission_grader_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['assignment', 'student', '-date_submitted'], name='submission_student_latest'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['student', 'date_submitted'], name='submission_student_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(condition=models.Q(('complete', False)), fields=['student'], name='submission_student_running'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(condition=models.Q(('complete', False)), fields=['grader_start_time'], name='submission_running_started'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.12 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0027_submission_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='blob_digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.12 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0028_submission_blob_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='grader_host',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,24 +1,52 @@
+import functools
+import gzip
+import hashlib
 import logging
 import os
-import subprocess
+import socket
+import threading
+from collections import OrderedDict
 from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import BinaryIO
 
-from celery.canvas import Signature
+import psutil
+import redis
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q, Subquery, Sum, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 
-from ...sandboxing import get_assignment_sandbox_args
+from ..courses.membership import taught_course_ids
+from . import blobs, files
 from .utils import decimal_repr
 
 logger = logging.getLogger(__name__)
 
 
+def _comment_aggregate(aggregate, default):
+    """Aggregate a submission's comments, in a subquery."""
+    comments = (
+        Comment.objects.filter(submission=OuterRef("pk"))
+        .order_by()
+        .values("submission")
+        .annotate(result=aggregate)
+        .values("result")
+    )
+    return Coalesce(Subquery(comments), Value(default))
+
+
+def _point_override_sum():
+    """Sum the point overrides of a submission's comments, in a subquery."""
+    return _comment_aggregate(Sum("point_override"), Decimal(0))
+
+
 class SubmissionQuerySet(models.query.QuerySet):
     def filter_visible(self, user):
         """Filter who can see the submission
@@ -30,21 +58,220 @@ class SubmissionQuerySet(models.query.QuerySet):
             return self.all()
         else:
             return self.filter(
-                Q(assignment__course__teacher=user)
+                Q(assignment__course_id__in=taught_course_ids(user))
                 | Q(student=user)
                 & Q(assignment__is_quiz=False)
                 & (
                     Q(assignment__course__archived=False)
                     | Q(assignment__course__permission__in="rw")
                 )
-            ).distinct()
+            )
 
     def filter_editable(self, user):
         """Filter submissions based on who can edit them."""
         if user.is_superuser:
             return self.all()
         else:
-            return self.filter(assignment__course__teacher=user).distinct()
+            return self.filter(assignment__course_id__in=taught_course_ids(user))
+
+    def _first_per_student(self, *order_by):
+        """Keep only the first submission of each student to each assignment.
+
+        This is done with a window function, so it takes a single query no matter
+        how many students there are.
+        """
+        return self.alias(
+            student_rank=Window(
+                RowNumber(),
+                partition_by=[F("assignment_id"), F("student_id")],
+                order_by=[*order_by, F("date_submitted").desc(), F("id").desc()],
+            )
+        ).filter(student_rank=1)
+
+    def latest_per_student(self):
+        """Keep only each student's latest submission to each assignment."""
+        return self._first_per_student()
+
+    def published_or_latest_per_student(self):
+        """Keep only the submission that counts for each student to each assignment.
+
+        That is their latest published submission, or if they haven't published one,
+        their latest submission.
+        """
+        is_published = Exists(PublishedSubmission.objects.filter(submission=OuterRef("pk")))
+        return self._first_per_student(is_published.desc())
+
+    def graded_per_student(self, assignment, students):
+        """Get the submission that counts for each student.
+
+        See :meth:`published_or_latest_per_student`. Students without any
+        submissions are left out.
+
+        Args:
+            assignment: The :class:`.Assignment` to get submissions for
+            students: The students (or their ids) to get submissions for
+
+        Returns:
+            A queryset with one submission per student, which is a single query.
+        """
+        return self.filter(
+            assignment=assignment, student__in=students
+        ).published_or_latest_per_student()
+
+    def with_file_headers(self):
+        """Load what :attr:`~.Submission.file_header` shows along with each submission.
+
+        That is their assignment, course and student, and (with one more query for
+        all of them) the students' periods.
+        """
+        return self.select_related("assignment__course", "student").prefetch_related(
+            Prefetch("student__periods", to_attr="header_periods")
+        )
+
+    def with_points(self):
+        """Load what is shown about each submission's comments along with it.
+
+        That is the sum of their point overrides, which the point properties (like
+        :attr:`~.Submission.points`) then use instead of
+        :attr:`~.Submission.points_override_total`, and the number of comments
+        (:attr:`~.Submission.comment_count`).
+        """
+        return self.annotate(
+            point_override_sum=_point_override_sum(),
+            num_comments=_comment_aggregate(Count("id"), 0),
+        )
+
+    def mark_for_rerun(self) -> list[int]:
+        """Reset the submissions to be graded again, with a single UPDATE.
+
+        Like :meth:`.Submission.rerun`, they still have to be queued with
+        :func:`.scheduler.schedule`. Their last grader is forgotten, so they aren't
+        reaped while they wait in the queue.
+
+        Returns:
+            The ids of the submissions that were reset.
+        """
+        ids = list(self.values_list("id", flat=True))
+        Submission.objects.filter(id__in=ids).update(
+            complete=False,
+            has_been_graded=False,
+            graded_from_cache=False,
+            last_run=timezone.now(),
+            grader_pid=None,
+            grader_host="",
+            grader_start_time=None,
+        )
+        return ids
+
+    def reap_dead(self) -> list[int]:
+        """Mark the incomplete submissions whose grader is no longer running as complete.
+
+        Only graders started on this host (see :func:`grader_host`) are checked, since
+        the pids of the others mean nothing here. Which graders are running is checked
+        once for all of them, and they are updated with a single UPDATE.
+
+        Returns:
+            The ids of the submissions that were marked as complete.
+        """
+        running = list(
+            self.filter(
+                complete=False, grader_pid__isnull=False, grader_host=grader_host()
+            ).values_list("id", "grader_pid")
+        )
+        # the processes are listed after the submissions, so a grader that started
+        # in between is either not read or is listed
+        running_pids = set(psutil.pids())
+        dead = [submission_id for submission_id, pid in running if pid not in running_pids]
+        Submission.objects.filter(id__in=dead, complete=False).update(
+            complete=True, grader_pid=None
+        )
+        return dead
+
+    def reap_timed_out(self) -> list[int]:
+        """Mark the incomplete submissions whose grader should have timed out as complete.
+
+        Returns:
+            The ids of the submissions that were marked as complete.
+        """
+        timed_out = list(
+            self.filter(
+                complete=False,
+                grader_start_time__isnull=False,
+                assignment__enable_grader_timeout=True,
+                grader_start_time__lte=timezone.localtime().timestamp()
+                - F("assignment__grader_timeout"),
+            ).values_list("id", flat=True)
+        )
+        Submission.objects.filter(id__in=timed_out, complete=False).update(complete=True)
+        return timed_out
+
+    def stale(self, grader_version: str):
+        """Keep only the submissions that weren't graded with this grader version.
+
+        The submissions are picked first, so after :meth:`graded_per_student` this keeps
+        each student's submission if it is stale, instead of their latest stale one.
+
+        Args:
+            grader_version: The assignment's :meth:`~.Assignment.grader_version`
+        """
+        return Submission.objects.filter(id__in=self.values("id")).exclude(
+            grader_version=grader_version
+        )
+
+    def update_points_override_totals(self) -> int:
+        """Recompute :attr:`~.Submission.points_override_total` from the comments.
+
+        Returns:
+            The number of submissions updated.
+        """
+        return self.update(points_override_total=_point_override_sum())
+
+    def with_publish_info(self):
+        """Load the publish status of each submission along with it.
+
+        :attr:`~.Submission.is_published`, :attr:`~.Submission.is_latest_publish` and
+        :attr:`~.Submission.published_submission` then don't need to query the database.
+        """
+        latest_publish = (
+            PublishedSubmission.objects.filter(
+                assignment=OuterRef("assignment"), student=OuterRef("student")
+            )
+            .order_by("-submission__date_submitted")
+            .values("submission")[:1]
+        )
+        return self.select_related("final_submission").annotate(
+            latest_publish_id=Subquery(latest_publish)
+        )
+
+    def with_latest_info(self):
+        """Let submissions be filtered on whether they are the latest or latest published.
+
+        That is with ``is_latest_submission=True`` (like :attr:`~.Submission.is_latest`)
+        or ``latest_publish_id=F("id")`` (like :attr:`~.Submission.is_latest_publish`).
+        Unlike :meth:`latest_per_student`, this doesn't depend on which other submissions
+        are filtered out. Their publish status is also loaded (see :meth:`with_publish_info`).
+        """
+        later = self.model.objects.filter(
+            Q(date_submitted__gt=OuterRef("date_submitted"))
+            | Q(date_submitted=OuterRef("date_submitted"), id__gt=OuterRef("id")),
+            assignment=OuterRef("assignment"),
+            student=OuterRef("student"),
+        )
+        return self.with_publish_info().alias(is_latest_submission=~Exists(later))
+
+
+@functools.cache
+def grader_host() -> str:
+    """Identify the machine (or container) this process runs on.
+
+    A grader's pid only means something on the host that started it, and only
+    until that host reboots, so this is its hostname and kernel boot id.
+    """
+    try:
+        boot_id = Path("/proc/sys/kernel/random/boot_id").read_text("utf-8").strip()
+    except OSError:
+        boot_id = str(psutil.boot_time())
+    return f"{socket.gethostname()}:{boot_id}"
 
 
 def upload_submission_file_path(submission, _) -> str:  # pylint: disable=unused-argument
@@ -65,6 +292,47 @@ def upload_submission_file_path(submission, _) -> str:  # pylint: disable=unused
         )
 
 
+class _TextCache:
+    """Recently read submission texts, up to ``SUBMISSION_TEXT_CACHE_BYTES`` of them.
+
+    Texts are kept by path and modification time, so a changed file is read again.
+    """
+
+    def __init__(self):
+        # (text, size) for each text, least recently used first
+        self.texts: OrderedDict[tuple[str, int], tuple[str, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def read(self, path: str) -> str:
+        key = (path, os.stat(path).st_mtime_ns)
+        with self.lock:
+            if key in self.texts:
+                self.texts.move_to_end(key)
+                return self.texts[key][0]
+
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f_obj:
+            data = f_obj.read()
+        text = data.decode()
+
+        limit = settings.SUBMISSION_TEXT_CACHE_BYTES
+        # one large file shouldn't push out everything else
+        if len(data) > limit // 8:
+            return text
+        with self.lock:
+            if key not in self.texts:
+                self.texts[key] = (text, len(data))
+                self.size += len(data)
+            while self.size > limit:
+                _, (_, size) = self.texts.popitem(last=False)
+                self.size -= size
+        return text
+
+
+_text_cache = _TextCache()
+
+
 class Submission(models.Model):
     """A single submission for an assignment."""
 
@@ -82,15 +350,29 @@ class Submission(models.Model):
 
     complete = models.BooleanField(default=False)
 
-    # If this is set to True, it will make the Celery task kill the submission
+    # Set by request_kill(), which also signals the Celery task to kill the submission
     kill_requested = models.BooleanField(default=False)
 
     grader_pid = models.IntegerField(null=True, default=None, blank=True)
+    # The grader_host() that grader_pid belongs to
+    grader_host = models.CharField(max_length=255, blank=True)
     grader_start_time = models.FloatField(null=True, default=None, blank=True)
 
     points_received = models.DecimalField(max_digits=6, decimal_places=3, null=True, blank=True)
 
+    # The sum of the comments' point overrides, kept up to date by signals.py
+    points_override_total = models.DecimalField(max_digits=9, decimal_places=3, default=0)
+
+    # Set when the result was reused from an identical submission, instead of running the grader
+    graded_from_cache = models.BooleanField(default=False)
+
+    # The assignment's grader_version() when it was last graded
+    grader_version = models.CharField(max_length=64, blank=True)
+
     file = models.FileField(upload_to=upload_submission_file_path, null=True)
+    # The digest of the submitted code in blobs.py. Older submissions only have a
+    # backup copy at backup_file_path.
+    blob_digest = models.CharField(max_length=64, blank=True)
 
     grader_output = models.CharField(max_length=10 * 1024, blank=True)
     grader_errors = models.CharField(max_length=4 * 1024, blank=True)
@@ -99,6 +381,26 @@ class Submission(models.Model):
 
     class Meta:
         get_latest_by = "date_submitted"
+        indexes = [
+            # a student's submissions to an assignment, newest first, which is also how
+            # the per-student window functions partition and order them
+            models.Index(
+                fields=["assignment", "student", "-date_submitted"],
+                name="submission_student_latest",
+            ),
+            # the rate limit counts a student's recent submissions
+            models.Index(fields=["student", "date_submitted"], name="submission_student_recent"),
+            # few submissions are incomplete at once; they are counted per student before
+            # each submission, and swept by the reaper
+            models.Index(
+                fields=["student"], condition=Q(complete=False), name="submission_student_running"
+            ),
+            models.Index(
+                fields=["grader_start_time"],
+                condition=Q(complete=False),
+                name="submission_running_started",
+            ),
+        ]
 
     def __str__(self):
         return "{}{} [{}]: {} ({})".format(
@@ -131,7 +433,15 @@ class Submission(models.Model):
 
     @property
     def point_override(self):
-        return sum(c.point_override for c in self.comments.all() if c.point_override)
+        if hasattr(self, "point_override_sum"):
+            return self.point_override_sum
+        return self.points_override_total
+
+    @property
+    def comment_count(self) -> int:
+        if hasattr(self, "num_comments"):
+            return self.num_comments
+        return self.comments.count()
 
     @property
     def points(self):
@@ -165,6 +475,10 @@ class Submission(models.Model):
         language = "P" if self.assignment.filename.endswith(".py") else "J"
 
         course = self.assignment.course
+        if hasattr(self.student, "header_periods"):
+            periods = [p for p in self.student.header_periods if p.course_id == course.id]
+        else:
+            periods = self.student.periods.filter(course=course)
 
         header_template = "\n".join(
             (
@@ -183,7 +497,7 @@ class Submission(models.Model):
             "// " if language == "J" else "# ",
             course.name,
             self.assignment.name,
-            ", ".join(p.name for p in self.student.periods.filter(course=course)),
+            ", ".join(p.name for p in periods),
             self.student.full_name,
             self.student.username,
             timezone.localtime(self.date_submitted).strftime("%D (%B %e, %Y) %-I:%M %P"),
@@ -197,8 +511,8 @@ class Submission(models.Model):
             return None
 
         try:
-            with open(self.backup_file_path) as f:
-                file_text = f.read()
+            path = self.stored_file_path()
+            file_text = _text_cache.read(path)
         except OSError:
             file_text = "[Error accessing submission file]"
 
@@ -237,68 +551,118 @@ class Submission(models.Model):
 
         return os.path.join(settings.MEDIA_ROOT, "submission-backups", self.file.name)
 
-    def save_file(self, submission_text: str) -> None:
-        """Save the student's code submission to a file
+    def stored_file_path(self) -> str:
+        """Get the path to the stored copy of the submitted code.
 
-        .. warning::
+        That is its blob (which is gzipped), or for older submissions, their backup copy.
 
-            Writing to files in directories not controlled by us without some
-            form of sandboxing is a security risk. Most notably, users can use symbolic
-            links to trick you into writing to another file, outside the directory.
-            This solution is very hacky, but we don't have another good way of
-            doing this.
+        Raises:
+            OSError: If the submission has no stored copy
+        """
+        if self.blob_digest:
+            return blobs.find_blob(self.blob_digest)
+        if not self.file:
+            raise FileNotFoundError(f"Submission {self.id} has no file")
+        return self.backup_file_path
 
+    def open_file(self) -> BinaryIO:
+        """Open the submitted code for reading.
+
+        Raises:
+            OSError: If the submission can't be read
+        """
+        path = self.stored_file_path()
+        return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+    def save_file(self, submission_text: str) -> None:
+        """Save the student's code submission to a file
+
+        The code is stored in :mod:`.blobs`, and a working copy for the grader is
+        written with :func:`.files.write_file`, so that symbolic links left in the
+        assignment's directory can't redirect it elsewhere.
         """
         fname = upload_submission_file_path(self, "")
+        data = submission_text.encode()
 
         self.file.name = fname
+        self.blob_digest = blobs.store(data, roots=(blobs.PRIMARY,))
         self.save()
 
-        fpath = self.file_path
-
-        os.makedirs(os.path.dirname(fpath), exist_ok=True)
-
-        args = get_assignment_sandbox_args(
-            ["sh", "-c", 'cat >"$1"', "sh", fpath],
-            network_access=False,
-            whitelist=[os.path.dirname(fpath)],
-        )
-
-        try:
-            subprocess.run(
-                args,
-                input=submission_text,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                encoding="utf-8",
-                text=True,
-                check=True,
-            )
-        except FileNotFoundError as e:
-            logger.error("Cannot run processes: %s", e)
-            raise FileNotFoundError from e
+        files.write_file(fname, data)
 
     def create_backup_copy(self, submission_text: str) -> None:
-        """Create a backup copy of the student's code submission"""
-        backup_fpath = self.backup_file_path
+        """Create a backup copy of the student's code submission
 
-        if backup_fpath is None:
-            raise ValueError
-
-        os.makedirs(os.path.dirname(backup_fpath), mode=0o755, exist_ok=True)
-
-        with open(backup_fpath, "w", encoding="utf-8") as f_obj:
-            f_obj.write(submission_text)
+        The backup is the replica of its blob, which is shared with any identical
+        submissions.
+        """
+        digest = blobs.store(submission_text.encode())
+        if digest != self.blob_digest:
+            self.blob_digest = digest
+            self.save(update_fields=["blob_digest"])
 
-    def rerun(self) -> Signature:
-        from .tasks import run_submission  # noqa: PLC0415
+    def rerun(self) -> None:
+        """Reset the submission to be graded again.
 
+        It still has to be queued with :func:`.scheduler.schedule`. Its last grader is
+        forgotten, so it isn't reaped while it waits in the queue.
+        """
         self.complete = False
         self.has_been_graded = False
+        self.graded_from_cache = False
         self.last_run = timezone.now()
-        self.save()
+        self.grader_pid = None
+        self.grader_host = ""
+        self.grader_start_time = None
+        self.save(
+            update_fields=[
+                "complete",
+                "has_been_graded",
+                "graded_from_cache",
+                "last_run",
+                "grader_pid",
+                "grader_host",
+                "grader_start_time",
+            ]
+        )
+
+    def grader_cache_key(self, grader_version: str | None = None) -> str:
+        """Get a digest of everything that goes into grading the submission.
+
+        That is the assignment's :meth:`~.Assignment.grader_version`, the submission
+        (by its contents) and the student's username, which graders are given.
+
+        Args:
+            grader_version: The assignment's grader version, if it is already known
+
+        Raises:
+            OSError: If the submission can't be read
+        """
+        if grader_version is None:
+            grader_version = self.assignment.grader_version()
+
+        digest = hashlib.sha256()
+        for value in (
+            str(CachedGraderResult.VERSION).encode(),
+            grader_version.encode(),
+            Path(self.file_path).read_bytes(),
+            self.student.username.encode(),
+        ):
+            # prefix the length, so that values can't run together
+            digest.update(len(value).to_bytes(8) + value)
+        return digest.hexdigest()
+
+    def request_kill(self) -> None:
+        """Kill the submission if it is running.
+
+        The grader running the submission is listening on :attr:`control_channel_name`,
+        so it is killed as soon as the message is published.
+        """
+        self.kill_requested = True
+        self.save(update_fields=["kill_requested"])
 
-        return run_submission.s(self.id)
+        with redis.Redis.from_url(settings.SUBMISSION_REDIS_URL) as conn:
+            conn.publish(self.control_channel_name, "kill")
 
     @property
     def rerun_color(self):
@@ -314,6 +678,14 @@ class Submission(models.Model):
     def channel_group_name(self) -> str:
         return f"submission-{self.id}"
 
+    @property
+    def control_channel_name(self) -> str:
+        return f"submission-{self.id}-control"
+
+    @property
+    def live_output_key(self) -> str:
+        return f"submission-{self.id}-output"
+
     @property
     def is_latest(self):
         submissions = Submission.objects.filter(assignment=self.assignment, student=self.student)
@@ -321,12 +693,19 @@ class Submission(models.Model):
 
     @property
     def is_published(self):
+        if hasattr(self, "latest_publish_id"):
+            # loaded by SubmissionQuerySet.with_publish_info()
+            return self.published_submission is not None
+
         return PublishedSubmission.objects.filter(
             assignment=self.assignment, student=self.student, submission=self
         ).exists()
 
     @property
     def is_latest_publish(self):
+        if hasattr(self, "latest_publish_id"):
+            return self.latest_publish_id == self.id
+
         latest_publish = PublishedSubmission.objects.filter(
             assignment=self.assignment, student=self.student
         )
@@ -334,6 +713,9 @@ class Submission(models.Model):
 
     @property
     def published_submission(self):
+        if hasattr(self, "latest_publish_id"):
+            return getattr(self, "final_submission", None)
+
         submissions = PublishedSubmission.objects.filter(
             student=self.student, assignment=self.assignment, submission=self
         )
@@ -379,6 +761,50 @@ class PublishedSubmission(models.Model):
         return cls.objects.filter(student=student, assignment=assignment).order_by("-date")
 
 
+class CachedGraderResult(models.Model):
+    """The result of grading a submission, to reuse for identical ones.
+
+    Results are looked up by :meth:`.Submission.grader_cache_key`, and only kept
+    for assignments with :attr:`~.Assignment.cache_grader_results` set.
+    """
+
+    # Change this to stop reusing results from before
+    VERSION = 1
+
+    key = models.CharField(max_length=64, unique=True)
+
+    points_received = models.DecimalField(max_digits=6, decimal_places=3, null=True, blank=True)
+    has_been_graded = models.BooleanField(default=False)
+    grader_output = models.CharField(max_length=10 * 1024, blank=True)
+    grader_errors = models.CharField(max_length=4 * 1024, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__}({self.key})"
+
+    @classmethod
+    def save_result(cls, key: str, submission: Submission) -> None:
+        """Keep the result of grading ``submission``."""
+        cls.objects.update_or_create(
+            key=key,
+            defaults={
+                "points_received": submission.points_received,
+                "has_been_graded": submission.has_been_graded,
+                "grader_output": submission.grader_output,
+                "grader_errors": submission.grader_errors,
+            },
+        )
+
+    def apply_to(self, submission: Submission) -> None:
+        """Give ``submission`` this result, as if its grader had been run."""
+        submission.points_received = self.points_received
+        submission.has_been_graded = self.has_been_graded
+        submission.grader_output = self.grader_output
+        submission.grader_errors = self.grader_errors
+        submission.graded_from_cache = True
+
+
 class Comment(models.Model):
     """A comment on a submission by a user"""
 
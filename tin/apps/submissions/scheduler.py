@@ -0,0 +1,226 @@
+"""Schedules grading, so that no course can starve the others.
+
+Instead of going straight to Celery, submissions wait in Redis, in a queue per lane
+and course, until :func:`dispatch` sends them on. Lanes are served in priority order,
+the courses with waiting submissions take turns within a lane, and no more than the
+``GRADING_*_CONCURRENCY_LIMIT`` settings allow are sent to be graded at once.
+
+Every running submission holds a slot until :func:`finish` is called. In case its
+worker died, the slot is given up anyway a while after its grader should have
+timed out.
+"""
+
+import json
+import time
+from collections.abc import Iterable
+
+import redis
+from django.conf import settings
+
+#: Submissions students (or teachers) are waiting on
+INTERACTIVE = "interactive"
+#: Reruns of whole periods or courses
+BULK = "bulk"
+
+#: The lanes, highest priority first
+LANES = (INTERACTIVE, BULK)
+
+# only this many submissions at the front of a course's queue are considered,
+# when looking for one whose assignment isn't at its limit
+SCAN_DEPTH = 200
+
+
+def _key(*parts) -> str:
+    return ":".join(str(part) for part in (settings.GRADING_QUEUE_PREFIX, *parts))
+
+
+def _connect() -> redis.Redis:
+    return redis.Redis.from_url(settings.SUBMISSION_REDIS_URL, decode_responses=True)
+
+
+def _lock(conn: redis.Redis):
+    return conn.lock(_key("lock"), timeout=30, blocking_timeout=30)
+
+
+def _running(conn: redis.Redis, key: str, now: float) -> int:
+    """Count the slots in ``key`` that haven't expired."""
+    conn.zremrangebyscore(key, "-inf", now)
+    return conn.zcard(key)
+
+
+def _lane_limit(lane: str) -> int:
+    if lane == BULK:
+        return settings.GRADING_BULK_CONCURRENCY_LIMIT
+    return settings.GRADING_CONCURRENCY_LIMIT
+
+
+def schedule(submissions: Iterable, lane: str = INTERACTIVE) -> None:
+    """Queue submissions to be graded, and dispatch as many as can be.
+
+    Args:
+        submissions: The submissions to grade. Their assignments should be loaded,
+            since they are used to find the course and grader timeout.
+        lane: Which of :data:`LANES` to queue them in
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown grading lane {lane!r}")
+
+    with _connect() as conn:
+        with _lock(conn):
+            pipe = conn.pipeline()
+            courses = []
+            for submission in submissions:
+                assignment = submission.assignment
+                job = json.dumps([submission.id, assignment.id, assignment.grader_timeout])
+                pipe.rpush(_key("lane", lane, "course", assignment.course_id), job)
+                if assignment.course_id not in courses:
+                    courses.append(assignment.course_id)
+            pipe.execute()
+
+            # the courses that just got their first waiting submission join the rotation
+            ring = _key("lane", lane, "courses")
+            queued = set(conn.lrange(ring, 0, -1))
+            new_courses = [course_id for course_id in courses if str(course_id) not in queued]
+            if new_courses:
+                conn.rpush(ring, *new_courses)
+
+        dispatch(conn)
+
+
+def _pop_runnable(conn: redis.Redis, lane: str, course_id: str, now: float):
+    """Take the first submission in the course's queue that may run right now."""
+    if (
+        _running(conn, _key("running", "course", course_id), now)
+        >= settings.GRADING_COURSE_CONCURRENCY_LIMIT
+    ):
+        return None
+
+    queue = _key("lane", lane, "course", course_id)
+    full_assignments = set()
+    for job in conn.lrange(queue, 0, SCAN_DEPTH - 1):
+        submission_id, assignment_id, timeout = json.loads(job)
+        if assignment_id in full_assignments:
+            continue
+        if (
+            _running(conn, _key("running", "assignment", assignment_id), now)
+            >= settings.GRADING_ASSIGNMENT_CONCURRENCY_LIMIT
+        ):
+            full_assignments.add(assignment_id)
+            continue
+
+        conn.lrem(queue, 1, job)
+        if not conn.llen(queue):
+            conn.lrem(_key("lane", lane, "courses"), 0, course_id)
+
+        deadline = now + timeout + settings.GRADING_SLOT_GRACE_PERIOD
+        for key in (
+            _key("running"),
+            _key("running", "lane", lane),
+            _key("running", "course", course_id),
+            _key("running", "assignment", assignment_id),
+        ):
+            conn.zadd(key, {submission_id: deadline})
+        return submission_id
+
+    return None
+
+
+def dispatch(conn: redis.Redis | None = None) -> list[int]:
+    """Send waiting submissions to Celery, for as long as there are free slots.
+
+    Returns:
+        The ids of the submissions that were sent.
+    """
+    from .tasks import run_submission  # noqa: PLC0415
+
+    if conn is None:
+        with _connect() as new_conn:
+            return dispatch(new_conn)
+
+    dispatched = []
+    with _lock(conn):
+        now = time.time()
+        running = _running(conn, _key("running"), now)
+        for lane in LANES:
+            ring = _key("lane", lane, "courses")
+            lane_running = _running(conn, _key("running", "lane", lane), now)
+
+            # take turns, one submission per course per round, until nothing can run
+            progress = True
+            while progress:
+                progress = False
+                for _ in range(conn.llen(ring)):
+                    if running >= settings.GRADING_CONCURRENCY_LIMIT or lane_running >= _lane_limit(
+                        lane
+                    ):
+                        break
+                    course_id = conn.lmove(ring, ring, "LEFT", "RIGHT")
+                    if course_id is None:
+                        break
+                    submission_id = _pop_runnable(conn, lane, course_id, now)
+                    if submission_id is not None:
+                        dispatched.append(submission_id)
+                        running += 1
+                        lane_running += 1
+                        progress = True
+
+    for submission_id in dispatched:
+        run_submission.apply_async((submission_id,))
+    return dispatched
+
+
+def finish(submission) -> None:
+    """Free the grading slot of a submission, and dispatch the next one."""
+    with _connect() as conn:
+        pipe = conn.pipeline()
+        pipe.zrem(_key("running"), submission.id)
+        for lane in LANES:
+            pipe.zrem(_key("running", "lane", lane), submission.id)
+        pipe.zrem(_key("running", "course", submission.assignment.course_id), submission.id)
+        pipe.zrem(_key("running", "assignment", submission.assignment_id), submission.id)
+        pipe.execute()
+
+        dispatch(conn)
+
+
+def queue_depths() -> dict[str, dict]:
+    """Get how many submissions are waiting and running in each lane.
+
+    Returns:
+        A dictionary mapping each lane to a dictionary with the number of
+        ``waiting`` and ``running`` submissions, and the number waiting per
+        course (``courses``).
+    """
+    now = time.time()
+    depths = {}
+    with _connect() as conn:
+        for lane in LANES:
+            courses = {
+                int(course_id): conn.llen(_key("lane", lane, "course", course_id))
+                for course_id in conn.lrange(_key("lane", lane, "courses"), 0, -1)
+            }
+            depths[lane] = {
+                "waiting": sum(courses.values()),
+                "running": _running(conn, _key("running", "lane", lane), now),
+                "courses": courses,
+            }
+    return depths
+
+
+def record_reaped(counts: dict[str, int]) -> None:
+    """Add to the totals of submissions that were found dead or timed out.
+
+    Args:
+        counts: How many submissions were reaped, by reason
+    """
+    with _connect() as conn:
+        pipe = conn.pipeline()
+        for reason, count in counts.items():
+            pipe.hincrby(_key("reaped"), reason, count)
+        pipe.execute()
+
+
+def reaped_totals() -> dict[str, int]:
+    """Get how many submissions have been reaped so far, by reason."""
+    with _connect() as conn:
+        return {reason: int(count) for reason, count in conn.hgetall(_key("reaped")).items()}
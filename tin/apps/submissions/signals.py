@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+
+from .models import Comment, Submission
+
+
+def update_points_override_total(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Keep the submission's :attr:`~.Submission.points_override_total` up to date."""
+    Submission.objects.filter(id=instance.submission_id).update_points_override_totals()
+    if Comment.submission.is_cached(instance):
+        instance.submission.refresh_from_db(fields=["points_override_total"])
+
+
+post_save.connect(update_points_override_total, sender=Comment)
+post_delete.connect(update_points_override_total, sender=Comment)
@@ -1,16 +1,20 @@
 import contextlib
+import json
 import logging
 import os
 import re
 import select
 import signal
 import subprocess
+import threading
 import time
 import traceback
 from decimal import Decimal
 from pathlib import Path
 
 import psutil
+import redis
+import redis.asyncio
 from asgiref.sync import async_to_sync
 from celery import shared_task
 from channels.layers import get_channel_layer
@@ -18,8 +22,10 @@ from django.conf import settings
 from django.utils import timezone
 
 from ... import sandboxing
-from ...sandboxing import get_assignment_sandbox_args
-from .models import Submission
+from . import files, scheduler
+from .grader_pool import get_grader_pool
+from .models import CachedGraderResult, Submission, grader_host
+from .utils import serialize_submission_info
 
 logger = logging.getLogger(__name__)
 
@@ -31,12 +37,274 @@ _SUBMISSION_ENV_ALLOWLIST = frozenset(
     {"PATH", "HOME", "LANG", "LANGUAGE", "LC_ALL", "LC_CTYPE", "TZ", "TERM"}
 )
 
+# The fields of a submission that grading sets. Only these are saved, so that anything
+# else changed while it is graded (like the total of its point overrides) is kept.
+_GRADING_FIELDS = [
+    "grader_version",
+    "points_received",
+    "has_been_graded",
+    "graded_from_cache",
+    "grader_output",
+    "grader_errors",
+    "kill_requested",
+    "complete",
+    "grader_pid",
+]
+
 
 def truncate_output(text, field_name):
     max_len = Submission._meta.get_field(field_name).max_length
     return ("..." + text[-max_len + 5 :]) if len(text) > max_len else text
 
 
+def send_submission_message(submission: Submission, message: dict) -> None:
+    """Send a message to every websocket watching a submission.
+
+    The message is encoded here, once with ``grader_errors`` and once without it for
+    watchers who may not see them, so consumers only have to pick one and forward it.
+    """
+    public_message = {key: value for key, value in message.items() if key != "grader_errors"}
+    async_to_sync(get_channel_layer().group_send)(
+        submission.channel_group_name,
+        {
+            "type": "submission.message",
+            "text": json.dumps(message),
+            "public_text": json.dumps(public_message),
+        },
+    )
+
+
+async def aget_live_output(submission: Submission) -> dict | None:
+    """Get the latest snapshot of a running submission's output.
+
+    Returns:
+        A dict with ``seq``, ``grader_output`` and ``grader_errors``, or ``None`` if the
+        grader has not sent any output yet (or has finished).
+    """
+    async with redis.asyncio.Redis.from_url(settings.SUBMISSION_REDIS_URL) as conn:
+        snapshot = await conn.get(submission.live_output_key)
+    return json.loads(snapshot) if snapshot is not None else None
+
+
+class GraderOutputStream:
+    """Batches the output of a running grader.
+
+    New output is sent to the submission's channel group as a delta at most once every
+    ``SUBMISSION_OUTPUT_FLUSH_INTERVAL`` seconds, or as soon as
+    ``SUBMISSION_OUTPUT_FLUSH_SIZE`` characters are waiting. The database is only
+    written at checkpoints, every ``SUBMISSION_OUTPUT_CHECKPOINT_INTERVAL`` seconds.
+
+    Deltas are numbered so that clients can tell when they missed one, and a snapshot
+    of the output so far is kept in Redis (see :func:`aget_live_output`) for them to
+    resync from.
+    """
+
+    def __init__(self, submission: Submission):
+        self.submission = submission
+        self.output = ""
+        self.errors = ""
+        self.sequence = 0
+
+        self._sent_output = 0
+        self._sent_errors = 0
+        self._last_flush = self._last_checkpoint = time.monotonic()
+        self._redis = redis.Redis.from_url(settings.SUBMISSION_REDIS_URL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._redis.delete(self.submission.live_output_key)
+        self._redis.close()
+
+    @property
+    def pending(self) -> int:
+        """The number of characters that have not been sent yet."""
+        return len(self.output) - self._sent_output + len(self.errors) - self._sent_errors
+
+    def write(self, output: str = "", errors: str = "") -> None:
+        self.output += output
+        self.errors += errors
+
+    def seconds_until_flush(self) -> float:
+        if not self.pending:
+            return float("inf")
+        return self._last_flush + settings.SUBMISSION_OUTPUT_FLUSH_INTERVAL - time.monotonic()
+
+    def seconds_until_checkpoint(self) -> float:
+        return (
+            self._last_checkpoint
+            + settings.SUBMISSION_OUTPUT_CHECKPOINT_INTERVAL
+            - time.monotonic()
+        )
+
+    def maybe_flush(self) -> None:
+        """Flush if enough output is waiting, or if it has been waiting long enough."""
+        if self.pending >= settings.SUBMISSION_OUTPUT_FLUSH_SIZE or self.seconds_until_flush() <= 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send any new output to everyone watching the submission."""
+        self._last_flush = time.monotonic()
+        if not self.pending:
+            return
+
+        self.sequence += 1
+        message = {
+            "type": "output",
+            "seq": self.sequence,
+            "grader_output": self.output[self._sent_output :].replace("\0", ""),
+            "grader_errors": self.errors[self._sent_errors :].replace("\0", ""),
+        }
+        self._sent_output = len(self.output)
+        self._sent_errors = len(self.errors)
+
+        # Update the snapshot first, so that a client that resyncs after seeing this
+        # delta gets a snapshot that includes it
+        self._redis.set(
+            self.submission.live_output_key,
+            json.dumps(
+                {
+                    "seq": self.sequence,
+                    "grader_output": truncate_output(
+                        self.output.replace("\0", ""), "grader_output"
+                    ),
+                    "grader_errors": truncate_output(
+                        self.errors.replace("\0", ""), "grader_errors"
+                    ),
+                }
+            ),
+            ex=24 * 60 * 60,
+        )
+        send_submission_message(self.submission, message)
+
+    def checkpoint(self) -> None:
+        """Flush, and save the output so far to the database."""
+        self.flush()
+        self._last_checkpoint = time.monotonic()
+
+        self.submission.grader_output = truncate_output(
+            self.output.replace("\0", ""), "grader_output"
+        )
+        self.submission.grader_errors = truncate_output(
+            self.errors.replace("\0", ""), "grader_errors"
+        )
+        self.submission.save(update_fields=["grader_output", "grader_errors"])
+
+
+class KillListener:
+    """Listens for kill requests sent by :meth:`.Submission.request_kill`.
+
+    A background thread waits on the submission's control channel and, when a kill
+    request arrives, makes this object readable so that a :func:`select.select` on it
+    wakes up immediately.
+    """
+
+    def __init__(self, submission: Submission):
+        self.submission = submission
+        self.kill_requested = threading.Event()
+
+        self._stopped = threading.Event()
+        self._read_fd, self._write_fd = os.pipe()
+        self._pubsub = redis.Redis.from_url(settings.SUBMISSION_REDIS_URL).pubsub(
+            ignore_subscribe_messages=True
+        )
+
+    def __enter__(self):
+        self._pubsub.subscribe(self.submission.control_channel_name)
+        threading.Thread(target=self._listen, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        os.close(self._read_fd)
+
+    def fileno(self) -> int:
+        return self._read_fd
+
+    def _listen(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                message = self._pubsub.get_message(timeout=1)
+                if message is not None and message["data"] == b"kill":
+                    self.kill_requested.set()
+                    with contextlib.suppress(OSError):
+                        os.write(self._write_fd, b"\0")
+        finally:
+            self._pubsub.close()
+            os.close(self._write_fd)
+
+
+def start_grader(
+    python_exe: str,
+    argv: list[str],
+    *,
+    cwd: str,
+    env: dict[str, str],
+    sandbox_options: dict | None,
+) -> subprocess.Popen:
+    """Start a grader, in its own process group.
+
+    With ``GRADER_POOL_ENABLED``, it runs in a warm interpreter from the
+    :class:`.GraderPool` if one is ready.
+    """
+    if settings.GRADER_POOL_ENABLED:
+        return get_grader_pool().popen(
+            python_exe, argv, cwd=cwd, env=env, sandbox_options=sandbox_options
+        )
+
+    args = [python_exe, "-u", *argv]
+    if sandbox_options is not None:
+        args = sandboxing.get_assignment_sandbox_args(args, **sandbox_options)
+
+    return subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        bufsize=0,
+        cwd=cwd,
+        preexec_fn=os.setpgrp,  # noqa: PLW1509
+        env=env,
+    )
+
+
+@shared_task
+def reap_submissions():
+    """Mark the submissions whose grader died or timed out as complete.
+
+    Celery beat runs this every minute (see ``CELERY_BEAT_SCHEDULE``), so that
+    students aren't held back by ``CONCURRENT_USER_SUBMISSION_LIMIT`` when a worker
+    dies. It also dispatches the grading queue, in case it stalled.
+
+    Only the graders started on the host of the worker this runs on are checked for
+    having died (see :meth:`.SubmissionQuerySet.reap_dead`). Those on other hosts are
+    checked when it runs there, and otherwise reaped once they time out.
+    """
+    reaped = {
+        "dead": Submission.objects.reap_dead(),
+        "timed_out": Submission.objects.reap_timed_out(),
+    }
+    reaped_ids = [submission_id for ids in reaped.values() for submission_id in ids]
+    if reaped_ids:
+        for submission in Submission.objects.filter(id__in=reaped_ids).select_related("assignment"):
+            send_submission_message(
+                submission, {"type": "snapshot", "seq": 0, **serialize_submission_info(submission)}
+            )
+            scheduler.finish(submission)
+
+        scheduler.record_reaped({reason: len(ids) for reason, ids in reaped.items()})
+        logger.info(
+            "Reaped %d dead and %d timed out submissions",
+            len(reaped["dead"]),
+            len(reaped["timed_out"]),
+        )
+
+    # slots held by graders that died are only freed when the queue is dispatched,
+    # which otherwise waits for the next submission to be scheduled or finish
+    scheduler.dispatch()
+
+
 @shared_task
 def run_submission(submission_id):
     submission = Submission.objects.select_related(
@@ -44,6 +312,31 @@ def run_submission(submission_id):
     ).get(id=submission_id)
 
     try:
+        _grade_submission(submission)
+    finally:
+        # hand this submission's grading slot to the next one
+        scheduler.finish(submission)
+
+
+def _grade_submission(submission):
+    cache_key = None
+    try:
+        grader_version = submission.assignment.grader_version()
+        submission.grader_version = grader_version
+        if submission.assignment.cache_grader_results:
+            cache_key = submission.grader_cache_key(grader_version)
+            cached_result = CachedGraderResult.objects.filter(key=cache_key).first()
+            if cached_result is not None:
+                cached_result.apply_to(submission)
+                submission.complete = True
+                submission.save(update_fields=_GRADING_FIELDS)
+
+                send_submission_message(
+                    submission,
+                    {"type": "snapshot", "seq": 0, **serialize_submission_info(submission)},
+                )
+                return
+
         grader_path = os.path.join(settings.MEDIA_ROOT, submission.assignment.grader_file.name)
         grader_log_path = os.path.join(
             settings.MEDIA_ROOT, submission.assignment.grader_log_filename
@@ -52,25 +345,6 @@ def run_submission(submission_id):
 
         submission_wrapper_path = submission.wrapper_file_path
 
-        args = get_assignment_sandbox_args(
-            ["mkdir", "-p", "--", os.path.dirname(submission_wrapper_path)],
-            network_access=False,
-            whitelist=[os.path.dirname(os.path.dirname(submission_wrapper_path))],
-        )
-
-        try:
-            subprocess.run(
-                args,
-                stdin=subprocess.DEVNULL,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True,
-            )
-        except FileNotFoundError as e:
-            logger.error("Cannot run processes: %s", e)
-            raise FileNotFoundError from e
-
         if submission.assignment.venv_fully_created:
             python_exe = os.path.join(submission.assignment.venv.path, "bin", "python")
         else:
@@ -106,10 +380,9 @@ def run_submission(submission_id):
             python=python_exe,
         )
 
-        with open(submission_wrapper_path, "w", encoding="utf-8") as f_obj:
-            f_obj.write(wrapper_text)
-
-        os.chmod(submission_wrapper_path, 0o700)
+        files.write_file(
+            os.path.relpath(submission_wrapper_path, settings.MEDIA_ROOT), wrapper_text, mode=0o700
+        )
     except OSError:
         submission.grader_output = (
             "An internal error occurred. Please try again.\n"
@@ -119,13 +392,14 @@ def run_submission(submission_id):
             traceback.format_exc().replace("\0", ""), "grader_errors"
         )
         submission.complete = True
-        submission.save()
+        submission.save(update_fields=_GRADING_FIELDS)
 
-        async_to_sync(get_channel_layer().group_send)(
-            submission.channel_group_name, {"type": "submission.updated"}
+        send_submission_message(
+            submission, {"type": "snapshot", "seq": 0, **serialize_submission_info(submission)}
         )
         return
 
+    stream = GraderOutputStream(submission)
     try:
         retcode = None
         killed = False
@@ -141,9 +415,7 @@ def run_submission(submission_id):
             java_runner = os.path.join(
                 settings.BASE_DIR, "sandboxing", "utils", "J", "Java_Grader.py"
             )
-            args = [
-                python_exe,
-                "-u",
+            argv = [
                 java_runner,
                 submission_wrapper_path,
                 submission_path,
@@ -152,9 +424,7 @@ def run_submission(submission_id):
                 grader_path,  # the teacher's Grader.java (JUnit test class)
             ]
         else:
-            args = [
-                python_exe,
-                "-u",
+            argv = [
                 grader_path,
                 submission_wrapper_path,
                 submission_path,
@@ -162,9 +432,14 @@ def run_submission(submission_id):
                 grader_log_path,
             ]
 
+        sandbox_options = None
         if settings.IS_FIREJAIL_PRESENT and settings.IS_SANDBOXING_MODULE_PRESENT:
             whitelist = [os.path.dirname(grader_path)]
-            read_only = [grader_path, submission_path, os.path.dirname(submission_wrapper_path)]
+            if settings.GRADER_POOL_ENABLED:
+                # warm graders are sandboxed before the submission is known
+                read_only = [grader_path]
+            else:
+                read_only = [grader_path, submission_path, os.path.dirname(submission_wrapper_path)]
             if submission.assignment.venv_fully_created:
                 whitelist.append(submission.assignment.venv.path)
                 read_only.append(submission.assignment.venv.path)
@@ -175,13 +450,12 @@ def run_submission(submission_id):
                 whitelist.append(java_utils)
                 read_only.append(java_utils)
 
-            args = sandboxing.get_assignment_sandbox_args(
-                args,
-                network_access=submission.assignment.grader_has_network_access,
-                direct_network_access=False,
-                whitelist=whitelist,
-                read_only=read_only,
-            )
+            sandbox_options = {
+                "network_access": submission.assignment.grader_has_network_access,
+                "direct_network_access": False,
+                "whitelist": whitelist,
+                "read_only": read_only,
+            }
 
         # Only hand graders/submissions a curated, non-sensitive environment.
         # os.environ.copy() would pass the whole worker environment (and any
@@ -190,27 +464,33 @@ def run_submission(submission_id):
         if submission.assignment.venv_fully_created:
             env.update(submission.assignment.venv.get_activation_env())
 
-        with subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.DEVNULL,
-            bufsize=0,
-            cwd=os.path.dirname(grader_path),
-            preexec_fn=os.setpgrp,  # noqa: PLW1509
-            env=env,
-        ) as proc:
+        with (
+            KillListener(submission) as kill_listener,
+            start_grader(
+                python_exe,
+                argv,
+                cwd=os.path.dirname(grader_path),
+                env=env,
+                sandbox_options=sandbox_options,
+            ) as proc,
+            stream,
+        ):
             start_time = time.time()
 
+            # Catch kill requests sent before we started listening
+            submission.refresh_from_db(fields=["kill_requested"])
+
             submission.grader_pid = proc.pid
+            submission.grader_host = grader_host()
             submission.grader_start_time = timezone.localtime().timestamp()
-            submission.save()
+            submission.save(update_fields=["grader_pid", "grader_host", "grader_start_time"])
 
             timed_out = False
 
             while proc.poll() is None:
-                submission.refresh_from_db()
-                submission.assignment.refresh_from_db()
+                if stream.seconds_until_checkpoint() <= 0:
+                    stream.checkpoint()
+
                 if submission.assignment.enable_grader_timeout:
                     time_elapsed = time.time() - start_time
                     timeout = submission.assignment.grader_timeout - time_elapsed
@@ -222,27 +502,27 @@ def run_submission(submission_id):
                 else:
                     timeout = 15
 
+                if kill_listener.kill_requested.is_set():
+                    submission.kill_requested = True
                 if submission.kill_requested:
                     break
 
-                files_ready = select.select([proc.stdout, proc.stderr], [], [], timeout)[0]
+                # wake up in time to send buffered output and to reach the next checkpoint
+                timeout = max(
+                    0,
+                    min(timeout, stream.seconds_until_flush(), stream.seconds_until_checkpoint()),
+                )
+
+                files_ready = select.select(
+                    [proc.stdout, proc.stderr, kill_listener], [], [], timeout
+                )[0]
                 if proc.stdout in files_ready:
-                    output += proc.stdout.read(8192).decode()
+                    stream.write(output=proc.stdout.read(8192).decode())
 
                 if proc.stderr in files_ready:
-                    errors += proc.stderr.read(8192).decode()
+                    stream.write(errors=proc.stderr.read(8192).decode())
 
-                submission.grader_output = truncate_output(
-                    output.replace("\0", ""), "grader_output"
-                )
-                submission.grader_errors = truncate_output(
-                    errors.replace("\0", ""), "grader_errors"
-                )
-                submission.save(update_fields=["grader_output", "grader_errors"])
-
-                async_to_sync(get_channel_layer().group_send)(
-                    submission.channel_group_name, {"type": "submission.updated"}
-                )
+                stream.maybe_flush()
 
             if proc.poll() is None:
                 killed = True
@@ -259,8 +539,8 @@ def run_submission(submission_id):
                     except psutil.NoSuchProcess:
                         pass
 
-            output += proc.stdout.read().decode()
-            errors += proc.stderr.read().decode()
+            output = stream.output + proc.stdout.read().decode()
+            errors = stream.errors + proc.stderr.read().decode()
 
             if killed:
                 msg = "[Grader timed out]" if timed_out else "[Grader killed]"
@@ -285,13 +565,13 @@ def run_submission(submission_id):
 
             submission.grader_output = truncate_output(output.replace("\0", ""), "grader_output")
             submission.grader_errors = truncate_output(errors.replace("\0", ""), "grader_errors")
-            submission.save()
+            submission.save(update_fields=_GRADING_FIELDS)
     except Exception:  # pylint: disable=broad-except  # noqa: BLE001
         submission.grader_output = "[Internal error]"
         submission.grader_errors = truncate_output(
             traceback.format_exc().replace("\0", ""), "grader_errors"
         )
-        submission.save()
+        submission.save(update_fields=_GRADING_FIELDS)
     else:
         if output and not killed and retcode == 0:
             last_line = output.splitlines()[-1]
@@ -305,13 +585,21 @@ def run_submission(submission_id):
                 if abs(score) < 1000:
                     submission.points_received = score
                     submission.has_been_graded = True
+
+        if cache_key is not None and not killed and retcode == 0:
+            CachedGraderResult.save_result(cache_key, submission)
     finally:
         submission.complete = True
         submission.grader_pid = None
-        submission.save()
-
-        async_to_sync(get_channel_layer().group_send)(
-            submission.channel_group_name, {"type": "submission.updated"}
+        submission.save(update_fields=_GRADING_FIELDS)
+
+        send_submission_message(
+            submission,
+            {
+                "type": "snapshot",
+                "seq": stream.sequence,
+                **serialize_submission_info(submission),
+            },
         )
 
         with contextlib.suppress(FileNotFoundError):
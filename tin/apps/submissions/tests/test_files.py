@@ -0,0 +1,52 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from ..files import make_dirs, write_file
+
+
+def test_write_file(settings):
+    media_root = Path(settings.MEDIA_ROOT)
+
+    write_file("assignment-1/student/submission.py", "print('hi')")
+    fpath = media_root / "assignment-1" / "student" / "submission.py"
+    assert fpath.read_text("utf-8") == "print('hi')"
+
+    write_file("assignment-1/student/submission.py", b"replaced", mode=0o700)
+    assert fpath.read_bytes() == b"replaced"
+    assert fpath.stat().st_mode & 0o777 == 0o700
+    # no temporary files are left behind
+    assert os.listdir(fpath.parent) == ["submission.py"]
+
+    make_dirs("assignment-1/student/wrappers")
+    assert (fpath.parent / "wrappers").is_dir()
+
+    for path in ("/etc/passwd", "assignment-1/../escaped", "assignment-1//file", ""):
+        with pytest.raises(ValueError, match="not a normalized path"):
+            write_file(path, "text")
+
+
+def test_write_file_symlinks(settings, tmp_path_factory):
+    media_root = Path(settings.MEDIA_ROOT)
+    outside = tmp_path_factory.mktemp("outside")
+    target = outside / "target"
+    target.write_text("untouched", "utf-8")
+
+    student_dir = media_root / "assignment-1" / "student"
+    student_dir.mkdir(parents=True)
+
+    # a link to a directory is refused
+    (student_dir / "wrappers").symlink_to(outside)
+    with pytest.raises(OSError, match=r"Not a directory|symbolic links"):
+        write_file("assignment-1/student/wrappers/target", "overwritten")
+    with pytest.raises(OSError, match=r"Not a directory|symbolic links"):
+        make_dirs("assignment-1/student/wrappers")
+
+    # a link to a file is replaced, not followed
+    (student_dir / "submission.py").symlink_to(target)
+    write_file("assignment-1/student/submission.py", "submission")
+    assert not (student_dir / "submission.py").is_symlink()
+    assert (student_dir / "submission.py").read_text("utf-8") == "submission"
+
+    assert target.read_text("utf-8") == "untouched"
@@ -1,6 +1,18 @@
+import gzip
+import io
+import os
+import subprocess
+import time
+from decimal import Decimal
 from pathlib import Path
 
-from ..models import Submission, upload_submission_file_path
+import psutil
+from django.core.management import call_command
+
+from tin.apps.courses.models import Course
+
+from .. import blobs, models
+from ..models import Submission, grader_host, upload_submission_file_path
 
 
 def test_submission_save_file(settings, submission: Submission):
@@ -15,10 +27,225 @@ def test_submission_save_file(settings, submission: Submission):
     assert submission_path.exists()
 
 
-def test_make_submission_backup(submission: Submission):
+def test_make_submission_backup(settings, submission: Submission):
     submission.create_backup_copy("HI")
-    backup_file = submission.backup_file_path
-    assert backup_file is not None
-    backup_path = Path(backup_file)
+    backup_path = Path(settings.MEDIA_ROOT) / blobs.blob_path(blobs.REPLICA, submission.blob_digest)
     assert backup_path.exists()
-    assert backup_path.read_text("utf-8") == "HI"
+    assert gzip.decompress(backup_path.read_bytes()) == b"HI"
+
+    # the replica is used if the primary copy is lost
+    os.remove(Path(settings.MEDIA_ROOT) / blobs.blob_path(blobs.PRIMARY, submission.blob_digest))
+    submission.refresh_from_db()
+    assert submission.file_text == "HI"
+
+
+def test_submission_blobs(settings, assignment, student):
+    media_root = Path(settings.MEDIA_ROOT)
+    submissions = []
+    for _ in range(3):
+        submission = assignment.submissions.create(student=student)
+        submission.save_file("print('Hello World!')")
+        submission.create_backup_copy("print('Hello World!')")
+        submissions.append(submission)
+
+    # identical submissions share one blob, and one replica
+    assert len({s.blob_digest for s in submissions}) == 1
+    assert len(list(media_root.glob("blobs/*/*.gz"))) == 1
+    assert len(list(media_root.glob("submission-backups/blobs/*/*.gz"))) == 1
+    assert submissions[0].file_text == "print('Hello World!')"
+
+    # submissions from before the blob store are moved into it
+    legacy = submissions[0]
+    Submission.objects.filter(id=legacy.id).update(blob_digest="")
+    legacy.refresh_from_db()
+    backup_path = Path(legacy.backup_file_path)
+    backup_path.parent.mkdir(parents=True)
+    backup_path.write_text("legacy", "utf-8")
+    assert legacy.file_text == "legacy"
+
+    call_command("store_submission_blobs", "--delete-backups", stdout=io.StringIO())
+    legacy.refresh_from_db()
+    assert legacy.blob_digest == blobs.get_digest(b"legacy")
+    assert legacy.file_text == "legacy"
+    assert not backup_path.exists()
+
+
+def test_graded_per_student(assignment, course, student, django_user_model):
+    unpublished = django_user_model.objects.create(username="unpublished", is_student=True)
+    absent = django_user_model.objects.create(username="absent", is_student=True)
+
+    published = assignment.submissions.create(student=student)
+    published.publish()
+    assignment.submissions.create(student=student)
+    assignment.submissions.create(student=unpublished)
+    latest = assignment.submissions.create(student=unpublished)
+    other_assignment = course.assignments.create(
+        name="Other",
+        points_possible=10,
+        due=assignment.due,
+        language_details=assignment.language_details,
+    )
+    other_assignment.submissions.create(student=unpublished)
+
+    graded = Submission.objects.graded_per_student(assignment, [student, unpublished, absent])
+    assert set(graded) == {published, latest}
+
+    latest_per_student = assignment.submissions.latest_per_student()
+    assert set(latest_per_student) == {student.submissions.latest(), latest}
+
+
+def test_points_override_total(submission: Submission, teacher):
+    submission.points_received = 100
+    submission.save()
+
+    comment = submission.comments.create(
+        author=teacher, start_char=0, end_char=1, text="Nice", point_override=5
+    )
+    submission.comments.create(
+        author=teacher, start_char=0, end_char=1, text="Also nice", point_override="2.5"
+    )
+    submission.comments.create(author=teacher, start_char=0, end_char=1, text="No override")
+    assert submission.points_override_total == Decimal("7.5")
+    assert submission.points == Decimal("107.5")
+
+    comment.point_override = -10
+    comment.save()
+    comment.delete()
+    submission.refresh_from_db()
+    assert submission.points_override_total == Decimal("2.5")
+
+    # the stored total can be recomputed, and the annotation sums the comments itself
+    Submission.objects.filter(id=submission.id).update(points_override_total=0)
+    annotated = Submission.objects.with_points().get(id=submission.id)
+    assert annotated.points == Decimal("102.5")
+    assert annotated.comment_count == 2
+    Submission.objects.filter(id=submission.id).update_points_override_totals()
+    submission.refresh_from_db()
+    assert submission.point_override == Decimal("2.5")
+
+
+def test_bulk_transitions(assignment, student, django_assert_num_queries):
+    host = grader_host()
+    running = assignment.submissions.create(
+        student=student, grader_pid=os.getpid(), grader_host=host
+    )
+    dead = assignment.submissions.create(student=student, grader_pid=2**22 + 1, grader_host=host)
+    elsewhere = assignment.submissions.create(
+        student=student, grader_pid=2**22 + 1, grader_host="other-host"
+    )
+    done = assignment.submissions.create(student=student, complete=True)
+
+    with django_assert_num_queries(2):
+        assert Submission.objects.reap_dead() == [dead.id]
+    dead.refresh_from_db()
+    assert dead.complete
+    assert dead.grader_pid is None
+    running.refresh_from_db()
+    assert not running.complete
+    elsewhere.refresh_from_db()
+    assert not elsewhere.complete, "Only graders on this host should be checked"
+
+    with django_assert_num_queries(2):
+        rerun_ids = Submission.objects.filter(complete=True).mark_for_rerun()
+    assert sorted(rerun_ids) == sorted([dead.id, done.id])
+    assert not Submission.objects.filter(complete=True).exists()
+    assert Submission.objects.filter(last_run__isnull=False).count() == 2
+
+
+def test_rerun_not_reaped(assignment, student):
+    started = {
+        "complete": True,
+        "grader_pid": 2**22 + 1,
+        "grader_host": grader_host(),
+        "grader_start_time": time.time() - 3600,
+    }
+    bulk = assignment.submissions.create(student=student, **started)
+    single = assignment.submissions.create(student=student, **started)
+
+    # reruns waiting in the queue haven't timed out or died
+    Submission.objects.filter(id=bulk.id).mark_for_rerun()
+    single.rerun()
+    assert Submission.objects.reap_timed_out() == []
+    assert Submission.objects.reap_dead() == []
+    for submission in (bulk, single):
+        submission.refresh_from_db()
+        assert not submission.complete
+        assert submission.grader_start_time is None
+
+
+def test_reap_dead_grader_starting(assignment, student, monkeypatch):
+    started = []
+    list_pids = psutil.pids
+
+    def pids():
+        # a grader starts right after the processes are listed
+        running_pids = list_pids()
+        proc = subprocess.Popen(["sleep", "30"])
+        started.append(proc)
+        assignment.submissions.create(
+            student=student, grader_pid=proc.pid, grader_host=grader_host()
+        )
+        return running_pids
+
+    monkeypatch.setattr(psutil, "pids", pids)
+    try:
+        assert Submission.objects.reap_dead() == []
+        assert not Submission.objects.get(grader_pid=started[0].pid).complete
+    finally:
+        for proc in started:
+            proc.kill()
+            proc.wait()
+
+
+def test_key_queries_use_indexes():
+    # fails if any of the common submission queries doesn't use its index
+    call_command(
+        "benchmark_submission_indexes", count=5000, students=50, assignments=5, stdout=io.StringIO()
+    )
+    assert not Submission.objects.exists(), "The seeded submissions should be rolled back"
+
+
+def test_file_headers(assignment, course, student, django_user_model, django_assert_num_queries):
+    other_course = Course.objects.create(name="Other")
+    course.period_set.create(name="Period 2").students.add(student)
+    other_course.period_set.create(name="Period 7").students.add(student)
+    for i in range(3):
+        classmate = django_user_model.objects.create(username=f"classmate{i}", is_student=True)
+        course.period_set.create(name=f"Period {i + 3}").students.add(classmate)
+        assignment.submissions.create(student=classmate).save_file(f"print({i})")
+    submission = assignment.submissions.create(student=student)
+    submission.save_file("print('Hello World!')")
+
+    # the submissions, then the periods of all their students
+    with django_assert_num_queries(2):
+        headers = {s.id: s.file_header for s in Submission.objects.with_file_headers()}
+    assert headers[submission.id] == Submission.objects.get(id=submission.id).file_header
+    assert "# Period: Period 2\n" in headers[submission.id]
+
+    # changing a stored file is noticed, despite the cache
+    Submission.objects.filter(id=submission.id).update(blob_digest="")
+    submission.refresh_from_db()
+    backup_path = Path(submission.backup_file_path)
+    backup_path.parent.mkdir(parents=True)
+    backup_path.write_text("old", "utf-8")
+    assert submission.file_text == "old"
+    backup_path.write_text("new", "utf-8")
+    os.utime(backup_path, ns=(0, backup_path.stat().st_mtime_ns + 1))
+    assert submission.file_text == "new"
+
+
+def test_file_text_cache_limit(settings, assignment, student):
+    settings.SUBMISSION_TEXT_CACHE_BYTES = 80
+    submissions = [assignment.submissions.create(student=student) for _ in range(3)]
+    for i, submission in enumerate(submissions):
+        submission.save_file(f"print({i})".ljust(10))
+    large = assignment.submissions.create(student=student)
+    large.save_file("x" * 11)
+
+    for submission in [*submissions, large]:
+        assert submission.file_text
+    # the large file isn't cached, and the cache is kept under the limit
+    cached = {path for path, _ in models._text_cache.texts}
+    assert large.stored_file_path() not in cached
+    assert models._text_cache.size <= 80
+    assert submissions[2].stored_file_path() in cached
@@ -0,0 +1,126 @@
+import pytest
+from django.urls import reverse
+
+from tin.apps.courses.models import Course
+from tin.tests import is_redirect, login
+
+from .. import scheduler
+from ..tasks import reap_submissions, run_submission
+
+pytestmark = pytest.mark.usefixtures("grading_queue")
+
+
+@pytest.fixture
+def sent(monkeypatch) -> list[int]:
+    """The ids of the submissions sent to Celery, in order."""
+    sent = []
+    monkeypatch.setattr(run_submission, "apply_async", lambda args: sent.append(args[0]))
+    return sent
+
+
+@pytest.fixture
+def other_assignment(assignment, teacher):
+    course = Course.objects.create(name="Intro to Vulkan")
+    course.teacher.add(teacher)
+    return course.assignments.create(
+        name="Draw a Triangle",
+        points_possible=10,
+        due=assignment.due,
+        language_details=assignment.language_details,
+    )
+
+
+def make_submissions(assignment, student, count: int) -> list:
+    return [assignment.submissions.create(student=student) for _ in range(count)]
+
+
+def test_interactive_lane_goes_first(settings, sent, assignment, student):
+    settings.GRADING_CONCURRENCY_LIMIT = 1
+
+    first, *reruns = make_submissions(assignment, student, 3)
+    scheduler.schedule([first])
+    scheduler.schedule(reruns, lane=scheduler.BULK)
+    submitted = assignment.submissions.create(student=student)
+    scheduler.schedule([submitted])
+    assert sent == [first.id]
+
+    scheduler.finish(first)
+    assert sent == [first.id, submitted.id], "Submissions should not wait behind reruns"
+
+    scheduler.finish(submitted)
+    assert sent == [first.id, submitted.id, reruns[0].id]
+
+
+def test_courses_take_turns(settings, sent, assignment, other_assignment, student):
+    settings.GRADING_COURSE_CONCURRENCY_LIMIT = 2
+    settings.GRADING_CONCURRENCY_LIMIT = 3
+
+    busy = make_submissions(assignment, student, 4)
+    scheduler.schedule(busy, lane=scheduler.BULK)
+    assert sent == [busy[0].id, busy[1].id], "The course limit should be respected"
+
+    other = make_submissions(other_assignment, student, 2)
+    scheduler.schedule(other, lane=scheduler.BULK)
+    assert sent == [busy[0].id, busy[1].id, other[0].id]
+
+    scheduler.finish(busy[0])
+    assert sent[-1] == busy[2].id
+    assert scheduler.queue_depths()[scheduler.BULK] == {
+        "waiting": 2,
+        "running": 3,
+        "courses": {assignment.course_id: 1, other_assignment.course_id: 1},
+    }
+
+
+def test_assignment_limit(settings, sent, assignment, course, student):
+    settings.GRADING_ASSIGNMENT_CONCURRENCY_LIMIT = 1
+    other_assignment = course.assignments.create(
+        name="Write a Fragment Shader",
+        points_possible=10,
+        due=assignment.due,
+        language_details=assignment.language_details,
+    )
+
+    submissions = [
+        *make_submissions(assignment, student, 2),
+        *make_submissions(other_assignment, student, 1),
+    ]
+    scheduler.schedule(submissions)
+    assert sent == [submissions[0].id, submissions[2].id]
+
+
+def test_slots_expire(settings, sent, assignment, student):
+    settings.GRADING_CONCURRENCY_LIMIT = 1
+    settings.GRADING_SLOT_GRACE_PERIOD = -assignment.grader_timeout
+
+    first, second = make_submissions(assignment, student, 2)
+    scheduler.schedule([first, second])
+    assert sent == [first.id]
+
+    # the first submission's worker never finishes it
+    scheduler.dispatch()
+    assert sent == [first.id, second.id]
+
+
+def test_reaper_restarts_stalled_queue(settings, sent, assignment, student):
+    settings.GRADING_CONCURRENCY_LIMIT = 1
+    settings.GRADING_SLOT_GRACE_PERIOD = -assignment.grader_timeout
+
+    first, second = make_submissions(assignment, student, 2)
+    scheduler.schedule([first, second])
+    assert sent == [first.id]
+
+    # nothing is reaped, but the expired slot is still freed
+    reap_submissions()
+    assert sent == [first.id, second.id]
+
+
+@login("teacher")
+def test_rerun_view_uses_bulk_lane(client, settings, sent, assignment, student):
+    settings.GRADING_BULK_CONCURRENCY_LIMIT = 0
+    assignment.submissions.create(student=student, complete=True)
+
+    response = client.post(reverse("assignments:rerun", args=[assignment.id]), {"period": "all"})
+    assert is_redirect(response)
+    assert sent == []
+    assert scheduler.queue_depths()[scheduler.BULK]["waiting"] == 1
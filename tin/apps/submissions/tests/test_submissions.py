@@ -1,18 +1,22 @@
 import json
 import os
+import re
 from typing import TYPE_CHECKING
 
 import psutil
 import pytest
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from tin.tests import is_redirect, login
 
 from ..consumers import SubmissionJsonConsumer
-from ..models import Comment
+from ..models import Comment, Submission, grader_host
+from ..tasks import GraderOutputStream
 
 if TYPE_CHECKING:
     from django.contrib.auth.models import AbstractBaseUser
@@ -20,7 +24,6 @@ if TYPE_CHECKING:
 
     from ...assignments.models import Assignment
     from ...courses.models import Course
-    from ..models import Submission
 
 
 @login("student")
@@ -147,6 +150,7 @@ def test_set_aborted_complete_invalid_pid(client: Client, submission: Submission
     submission.complete = False
     # on linux x64, 2^22 is the max PID so 2^22+1 should always not exist
     submission.grader_pid = 2**22 + 1
+    submission.grader_host = grader_host()
     submission.save()
 
     client.post(reverse("submissions:set_aborted_complete"))
@@ -163,6 +167,90 @@ def test_set_aborted_complete_valid_pid(client: Client, submission: Submission):
     assert not submission.complete, "Should not mark submission as complete while running"
 
 
+@login("admin")
+def test_filter_view_code(client: Client, settings, assignment: Assignment, student):
+    settings.SUBMISSION_FILTER_CODE_PAGE_SIZE = 3
+    settings.SUBMISSION_FILTER_CODE_READ_THREADS = 2
+    settings.SUBMISSION_FILTER_CODE_BYTE_LIMIT = 30
+    for i in range(5):
+        assignment.submissions.create(student=student).save_file(f"print('submission {i}')")
+
+    async def read(response) -> str:
+        return b"".join([chunk async for chunk in response.streaming_content]).decode()
+
+    def view_code(start):
+        response = client.post(reverse("submissions:filter"), {"limit": "", "code_start": start})
+        assert response.streaming
+        assert response.is_async
+        return async_to_sync(read)(response)
+
+    page = view_code(0)
+    # the first two fill the page's byte limit, so the next page starts with the third
+    assert "Showed submissions 1 to 2 of 5." in page
+    assert page.rstrip().endswith("</html>")
+
+    # following Next shows every submission once
+    pages = []
+    start = 0
+    while start is not None:
+        page = view_code(start)
+        pages.append([i for i in range(5) if f"submission {i}" in page])
+        next_start = re.search(r'name="code_start" value="(\d+)">\s*Next', page)
+        start = int(next_start[1]) if next_start else None
+    assert pages == [[0, 1], [2, 3], [4]]
+    assert re.search(r'name="code_start" value="1">\s*Previous', page)
+
+
+@login("admin")
+def test_filter_latest_and_published(
+    client: Client, settings, assignment: Assignment, student, django_user_model
+):
+    settings.SUBMISSION_FILTER_PAGE_SIZE = 3
+    classmate = django_user_model.objects.create(username="classmate", is_student=True)
+    published, latest = (assignment.submissions.create(student=student) for _ in range(2))
+    published.publish()
+    classmate_latest = assignment.submissions.create(student=classmate)
+
+    def filter_ids(**data) -> list[int]:
+        response = client.post(
+            reverse("submissions:filter"), {"limit": "", "list_submissions": "1", **data}
+        )
+        ids = [s.id for s in response.context["page"]]
+        assert response.context["page"].paginator.count == len(ids)
+        return ids
+
+    def expected(predicate) -> list[int]:
+        return [s.id for s in Submission.objects.order_by("id") if predicate(s)]
+
+    assert filter_ids(is_latest="on") == expected(lambda s: s.is_latest)
+    assert filter_ids(is_latest="on") == [latest.id, classmate_latest.id]
+    assert filter_ids(is_published="on") == expected(lambda s: s.is_latest_publish)
+    assert filter_ids(is_latest_publish="on") == expected(
+        lambda s: s.is_latest or s.is_latest_publish
+    )
+    # whether a submission is the latest doesn't depend on the other filters
+    assert filter_ids(is_latest="on", students=[student.id]) == [latest.id]
+    assert filter_ids(is_latest="on", end_date=published.date_submitted) == []
+
+    def get_page(number, **data):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(
+                reverse("submissions:filter"), {"limit": "", "list_page": number, **data}
+            )
+        return response.context["page"], len(queries)
+
+    _, num_queries = get_page(1, is_latest_publish="on")
+    for _ in range(5):
+        newest = assignment.submissions.create(student=classmate)
+    page, new_num_queries = get_page(1, is_latest_publish="on")
+    assert new_num_queries == num_queries, "The filter should not query once per submission"
+    assert [s.id for s in page] == [published.id, latest.id, newest.id]
+
+    page, _ = get_page(3)
+    assert page.number == 3
+    assert len(page) == 2
+
+
 @login("admin")
 def test_set_past_timeout_complete_view(
     client: Client, assignment: Assignment, submission: Submission
@@ -223,11 +311,6 @@ def test_delete_comment_rejects_get(client: Client, submission: Submission, teac
 # classmate's submission (including quizzes). ---
 
 
-@pytest.fixture
-def in_memory_channels(settings):
-    settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
-
-
 def _try_ws_connect(user, submission):
     """Drive the consumer directly with the scope the routing layer would supply."""
 
@@ -258,6 +341,15 @@ def test_ws_teacher_can_watch(in_memory_channels, submission, teacher):
     assert connected
 
 
+@pytest.mark.django_db(transaction=True)
+def test_ws_connect_queries(in_memory_channels, submission, teacher, django_assert_num_queries):
+    # one query for the submission and the permission check
+    with django_assert_num_queries(1):
+        connected, payload = _try_ws_connect(teacher, submission)
+    assert connected
+    assert payload["type"] == "snapshot"
+
+
 @pytest.mark.django_db(transaction=True)
 def test_ws_classmate_cannot_watch(in_memory_channels, submission, course, django_user_model):
     classmate = django_user_model.objects.create(username="classmate", is_student=True)
@@ -274,3 +366,38 @@ def test_ws_classmate_cannot_watch_quiz(
     course.students.add(classmate)
     connected, payload = _try_ws_connect(classmate, quiz_submission)
     assert not connected, f"classmate must not read a quiz submission; got {payload!r}"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_ws_output_deltas(in_memory_channels, submission, student):
+    """Output arrives as numbered deltas, and a resync returns the live snapshot."""
+    submission.complete = False
+    submission.save()
+
+    async def scenario():
+        communicator = WebsocketCommunicator(
+            SubmissionJsonConsumer.as_asgi(), f"/submissions/{submission.id}.json"
+        )
+        communicator.scope["user"] = student
+        communicator.scope["url_route"] = {"kwargs": {"submission_id": submission.id}}
+        await communicator.connect()
+        snapshot = await communicator.receive_json_from()
+
+        with GraderOutputStream(submission) as stream:
+            stream.write(output="hello", errors="secret")
+            await sync_to_async(stream.flush)()
+            delta = await communicator.receive_json_from()
+
+            await communicator.send_json_to({"type": "request-info"})
+            resync = await communicator.receive_json_from()
+
+        await communicator.disconnect()
+        return snapshot, delta, resync
+
+    snapshot, delta, resync = async_to_sync(scenario)()
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["seq"] == 0
+    assert delta == {"type": "output", "seq": 1, "grader_output": "hello"}
+    assert resync["seq"] == 1
+    assert resync["grader_output"] == "hello"
+    assert "grader_errors" not in resync
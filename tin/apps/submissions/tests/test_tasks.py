@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from tin.apps.assignments.models import Assignment
+
+from .. import scheduler
+from ..grader_pool import get_grader_pool
+from ..models import Submission, grader_host
+from ..tasks import GraderOutputStream, aget_live_output, reap_submissions, run_submission
+
+pytestmark = pytest.mark.usefixtures("grading_queue")
+
+
+def test_run_submission(in_memory_channels, assignment, submission: Submission):
+    assignment.save_grader_file("print('Hello from the grader')\nprint('Score: 50%')")
+    submission.create_backup_copy("print('Hello World!')")
+
+    run_submission(submission.id)
+    submission.refresh_from_db()
+
+    assert submission.complete
+    assert submission.has_been_graded
+    assert submission.points_received == Decimal(150)
+    assert submission.grader_output == "Hello from the grader\nScore: 50%\n"
+    assert submission.grader_pid is None
+
+
+def test_run_submission_keeps_point_overrides(
+    in_memory_channels, monkeypatch, assignment, submission: Submission, teacher
+):
+    assignment.save_grader_file("print('Score: 50%')")
+    submission.create_backup_copy("print('Hello World!')")
+
+    grader_version = Assignment.grader_version
+
+    def add_override(self):
+        # a teacher comments while the submission is being graded
+        submission.comments.create(
+            author=teacher, start_char=0, end_char=1, text="Nice", point_override=5
+        )
+        return grader_version(self)
+
+    monkeypatch.setattr(Assignment, "grader_version", add_override)
+    run_submission(submission.id)
+    submission.refresh_from_db()
+
+    assert submission.complete
+    assert submission.points_override_total == Decimal(5)
+
+
+def test_run_submission_kill(in_memory_channels, assignment, submission: Submission):
+    assignment.save_grader_file("import time\nprint('Started', flush=True)\ntime.sleep(60)")
+    submission.create_backup_copy("print('Hello World!')")
+
+    # keep asking until the task has subscribed to the control channel
+    done = threading.Event()
+
+    def kill():
+        with redis.Redis.from_url(settings.SUBMISSION_REDIS_URL) as conn:
+            while not done.wait(0.1):
+                conn.publish(submission.control_channel_name, "kill")
+
+    killer = threading.Thread(target=kill)
+    killer.start()
+    start = time.monotonic()
+    try:
+        run_submission(submission.id)
+    finally:
+        done.set()
+        killer.join()
+
+    assert time.monotonic() - start < 30
+    submission.refresh_from_db()
+    assert submission.complete
+    assert submission.kill_requested
+    assert not submission.has_been_graded
+    assert submission.grader_output.endswith("[Grader killed]")
+
+
+def test_output_stream_batches_output(in_memory_channels, settings, submission: Submission):
+    settings.SUBMISSION_OUTPUT_FLUSH_INTERVAL = 1000
+    settings.SUBMISSION_OUTPUT_FLUSH_SIZE = 10
+
+    layer = get_channel_layer()
+    channel = async_to_sync(layer.new_channel)()
+    async_to_sync(layer.group_add)(submission.channel_group_name, channel)
+
+    stream = GraderOutputStream(submission)
+    stream.write(output="hello")
+    stream.maybe_flush()
+    assert stream.pending == 5, "Output below the flush size should be buffered"
+
+    stream.write(output=" world", errors="oops")
+    stream.maybe_flush()
+    assert stream.pending == 0
+
+    event = async_to_sync(layer.receive)(channel)
+    assert event["type"] == "submission.message"
+    message = json.loads(event["text"])
+    assert message == {
+        "type": "output",
+        "seq": 1,
+        "grader_output": "hello world",
+        "grader_errors": "oops",
+    }
+    assert "grader_errors" not in json.loads(event["public_text"])
+    assert async_to_sync(aget_live_output)(submission)["grader_output"] == "hello world"
+
+    submission.refresh_from_db()
+    assert submission.grader_output == "", "Flushing should not write to the database"
+
+    stream.write(output="!")
+    stream.checkpoint()
+    submission.refresh_from_db()
+    assert submission.grader_output == "hello world!"
+    assert submission.grader_errors == "oops"
+    message = json.loads(async_to_sync(layer.receive)(channel)["text"])
+    assert message["seq"] == 2
+    assert message["grader_output"] == "!"
+
+    stream.__exit__(None, None, None)
+    assert async_to_sync(aget_live_output)(submission) is None
+
+
+def test_run_submission_warm(settings, in_memory_channels, assignment, student):
+    settings.GRADER_POOL_ENABLED = True
+    assignment.save_grader_file(
+        "import sys\nprint(sys.stdin.read() == '', sys.argv[3])\nprint('Score: 50%')"
+    )
+
+    try:
+        for _ in range(2):
+            submission = assignment.submissions.create(student=student)
+            submission.save_file("print('Hello World!')")
+            submission.create_backup_copy("print('Hello World!')")
+            run_submission(submission.id)
+            submission.refresh_from_db()
+
+            assert submission.grader_output == "True student\nScore: 50%\n"
+            assert submission.points_received == Decimal(150)
+
+        spares = get_grader_pool()._spares
+        assert sum(len(s) for s in spares.values()) == 1, "A spare should be kept ready"
+    finally:
+        get_grader_pool().close()
+
+
+def test_run_submission_cached(in_memory_channels, assignment, student):
+    assignment.cache_grader_results = True
+    assignment.save()
+    assignment.save_grader_file("import random\nprint(random.random())\nprint('Score: 50%')")
+
+    def grade():
+        submission = assignment.submissions.create(student=student)
+        submission.save_file("print('Hello World!')")
+        submission.create_backup_copy("print('Hello World!')")
+        run_submission(submission.id)
+        submission.refresh_from_db()
+        assert submission.complete
+        assert submission.points_received == Decimal(150)
+        return submission
+
+    first = grade()
+    second = grade()
+    assert not first.graded_from_cache
+    assert second.graded_from_cache
+    assert second.grader_output == first.grader_output
+
+    assignment.save_grader_file("import random\nprint(random.random())\nprint('Score: 50%')\n")
+    third = grade()
+    assert not third.graded_from_cache, "Changing the grader should not reuse old results"
+    assert third.grader_output != first.grader_output
+
+
+def test_reap_submissions(in_memory_channels, assignment, student):
+    dead = assignment.submissions.create(
+        student=student, grader_pid=2**22 + 1, grader_host=grader_host()
+    )
+    timed_out = assignment.submissions.create(
+        student=student, grader_pid=os.getpid(), grader_start_time=time.time() - 3600
+    )
+    running = assignment.submissions.create(
+        student=student, grader_pid=os.getpid(), grader_start_time=time.time()
+    )
+
+    layer = get_channel_layer()
+    channel = async_to_sync(layer.new_channel)()
+    async_to_sync(layer.group_add)(dead.channel_group_name, channel)
+
+    reap_submissions()
+
+    assert set(Submission.objects.filter(complete=True).values_list("id", flat=True)) == {
+        dead.id,
+        timed_out.id,
+    }
+    message = json.loads(async_to_sync(layer.receive)(channel)["text"])
+    assert message["type"] == "snapshot"
+    assert message["complete"]
+    assert scheduler.reaped_totals() == {"dead": 1, "timed_out": 1}
+
+    reap_submissions()
+    assert scheduler.reaped_totals() == {"dead": 1, "timed_out": 1}
+    running.refresh_from_db()
+    assert not running.complete
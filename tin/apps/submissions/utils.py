@@ -1,11 +1,23 @@
+import zipfile
+from collections import deque
+from collections.abc import AsyncIterator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
+from asgiref.sync import sync_to_async
+
 
 def decimal_repr(d: Decimal) -> Decimal:
     return d.quantize(Decimal(1)) if d == d.to_integral() else d.normalize()
 
 
-def serialize_submission_info(submission, user) -> dict[str, float | str | bool | None]:
+def serialize_submission_info(submission, user=None) -> dict[str, float | str | bool | None]:
+    """Serialize the live-updating fields of a submission.
+
+    ``grader_errors`` is only included if ``user`` is a teacher or superuser. If no user
+    is given it is always included, for messages that are sent to every watcher (see
+    :func:`.tasks.send_submission_message`).
+    """
     data = {
         "grader_output": submission.grader_output,
         "has_been_graded": submission.has_been_graded,
@@ -24,9 +36,125 @@ def serialize_submission_info(submission, user) -> dict[str, float | str | bool
         ),
         "grade_percent": submission.grade_percent,
         "formatted_grade": submission.formatted_grade,
+        "graded_from_cache": submission.graded_from_cache,
     }
 
-    if user.is_teacher or user.is_superuser:
+    if user is None or can_see_grader_errors(user):
         data["grader_errors"] = submission.grader_errors
 
     return data
+
+
+def can_see_grader_errors(user) -> bool:
+    return user.is_teacher or user.is_superuser
+
+
+class _ZipStream:
+    """A write-only file that keeps what is written to it until it is taken.
+
+    :class:`zipfile.ZipFile` can write to unseekable files like this one, so an
+    archive can be sent while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def aiter_sync[T](iterator: Iterator[T]) -> AsyncIterator[T]:
+    """Yield the items of a synchronous iterator, getting each one with ``sync_to_async``.
+
+    Daphne reads a synchronous iterator given to a :class:`~django.http.StreamingHttpResponse`
+    to the end before sending any of it, so responses that should be streamed wrap
+    their iterators in this.
+    """
+    done = object()
+    try:
+        while (item := await sync_to_async(next)(iterator, done)) is not done:
+            yield item
+    finally:
+        if close := getattr(iterator, "close", None):
+            await sync_to_async(close)()
+
+
+def iter_file_chunks(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Read a file ``chunk_size`` bytes at a time."""
+    with open(path, "rb") as f_obj:
+        while chunk := f_obj.read(chunk_size):
+            yield chunk
+
+
+def iter_submissions_zip(
+    submissions: Iterable, extension: str, chunk_size: int = 64 * 1024
+) -> Iterator[bytes]:
+    """Build a zip archive of submissions, yielding it a chunk at a time.
+
+    Each submission is added as ``<username>.<extension>``, with its file header, and
+    its file is read ``chunk_size`` bytes at a time, so the whole archive is never
+    held in memory.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for submission in submissions:
+            if not submission.file:
+                continue
+
+            with zf.open(f"{submission.student.username}.{extension}", "w") as f:
+                f.write((submission.file_header + "\n\n").encode())
+                try:
+                    with submission.open_file() as submission_file:
+                        while chunk := submission_file.read(chunk_size):
+                            f.write(chunk)
+                            yield stream.take()
+                except OSError:
+                    f.write(b"[Error accessing submission file]")
+
+            yield stream.take()
+
+    yield stream.take()
+
+
+def iter_file_texts(
+    submissions: Iterable, *, threads: int, byte_limit: int
+) -> Iterator[tuple[object, str]]:
+    """Read the code of submissions with a pool of threads, yielding them in order.
+
+    Up to ``threads`` files are read ahead of the one being yielded. Once ``byte_limit``
+    bytes of code have been yielded, this stops without reading the rest of the
+    submissions, so fewer submissions than were passed may be yielded (but always at
+    least one).
+    """
+    executor = ThreadPoolExecutor(max_workers=threads)
+    pending = deque()
+    total = 0
+
+    def take():
+        nonlocal total
+        submission, future = pending.popleft()
+        text = future.result()
+        if text:
+            total += len(text.encode())
+        return submission, text
+
+    try:
+        for submission in submissions:
+            if total >= byte_limit:
+                return
+            pending.append((submission, executor.submit(lambda s=submission: s.file_text)))
+            if len(pending) > threads:
+                yield take()
+        while pending and total < byte_limit:
+            yield take()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
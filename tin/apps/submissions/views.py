@@ -1,15 +1,19 @@
-import psutil
+import uuid
+
+from asgiref.sync import sync_to_async
 from django import http
-from django.db.models import F
+from django.conf import settings
+from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
+from django.template.loader import render_to_string
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.http import require_POST
 
 from ..auth.decorators import login_required, superuser_required, teacher_or_superuser_required
+from . import scheduler
 from .forms import CommentForm, FilterForm
 from .models import Comment, Submission
-from .utils import serialize_submission_info
+from .utils import iter_file_texts, serialize_submission_info
 
 # Create your views here.
 
@@ -41,9 +45,9 @@ def show_view(request, submission_id):
         "submission_number": submission_number,
         "submission_text": submission.file_text,
         "submission_comments": submission.comments.all(),
-        "submissions": submissions.order_by("-date_submitted"),
+        "submissions": submissions.with_points().order_by("-date_submitted"),
         "is_student": submission.assignment.course.is_student_in_course(request.user),
-        "is_teacher": request.user in submission.assignment.course.teacher.all(),
+        "is_teacher": submission.assignment.course.is_teacher_in_course(request.user),
     }
 
     if request.user.is_teacher or request.user.is_superuser:
@@ -103,8 +107,7 @@ def kill_view(request, submission_id):
     )
 
     if request.method == "POST":
-        submission.kill_requested = True
-        submission.save()
+        submission.request_kill()
         next_url = request.GET.get("next")
         if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts=None):
             return redirect(next_url)
@@ -127,7 +130,8 @@ def rerun_view(request, submission_id):
         Submission.objects.filter_visible(request.user), id=submission_id
     )
 
-    submission.rerun().apply_async()
+    submission.rerun()
+    scheduler.schedule([submission])
     return redirect("submissions:show", submission.id)
 
 
@@ -224,7 +228,7 @@ def delete_comment_view(request, submission_id, comment_id):
     comment = get_object_or_404(submission.comments.all(), id=comment_id)
     course = submission.assignment.course
 
-    if not course.teacher.filter(id=request.user.id).exists() and not request.user.is_superuser:
+    if not course.is_teacher_in_course(request.user) and not request.user.is_superuser:
         raise http.Http404
 
     comment.delete()
@@ -277,32 +281,91 @@ def filter_view(request):
         if filter_form.is_valid():
             queryset = filter_form.get_results()
 
-            if "list_submissions" in request.POST:
+            queryset = queryset.select_related(
+                "assignment__course", "assignment__folder", "student"
+            )
+
+            # the page buttons are named after the view they page through
+            if "list_submissions" in request.POST or "list_page" in request.POST:
+                page = Paginator(queryset, settings.SUBMISSION_FILTER_PAGE_SIZE).get_page(
+                    request.POST.get("list_page")
+                )
                 return render(
                     request,
                     "submissions/filter.html",
                     {
                         "form": filter_form,
-                        "submissions": queryset,
+                        "page": page,
+                        "page_field": "list_page",
                         "action": "show",
                         "nav_item": "Filter submissions",
                     },
                 )
-            elif "view_code" in request.POST:
-                submission_texts = []
-                for submission in queryset:
-                    submission_texts.append(submission.file_text)
-
-                return render(
-                    request,
+            elif "view_code" in request.POST or "code_start" in request.POST:
+                # A page of code ends early once it is SUBMISSION_FILTER_CODE_BYTE_LIMIT
+                # bytes long, so pages start at an offset instead of a page number, and
+                # the next page starts with the first submission left out of this one
+                try:
+                    start = max(int(request.POST.get("code_start", 0)), 0)
+                except ValueError:
+                    start = 0
+                page_size = settings.SUBMISSION_FILTER_CODE_PAGE_SIZE
+                context = {
+                    "form": filter_form,
+                    "count": queryset.count(),
+                    "code_start": start,
+                    "previous_start": max(start - page_size, 0) if start else None,
+                }
+
+                # The page is sent in pieces, so each submission's code is shown as soon
+                # as it's read, instead of after all of them are
+                marker = f"<!-- code-{uuid.uuid4().hex} -->"
+                head, tail = render_to_string(
                     "submissions/filter.html",
                     {
-                        "form": filter_form,
-                        "submissions": list(zip(queryset, submission_texts, strict=False)),
+                        **context,
+                        "code_marker": marker,
                         "action": "show_code",
                         "nav_item": "Filter submissions",
                     },
+                    request,
+                ).split(marker)
+
+                texts = iter_file_texts(
+                    queryset[start : start + page_size],
+                    threads=settings.SUBMISSION_FILTER_CODE_READ_THREADS,
+                    byte_limit=settings.SUBMISSION_FILTER_CODE_BYTE_LIMIT,
                 )
+                shown = 0
+
+                def render_next() -> str | None:
+                    nonlocal shown
+                    item = next(texts, None)
+                    if item is None:
+                        return None
+                    shown += 1
+                    submission, submission_text = item
+                    return render_to_string(
+                        "submissions/filter_code.html",
+                        {"submission": submission, "submission_text": submission_text},
+                    )
+
+                # Daphne only streams asynchronous iterators (it reads synchronous ones
+                # to the end first), so the blocking reads are done in a thread
+                async def stream():
+                    yield head
+                    try:
+                        while (block := await sync_to_async(render_next)()) is not None:
+                            yield block
+                    finally:
+                        await sync_to_async(texts.close)()
+                    yield render_to_string(
+                        "submissions/filter_code_pages.html",
+                        {**context, "code_end": start + shown},
+                    )
+                    yield tail
+
+                return http.StreamingHttpResponse(stream())
 
     filter_form = FilterForm()
 
@@ -323,19 +386,13 @@ def set_aborted_complete_view(request):
     """Check if a submission is running.
 
     This also marks all non-running incomplete submissions
-    as completed.
+    as completed, of those graded on the same host as this view.
 
     Args:
         request: The request
     """
     if request.method == "POST":
-        submissions = Submission.objects.filter(complete=False, grader_pid__isnull=False)
-
-        for submission in submissions:
-            if not psutil.pid_exists(submission.grader_pid):
-                submission.complete = True
-                submission.grader_pid = None
-                submission.save(update_fields=["complete", "grader_pid"])
+        Submission.objects.reap_dead()
 
     return redirect("auth:index")
 
@@ -350,12 +407,6 @@ def set_past_timeout_complete_view(request):
         request: The request
     """
     if request.method == "POST":
-        Submission.objects.filter(
-            complete=False,
-            grader_start_time__isnull=False,
-            assignment__enable_grader_timeout=True,
-            grader_start_time__lte=timezone.localtime().timestamp()
-            - F("assignment__grader_timeout"),
-        ).update(complete=True)
+        Submission.objects.reap_timed_out()
 
     return redirect("auth:index")
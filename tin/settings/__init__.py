@@ -255,6 +255,33 @@ else:
 
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# The cache is kept on the same Redis server
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CELERY_BROKER_URL,
+        "KEY_PREFIX": "tin",
+    }
+}
+
+# Tasks run by ``celery -A tin beat``
+CELERY_BEAT_SCHEDULE = {
+    # mark the submissions whose grader died or timed out as complete, every minute
+    "reap-submissions": {
+        "task": "tin.apps.submissions.tasks.reap_submissions",
+        "schedule": 60,
+    },
+    # remove the submission archives that are older than SUBMISSION_ARCHIVE_MAX_AGE, every hour
+    "remove-old-submission-archives": {
+        "task": "tin.apps.assignments.tasks.remove_old_submission_archives",
+        "schedule": 60 * 60,
+    },
+}
+
+# Running graders subscribe to a pub/sub channel on this Redis server to find out
+# when they should be killed, and keep a snapshot of their live output there
+SUBMISSION_REDIS_URL = CELERY_BROKER_URL
+
 
 # Markdown
 MARKDOWNIFY = {
@@ -318,6 +345,11 @@ DEBUG_TOOLBAR_CONFIG = {
 
 SUBMISSION_SIZE_LIMIT = 1 * 1000 * 1000  # 1 MB
 
+# How many bytes of submissions' code each process keeps in memory, for downloads and
+# exports. Every web and Celery worker process has its own cache, so this is the memory
+# used by each of them. Files larger than an eighth of this aren't cached.
+SUBMISSION_TEXT_CACHE_BYTES = 16 * 1000 * 1000  # 16 MB
+
 DEVELOPER_EMAIL = "tin@tjhsst.edu"
 REPO_URL = "https://github.com/tjcsl/tin"
 
@@ -330,12 +362,67 @@ DEBUG_GRADER_WRAPPER_SCRIPT = Path(BASE_DIR).parent / "scripts" / "grader_wrappe
 
 SUBMISSION_NAMESERVERS = ["198.38.16.40", "198.38.16.41"]
 
+# The ids of the courses each user teaches or takes are cached for this long (in seconds),
+# though they are also invalidated when they change (see courses/membership.py)
+COURSE_MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+
 # Users may only have this many submissions running
 CONCURRENT_USER_SUBMISSION_LIMIT = 2
 
+# Running graders send new output to live watchers at most this often (in seconds),
+# or as soon as this many characters are waiting
+SUBMISSION_OUTPUT_FLUSH_INTERVAL = 0.25
+SUBMISSION_OUTPUT_FLUSH_SIZE = 8 * 1024
+
+# How often (in seconds) the output of a running grader is saved to the database
+SUBMISSION_OUTPUT_CHECKPOINT_INTERVAL = 5
+
+# Grading is scheduled so that no course can starve the others (see submissions/scheduler.py).
+# At most this many submissions are graded at once,
+GRADING_CONCURRENCY_LIMIT = 16
+# of which at most this many can be bulk reruns, leaving room for students' submissions,
+GRADING_BULK_CONCURRENCY_LIMIT = 12
+# and at most this many can be from one course, or for one assignment
+GRADING_COURSE_CONCURRENCY_LIMIT = 8
+GRADING_ASSIGNMENT_CONCURRENCY_LIMIT = 6
+
+# A submission gives up its grading slot this long (in seconds) after its grader should
+# have timed out, in case its worker died
+GRADING_SLOT_GRACE_PERIOD = 5 * 60
+
+# The prefix of the scheduler's keys on the SUBMISSION_REDIS_URL server
+GRADING_QUEUE_PREFIX = "grading"
+
+# Keep interpreters running ahead of time to run graders in (see submissions/grader_pool.py).
+# They are sandboxed before the submission is known, so the grader isn't denied writing to
+# the submission file and wrapper (the submission itself is still sandboxed by the wrapper).
+GRADER_POOL_ENABLED = False
+# Spares kept per assignment, and per worker process in total
+GRADER_POOL_SIZE = 1
+GRADER_POOL_MAX_IDLE = 8
+# Spares are stopped when they haven't been used for this long (in seconds)
+GRADER_POOL_IDLE_TIMEOUT = 10 * 60
+GRADER_POOL_SCRIPT = Path(BASE_DIR).parent / "scripts" / "warm_grader.py"
+
+# Code downloads of more submissions than this are built by a Celery task,
+# and kept for this many seconds
+SUBMISSION_ARCHIVE_BACKGROUND_THRESHOLD = 500
+SUBMISSION_ARCHIVE_MAX_AGE = 24 * 60 * 60
+
+# The submission filter lists this many submissions per page. It shows the code of this many
+# per page, read ahead by this many threads, and ends a page early (leaving the rest for the
+# next page) once it has shown this many bytes of code
+SUBMISSION_FILTER_PAGE_SIZE = 100
+SUBMISSION_FILTER_CODE_PAGE_SIZE = 50
+SUBMISSION_FILTER_CODE_READ_THREADS = 8
+SUBMISSION_FILTER_CODE_BYTE_LIMIT = 5 * 1000 * 1000
+
 # Threshold for log messages being issues
 QUIZ_ISSUE_THRESHOLD = 5
 
+# The quiz page reports at most this many log messages in one request
+QUIZ_REPORT_BATCH_LIMIT = 100
+
 # Maximum size of uploaded images in bytes
 MAX_UPLOADED_IMAGE_SIZE = float("inf")
 
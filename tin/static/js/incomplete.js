@@ -12,6 +12,44 @@ function filter_incomplete_by_endpoint(endpoint) {
 
 var websockets = {};
 
+// The latest state of each submission being watched over a websocket. The server
+// sends a full snapshot when we connect, then only the new output as numbered deltas.
+var states = {};
+
+// Same limits as the server (Submission.grader_output/grader_errors)
+var MAX_LENGTHS = {grader_output: 10 * 1024, grader_errors: 4 * 1024};
+
+function truncate_output(text, key) {
+  var max_len = MAX_LENGTHS[key];
+  return text.length > max_len ? '...' + text.slice(-max_len + 5) : text;
+}
+
+function handle_message(endpoint, sock, data) {
+  if (data.type == 'output') {
+    var state = states[endpoint];
+    if (state === undefined || state.resyncing || data.seq <= state.seq) {
+      // Waiting for a snapshot, or already included in the last one
+      return;
+    }
+    if (data.seq != state.seq + 1) {
+      // We missed a delta; start over from a fresh snapshot
+      state.resyncing = true;
+      sock.send(JSON.stringify({type: 'request-info'}));
+      return;
+    }
+    state.seq = data.seq;
+    for (var key of ['grader_output', 'grader_errors']) {
+      if (data[key] !== undefined) {
+        state.data[key] = truncate_output((state.data[key] || '') + data[key], key);
+      }
+    }
+    handle_data(endpoint, state.data);
+  } else {
+    states[endpoint] = {seq: data.seq, data: data, resyncing: false};
+    handle_data(endpoint, data);
+  }
+}
+
 function create_websocket(endpoint) {
   var ws_endpoint = join_url(
     location.protocol + '//' + location.host,
@@ -20,13 +58,14 @@ function create_websocket(endpoint) {
   var sock = new WebSocket(ws_endpoint);
   sock.onmessage = function (e) {
     data = JSON.parse(e.data);
-    handle_data(endpoint, data);
+    handle_message(endpoint, sock, data);
     if (filter_incomplete_by_endpoint(endpoint).get().length == 0) {
       sock.close();
     }
   };
   sock.onclose = function (e) {
     websockets[endpoint] = false;
+    delete states[endpoint];
   };
   websockets[endpoint] = sock;
 }
@@ -10,6 +10,7 @@
 //   <a href="#" data-post-action="{% url '...' %}">Label</a>
 //   <a href="#" data-post-action="{% url '...' %}"
 //      data-period-from="#assignment-action-period-select">Rerun</a>
+//   <a href="#" data-post-action="{% url '...' %}" data-post-fields="stale=1">Rerun</a>
 (function () {
   function getCookie(name) {
     var match = document.cookie.match('(^|;)\\s*' + name + '\\s*=\\s*([^;]+)');
@@ -42,6 +43,19 @@
       }).appendTo($form);
     }
 
+    // Optionally send fixed POST fields, given as `name=value&name=value`.
+    var fields = $link.attr('data-post-fields');
+    if (fields) {
+      fields.split('&').forEach(function (field) {
+        var parts = field.split('=');
+        $('<input>', {
+          type: 'hidden',
+          name: decodeURIComponent(parts[0]),
+          value: decodeURIComponent(parts.slice(1).join('=')),
+        }).appendTo($form);
+      });
+    }
+
     $form.appendTo(document.body);
     $form.get(0).submit();
   });
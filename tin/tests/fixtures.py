@@ -1,8 +1,11 @@
 import platform
 import sys
+import uuid
 from pathlib import Path
 
 import pytest
+import redis
+from django.core.cache import cache
 from django.utils import timezone
 
 import tin.tests.create_users as users
@@ -25,6 +28,29 @@ def create_users(request, db):
         users.add_users_to_database(password=PASSWORD, verbose=False)
 
 
+@pytest.fixture(autouse=True)
+def local_cache(settings):
+    """Give each test its own empty cache, in memory instead of Redis."""
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    cache.clear()
+
+
+@pytest.fixture
+def grading_queue(settings):
+    """Give the test its own grading queue, for tests that schedule or run submissions."""
+    settings.GRADING_QUEUE_PREFIX = f"test-grading-{uuid.uuid4()}"
+    yield
+    with redis.Redis.from_url(settings.SUBMISSION_REDIS_URL) as conn:
+        for key in conn.scan_iter(f"{settings.GRADING_QUEUE_PREFIX}:*"):
+            conn.delete(key)
+
+
+@pytest.fixture
+def in_memory_channels(settings):
+    """Use an in-memory channel layer instead of Redis."""
+    settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
 @pytest.fixture
 def admin(django_user_model):
     """Fixture to pass in an Admin user into a test
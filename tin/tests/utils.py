@@ -1,6 +1,7 @@
 __all__ = (
     "login",
     "model_to_dict",
+    "read_streaming",
     "str_to_html",
     "to_html",
 )
@@ -9,6 +10,7 @@ from collections.abc import Callable
 from typing import TYPE_CHECKING, Any, Literal, ParamSpec, TypeVar
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.template import Context, Engine
 
 if TYPE_CHECKING:
@@ -103,3 +105,19 @@ def model_to_dict(model: models.Model, *, remove_relations: bool = True) -> dict
         if value is not None:
             data[field.name] = value
     return data
+
+
+def read_streaming(response) -> bytes:
+    """Read all of a streaming response that is served asynchronously.
+
+    .. code-block::
+
+        response = client.get(reverse("assignments:download_submissions", args=[1]))
+        content = read_streaming(response)
+    """
+    assert response.is_async, "The response would be read into memory before it is sent"
+
+    async def read():
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(read)()